@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark della classificazione: vecchi loop di parole chiave e
+select_one() contro il matcher precompilato di matcher.py
+
+Uso: python benchmarks/bench_matcher.py [--size-kb 1500] [--repeat 20]
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from matcher import LANGUAGE_KEYWORDS, find_price, find_title, get_matcher  # noqa: E402
+
+
+# --- Implementazione precedente, copiata per il confronto ---
+
+def legacy_title(soup):
+    for selector in ['h1', 'title', '.product-title', '.product-name',
+                     '.item-title', '#product-title', '.entry-title']:
+        title_elem = soup.select_one(selector)
+        if title_elem and title_elem.get_text(strip=True):
+            return title_elem.get_text(strip=True)
+    return ''
+
+
+def legacy_price(soup):
+    for selector in ['.price', '.cost', '.amount', '.valor', '.prezzo',
+                     '[class*="price"]', '[class*="cost"]', '[id*="price"]',
+                     '.product-price', '.regular-price', '.sale-price']:
+        price_elem = soup.select_one(selector)
+        if price_elem:
+            price_match = re.search(r'[\€\$\£\¥]\s*(\d+(?:[.,]\d+)?)|(\d+(?:[.,]\d+)?)\s*[\€\$\£\¥]',
+                                    price_elem.get_text(strip=True))
+            if price_match:
+                return price_match.group(0)
+    return None
+
+
+def legacy_availability(page_text):
+    unavailable_keywords = [
+        'esaurito', 'non disponibile', 'out of stock', 'sold out',
+        'temporarily unavailable', 'currently unavailable', 'fuori stock',
+        'prodotto terminato', 'non in magazzino'
+    ]
+    available_keywords = [
+        'disponibile', 'in stock', 'available', 'aggiungi al carrello',
+        'add to cart', 'buy now', 'acquista ora', 'in magazzino'
+    ]
+    page_text_lower = page_text.lower()
+    for keyword in unavailable_keywords:
+        if keyword in page_text_lower:
+            return False
+    for keyword in available_keywords:
+        if keyword in page_text_lower:
+            return True
+    return True
+
+
+# --- Pagina di prova ---
+
+def build_page(size_kb, seed=1):
+    """Pagina prodotto con molto markup e JavaScript, prezzo e pulsante in fondo"""
+    rng = random.Random(seed)
+    words = ['matcha', 'tea', 'ceremonial', 'grade', 'uji', 'whisk', 'bowl', 'harvest', 'shipping']
+    blocks = []
+    size = 0
+    i = 0
+    while size < size_kb * 1024:
+        text = ' '.join(rng.choice(words) for _ in range(30))
+        block = (
+            f'<div class="card card-{i}"><a href="/p/{i}" class="link">{text}</a>'
+            f'<ul class="menu"><li class="item">{text[:40]}</li><li class="item">{text[40:80]}</li></ul></div>\n'
+        )
+        if i % 20 == 0:
+            block += f'<script>var data{i} = {{"id": {i}, "tags": "{text}"}};</script>\n'
+        blocks.append(block)
+        size += len(block)
+        i += 1
+
+    return (
+        '<html><head><title>Matcha Sayaka 40g</title></head><body>'
+        + ''.join(blocks)
+        + '<h1 class="product-title">Matcha Sayaka 40g</h1>'
+        + '<div class="product-form"><span class="product-price">€ 24,90</span>'
+        + '<button>Aggiungi al carrello</button></div></body></html>'
+    )
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-kb', type=int, default=1500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    page = build_page(args.size_kb)
+    soup = BeautifulSoup(page, 'html.parser')
+    matcher = get_matcher()
+
+    keywords = [k for lang in ('it', 'en') for kind in ('unavailable', 'available')
+                for k in LANGUAGE_KEYWORDS[lang][kind]]
+    combined_re = re.compile('|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)))
+
+    cases = [
+        ('parole chiave (vecchio)', lambda: legacy_availability(page)),
+        ('parole chiave (matcher)', lambda: matcher.is_available(page)),
+        ('parole chiave (regex unica)', lambda: bool(combined_re.findall(page.lower()))),
+        ('titolo+prezzo (vecchio)', lambda: (legacy_title(soup), legacy_price(soup))),
+        ('titolo+prezzo (matcher)', lambda: (find_title(soup), find_price(soup))),
+        ('classificazione (vecchio)',
+         lambda: (legacy_title(soup), legacy_price(soup), legacy_availability(page))),
+        ('classificazione (matcher)',
+         lambda: (find_title(soup), find_price(soup), matcher.is_available(page))),
+    ]
+
+    print(f"Pagina: {len(page) // 1024} KB, {args.repeat} ripetizioni")
+    timings = {}
+    for name, func in cases:
+        ms, result = timed(func, args.repeat)
+        timings[name] = ms
+        print(f"{name:32s} {ms:9.2f} ms  -> {result}")
+
+    speedup = timings['classificazione (vecchio)'] / timings['classificazione (matcher)']
+    print(f"\nClassificazione {speedup:.1f}x più veloce")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Confronto dei backend di parsing HTML (parsers.py) su una pagina grande
+Misura il tempo medio e l'aumento di RSS di picco (in un processo separato
+per ogni caso, così conta anche la memoria delle librerie C) e verifica
+che titolo e prezzo coincidano con la vecchia analisi html.parser.
+
+Uso: python benchmarks/bench_parsers.py [--size-kb 2000] [--repeat 5]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from parsers import BACKENDS, parse_page  # noqa: E402
+from bench_matcher import build_page  # noqa: E402
+
+
+def build_heavy_page(size_kb):
+    """Pagina con metà del peso in JavaScript inline, come molti temi Shopify"""
+    page = build_page(size_kb // 2)
+    script = '<script>window.theme = [' + ('{"k": "' + 'x' * 1000 + '"},') * (size_kb // 2) + '{}];</script>'
+    return page.replace('<body>', '<body>' + script, 1)
+
+
+def run_case(page_text, backend, scoped, repeat):
+    """Esegue un caso e restituisce tempo medio, RSS aggiuntivo e risultato"""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for _ in range(repeat):
+        page = parse_page(page_text, backend=backend, scoped=scoped)
+        result = (page.title(), page.price())
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    # ru_maxrss è in KB su Linux
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024
+    return {'ms': elapsed, 'rss_mb': peak, 'result': list(result)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-kb', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    page_text = build_heavy_page(args.size_kb)
+
+    if args.case:
+        backend, scoped = args.case.split(':')
+        print(json.dumps(run_case(page_text, backend, scoped == '1', args.repeat)))
+        return
+
+    print(f"Pagina: {len(page_text) // 1024} KB, {args.repeat} ripetizioni")
+    expected = None
+    for backend in ['html.parser'] + [b for b in BACKENDS if b != 'html.parser']:
+        for scoped in (False, True):
+            proc = subprocess.run(
+                [sys.executable, __file__, '--size-kb', str(args.size_kb),
+                 '--repeat', str(args.repeat), '--case', f"{backend}:{int(scoped)}"],
+                capture_output=True, text=True
+            )
+            if proc.returncode != 0:
+                print(f"{backend:12s} non disponibile: {proc.stderr.strip().splitlines()[-1]}")
+                break
+            stats = json.loads(proc.stdout)
+            if expected is None:
+                expected = stats['result']
+            label = f"{backend} ({'ridotta' if scoped else 'completa'})"
+            check = 'ok' if stats['result'] == expected else f"DIVERSO: {stats['result']}"
+            print(f"{label:26s} {stats['ms']:9.1f} ms  RSS +{stats['rss_mb']:6.1f} MB  {check}")
+
+
+if __name__ == '__main__':
+    main()
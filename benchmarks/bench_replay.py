@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Riproduzione offline di un controllo completo da una cassetta (cassettes.py)
+I link partono dallo stato salvato al momento della registrazione (di
+default FILE.links.db, come lo scrive bench_sweep.py --record) e le
+risposte arrivano dalla cassetta invece che dalla rete: il risultato è
+deterministico e il tempo misura solo motore, parsing e salvataggio.
+Con --save i risultati per URL (disponibilità, prezzo, valuta, errore) di
+ogni passata vengono scritti in un file; con --expect vengono confrontati
+con un file salvato prima, e qualsiasi differenza termina con errore.
+
+Uso: python benchmarks/bench_replay.py sweep.cassette [--links-db sweep.cassette.links.db]
+     [--sweeps 2] [--save attesi.json | --expect attesi.json] [--json risultati.json]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_sweep import git_revision  # noqa: E402
+
+# Campi del risultato confrontati tra riproduzioni
+COMPARED_FIELDS = ('in_stock', 'price_minor', 'currency')
+
+
+def copy_database(source, target):
+    """Copia del database (anche in modalità WAL) con il backup di sqlite"""
+    source_db = sqlite3.connect(source)
+    target_db = sqlite3.connect(target)
+    source_db.backup(target_db)
+    target_db.close()
+    source_db.close()
+
+
+def outcome(result):
+    values = {field: result.get(field) for field in COMPARED_FIELDS}
+    values['error'] = bool(result.get('error'))
+    return values
+
+
+def compare(expected, actual):
+    """Righe con le differenze tra due liste di passate {url: esito}"""
+    differences = []
+    for sweep, (expected_sweep, actual_sweep) in enumerate(zip(expected, actual), 1):
+        for url in sorted(set(expected_sweep) | set(actual_sweep)):
+            before = expected_sweep.get(url)
+            after = actual_sweep.get(url)
+            if before != after:
+                differences.append(f"passata {sweep}: {url}\n    atteso:  {before}\n    ottenuto: {after}")
+    if len(expected) != len(actual):
+        differences.append(f"passate attese {len(expected)}, eseguite {len(actual)}")
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('cassette')
+    parser.add_argument('--links-db', help='stato iniziale dei link (predefinito: CASSETTA.links.db)')
+    parser.add_argument('--domain-config', help='configurazione per dominio (predefinita: quella del monitor)')
+    parser.add_argument('--sweeps', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=20, help='MONITOR_CONCURRENCY')
+    parser.add_argument('--save', help='file in cui salvare i risultati per URL')
+    parser.add_argument('--expect', help='risultati per URL attesi (errore se diversi)')
+    parser.add_argument('--json', help='file in cui scrivere le misure')
+    args = parser.parse_args()
+
+    cassette_path = os.path.abspath(args.cassette)
+    links_db = os.path.abspath(args.links_db or cassette_path + '.links.db')
+    if not os.path.exists(links_db):
+        parser.error(f"database dei link non trovato: {links_db}")
+
+    workdir = tempfile.mkdtemp(prefix='bench_replay_')
+    # Database, cassetta e configurazione impostati prima di importare il monitor
+    os.environ['LINKS_DB'] = os.path.join(workdir, 'links.db')
+    os.environ['MONITOR_CONCURRENCY'] = str(args.concurrency)
+    os.environ['HTTP_CASSETTE'] = cassette_path
+    os.environ['HTTP_CASSETTE_MODE'] = 'replay'
+    copy_database(links_db, os.environ['LINKS_DB'])
+
+    import logging
+    import domain_config as domain_config_module
+    from cassettes import Cassette
+    from domain_config import domain_of
+    from metrics import registry
+
+    # Senza rete i limiti per host non servono: restano le altre impostazioni per dominio
+    domain_config = dict(domain_config_module.load_domain_config(args.domain_config))
+    cassette = Cassette(cassette_path)
+    for url in cassette.urls():
+        domain = domain_of(url)
+        domain_config[domain] = {
+            **domain_config.get(domain, {}),
+            'rate': 100000, 'burst': 100000, 'max_in_flight': args.concurrency,
+        }
+    cassette.close()
+    config_path = os.path.join(workdir, 'domain_config.json')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(domain_config, f)
+    domain_config_module.load_domain_config(config_path)
+
+    from history import HistoryStore
+    from product_monitor import ProductMonitor
+    from storage import SqliteLinkStore
+    # Gli errori registrati fanno parte del confronto: vengono contati, non stampati
+    logging.disable(logging.ERROR)
+
+    monitor = ProductMonitor(
+        SqliteLinkStore(os.environ['LINKS_DB'], import_from=None), HistoryStore(os.environ['LINKS_DB'])
+    )
+    print(f"{len(monitor.monitored_links)} link, {cassette.count} risposte registrate")
+
+    sweeps = []
+    outcomes = []
+    for sweep in range(args.sweeps):
+        registry.reset()
+        started = time.perf_counter()
+        results = monitor.check_all_products()
+        elapsed = time.perf_counter() - started
+        stages = registry.summary()['stages']
+        checks = stages.get('check', {})
+        sweeps.append({
+            'sweep': sweep + 1,
+            'checks': len(results),
+            'errors': sum(1 for r in results if r.get('error')),
+            'seconds': round(elapsed, 3),
+            'checks_per_second': round(len(results) / elapsed, 1) if elapsed else None,
+            'check_p50_ms': checks.get('p50_ms'),
+            'check_p95_ms': checks.get('p95_ms'),
+            'stage_seconds': {stage: data['total_seconds'] for stage, data in stages.items()},
+        })
+        outcomes.append({result['url']: outcome(result) for result in results})
+        print(
+            f"Passata {sweep + 1}: {len(results)} controlli in {elapsed:.2f} s "
+            f"({sweeps[-1]['checks_per_second']} controlli/s), errori {sweeps[-1]['errors']}"
+        )
+
+    monitor.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'cassette': os.path.basename(cassette_path), 'sweeps': outcomes}, f, indent=2, sort_keys=True)
+        print(f"Risultati per URL scritti in {args.save}")
+
+    if args.json:
+        report = {
+            'benchmark': 'replay',
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cassette': os.path.basename(cassette_path),
+            'links': len(outcomes[0]) if outcomes else 0,
+            'sweeps': sweeps,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Misure scritte in {args.json}")
+
+    if args.expect:
+        with open(args.expect, 'r', encoding='utf-8') as f:
+            expected = json.load(f)['sweeps']
+        differences = compare(expected, outcomes)
+        if differences:
+            print(f"{len(differences)} differenze rispetto a {args.expect}:")
+            print('\n'.join(differences))
+            sys.exit(1)
+        print(f"Nessuna differenza rispetto a {args.expect}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark del tempo di avvio del runner
+Ogni misura è un processo Python nuovo (come in un'esecuzione di GitHub
+Actions): interprete vuoto, import del nucleo (product_monitor), import
+del runner, avvio completo di monitor_runner.py --help e import del bot
+(main.py) per confronto. Riporta la mediana di più ripetizioni e i moduli
+pesanti caricati; con --max-ms termina con errore se l'import del runner
+supera la soglia. Con --importtime mostra i moduli più lenti da importare.
+
+Uso: python benchmarks/bench_startup.py [--repeat 10] [--max-ms 150] [--json risultati.json]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Moduli che il runner non deve caricare all'avvio
+HEAVY_MODULES = ('telegram', 'bs4', 'soupsieve', 'lxml', 'selectolax', 'httpx')
+
+CASES = (
+    ('python', ['-c', 'pass']),
+    ('import product_monitor', ['-c', 'import product_monitor']),
+    ('import monitor_runner', ['-c', 'import monitor_runner']),
+    ('monitor_runner.py --help', ['monitor_runner.py', '--help']),
+    ('import main', ['-c', 'import main']),
+)
+
+
+def run_once(args):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, *args], cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def heavy_modules(module):
+    """Moduli pesanti presenti in sys.modules dopo l'import di module"""
+    code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return output.split()
+
+
+def slowest_imports(module, count=10):
+    """(microsecondi cumulativi, modulo) dei moduli più lenti secondo -X importtime"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                            check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, help="soglia per l'import del runner (errore se superata)")
+    parser.add_argument('--importtime', action='store_true', help='moduli più lenti da importare per il runner')
+    parser.add_argument('--json', help='file in cui scrivere i risultati')
+    args = parser.parse_args()
+
+    # Il primo avvio riscalda la cache dei file e i .pyc
+    for _, case_args in CASES:
+        run_once(case_args)
+
+    cases = []
+    for name, case_args in CASES:
+        times = [run_once(case_args) for _ in range(args.repeat)]
+        cases.append({
+            'case': name,
+            'median_ms': round(statistics.median(times) * 1000, 1),
+            'min_ms': round(min(times) * 1000, 1),
+        })
+    baseline = cases[0]['median_ms']
+    for case in cases:
+        case['import_ms'] = round(case['median_ms'] - baseline, 1)
+        print(f"{case['case']:28s} {case['median_ms']:7.1f} ms  (+{case['import_ms']:.1f} ms rispetto all'interprete)")
+
+    loaded = {module: heavy_modules(module) for module in ('product_monitor', 'monitor_runner')}
+    for module, modules in loaded.items():
+        print(f"Moduli pesanti dopo import {module}: {', '.join(modules) or 'nessuno'}")
+
+    if args.importtime:
+        print("Import più lenti di monitor_runner (cumulativi):")
+        for cumulative, name in slowest_imports('monitor_runner'):
+            print(f"  {cumulative / 1000:7.1f} ms  {name}")
+
+    if args.json:
+        report = {
+            'benchmark': 'startup',
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'repeat': args.repeat,
+            'cases': cases,
+            'heavy_modules': loaded,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Risultati scritti in {args.json}")
+
+    runner = next(case for case in cases if case['case'] == 'import monitor_runner')
+    if any(loaded.values()) or (args.max_ms is not None and runner['import_ms'] > args.max_ms):
+        print("Avvio del runner oltre i limiti")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
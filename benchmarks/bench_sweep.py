@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Benchmark di un controllo completo contro negozi finti locali (fake_shop.py)
+Per ogni numero di link avvia un processo separato con i suoi negozi e un
+database temporaneo, esegue più passate di ProductMonitor.check_all_products
+(la prima a freddo, le successive con 304 e impronte) e un campione di
+get_product_info, e misura throughput, latenza p50/p95/p99 per controllo,
+tempo di parsing e RSS di picco. Con --json i risultati vengono scritti in
+un file confrontabile tra versioni. Con --record le risposte dei negozi
+vengono registrate in una cassetta (con il database iniziale accanto, in
+FILE.links.db) da riprodurre offline con bench_replay.py.
+
+Uso: python benchmarks/bench_sweep.py [--links 10 100 1000 5000] [--domains 8]
+     [--latency 0.02] [--error-rate 0.01] [--json risultati.json] [--record sweep.cassette]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import shutil
+import resource
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_shop import KINDS, serve  # noqa: E402
+
+
+def percentile(values, p):
+    """Percentile con il metodo nearest-rank (None se non ci sono valori)"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))]
+
+
+def latency_stats(seconds):
+    return {
+        'p50_ms': round(percentile(seconds, 50) * 1000, 2) if seconds else None,
+        'p95_ms': round(percentile(seconds, 95) * 1000, 2) if seconds else None,
+        'p99_ms': round(percentile(seconds, 99) * 1000, 2) if seconds else None,
+    }
+
+
+class Timings:
+    """Durate raccolte da più thread"""
+
+    def __init__(self):
+        self.values = []
+        self.lock = threading.Lock()
+
+    def add(self, value):
+        with self.lock:
+            self.values.append(value)
+
+    def take(self):
+        with self.lock:
+            values, self.values = self.values, []
+        return values
+
+
+def timed(function, timings):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings.add(time.perf_counter() - started)
+    return wrapper
+
+
+def run_case(args):
+    """Esegue il benchmark per args.case link; restituisce le misure come dizionario"""
+    record = os.path.abspath(args.record) if args.record else None
+    workdir = tempfile.mkdtemp(prefix='bench_sweep_')
+    os.chdir(workdir)
+    # Database e configurazione temporanei, impostati prima di importare il monitor
+    os.environ['LINKS_DB'] = os.path.join(workdir, 'links.db')
+    os.environ['MONITOR_CONCURRENCY'] = str(args.concurrency)
+    if record:
+        os.environ['HTTP_CASSETTE'] = record
+        os.environ['HTTP_CASSETTE_MODE'] = 'record'
+
+    shops = []
+    domain_config = {}
+    for i in range(args.domains):
+        server, shop, base = serve(
+            kind=KINDS[i % len(KINDS)] if args.kind == 'mix' else args.kind,
+            latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+            etag=not args.no_etag, change_rate=args.change_rate, page_kb=args.page_kb, seed=i
+        )
+        shops.append((server, shop, base))
+        domain_config[base.split('//', 1)[1]] = {
+            'rate': args.host_rate, 'burst': args.host_rate, 'max_in_flight': args.host_concurrency,
+            'pool_size': args.host_concurrency, 'pool_keepalive': args.host_concurrency
+        }
+    config_path = os.path.join(workdir, 'domain_config.json')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(domain_config, f)
+
+    import logging
+    import domain_config as domain_config_module
+    domain_config_module.load_domain_config(config_path)
+
+    from check_engine import CheckEngine
+    from history import HistoryStore
+    from product_monitor import ProductMonitor
+    from storage import SqliteLinkStore
+    # Gli errori simulati sono attesi: vengono contati, non stampati
+    logging.disable(logging.ERROR)
+
+    parse_timings = Timings()
+    check_latencies = Timings()
+    CheckEngine.parse_page = timed(CheckEngine.parse_page, parse_timings)
+
+    monitor = ProductMonitor(
+        SqliteLinkStore(os.environ['LINKS_DB'], import_from=None), HistoryStore(os.environ['LINKS_DB'])
+    )
+    apply_check_result = monitor.apply_check_result
+
+    def apply_and_measure(url, data, product_info):
+        if product_info.get('latency') is not None:
+            check_latencies.add(product_info['latency'])
+        return apply_check_result(url, data, product_info)
+    monitor.apply_check_result = apply_and_measure
+
+    for i in range(args.case):
+        _, _, base = shops[i % len(shops)]
+        url = f"{base}/products/matcha-{i}"
+        monitor.monitored_links[url] = monitor.new_link_data(url, f"Matcha {i}", {'title': '', 'price': None, 'in_stock': None})
+        monitor.mark_dirty(url)
+    if record:
+        # La piattaforma di ogni negozio viene rilevata prima (fuori dalla cassetta):
+        # a freddo dipende da quale pagina arriva per prima e la riproduzione,
+        # senza latenza, chiederebbe URL diversi da quelli registrati
+        import urllib.request
+        from extractors import ExtractorRegistry
+        registry = ExtractorRegistry()
+        for _, _, base in shops:
+            with urllib.request.urlopen(f"{base}/products/matcha-0") as response:
+                registry.detect(base, response.read().decode('utf-8', 'replace'))
+        for url, data in monitor.monitored_links.items():
+            data['platform'] = registry.platform(url)
+    monitor.save_links()
+    monitor.scheduler.rebuild()
+    if record:
+        # Stato dei link all'inizio della registrazione, per la riproduzione
+        import sqlite3
+        source = sqlite3.connect(os.environ['LINKS_DB'])
+        target = sqlite3.connect(record + '.links.db')
+        source.backup(target)
+        target.close()
+        source.close()
+
+    sweeps = []
+    for sweep in range(args.sweeps):
+        started = time.perf_counter()
+        results = monitor.check_all_products()
+        elapsed = time.perf_counter() - started
+        parse_times = parse_timings.take()
+        latencies = check_latencies.take()
+        sweeps.append({
+            'sweep': sweep + 1,
+            'checks': len(results),
+            'errors': sum(1 for r in results if r.get('error')),
+            'seconds': round(elapsed, 3),
+            'checks_per_second': round(len(results) / elapsed, 1) if elapsed else None,
+            **latency_stats(latencies),
+            'parsed_pages': len(parse_times),
+            'parse_total_ms': round(sum(parse_times) * 1000, 1),
+            'parse_mean_ms': round(sum(parse_times) / len(parse_times) * 1000, 2) if parse_times else None,
+        })
+
+    # get_product_info: percorso sincrono usato all'aggiunta di un link, su un campione
+    sample = list(monitor.monitored_links)[:min(args.case, args.sync_sample)]
+    sync_latencies = []
+    monitor.parse_product_page = timed(monitor.parse_product_page, parse_timings)
+    for url in sample:
+        started = time.perf_counter()
+        monitor.get_product_info(url)
+        sync_latencies.append(time.perf_counter() - started)
+    parse_times = parse_timings.take()
+
+    requests = sum(shop.requests for _, shop, _ in shops)
+    monitor.close()
+    for server, _, _ in shops:
+        server.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'links': args.case,
+        'sweeps': sweeps,
+        'get_product_info': {
+            'checks': len(sample),
+            **latency_stats(sync_latencies),
+            'parse_mean_ms': round(sum(parse_times) / len(parse_times) * 1000, 2) if parse_times else None,
+        },
+        'shop_requests': requests,
+        # ru_maxrss è in KB su Linux (in byte su macOS)
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--links', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--domains', type=int, default=8, help='negozi finti (un dominio ciascuno)')
+    parser.add_argument('--kind', choices=KINDS + ('mix',), default='mix')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--no-etag', action='store_true', help='i negozi non rispondono mai 304')
+    parser.add_argument('--change-rate', type=float, default=0.05)
+    parser.add_argument('--page-kb', type=int, default=120)
+    parser.add_argument('--sweeps', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=20, help='MONITOR_CONCURRENCY')
+    parser.add_argument('--host-rate', type=float, default=1000, help='richieste al secondo per dominio')
+    parser.add_argument('--host-concurrency', type=int, default=8, help='richieste contemporanee per dominio')
+    parser.add_argument('--sync-sample', type=int, default=20, help='link controllati con get_product_info')
+    parser.add_argument('--json', help='file in cui scrivere i risultati')
+    parser.add_argument('--record', help='cassetta in cui registrare le risposte (un solo caso)')
+    parser.add_argument('--case', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.record and len(args.links) > 1:
+        parser.error("--record registra un solo caso: indica un solo valore per --links")
+
+    if args.case:
+        print(json.dumps(run_case(args)))
+        return
+
+    # Le stesse opzioni passano ai processi dei singoli casi, tranne --json
+    options = []
+    skip = False
+    for arg in sys.argv[1:]:
+        if skip or arg.startswith('--json='):
+            skip = False
+            continue
+        if arg == '--json':
+            skip = True
+            continue
+        options.append(arg)
+    cases = []
+    for links in args.links:
+        # Un processo per caso: l'RSS di picco non dipende dai casi precedenti
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *options, '--case', str(links)],
+            capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            print(f"{links:6d} link: errore\n{proc.stderr.strip()}")
+            continue
+        case = json.loads(proc.stdout.strip().splitlines()[-1])
+        cases.append(case)
+        for sweep in case['sweeps']:
+            print(
+                f"{links:6d} link, passata {sweep['sweep']}: {sweep['checks_per_second']:8.1f} controlli/s  "
+                f"p50 {sweep['p50_ms']} ms  p95 {sweep['p95_ms']} ms  p99 {sweep['p99_ms']} ms  "
+                f"parsing {sweep['parsed_pages']} pagine, media {sweep['parse_mean_ms']} ms  "
+                f"errori {sweep['errors']}"
+            )
+        sync = case['get_product_info']
+        print(f"{'':6s}       get_product_info: p50 {sync['p50_ms']} ms  p95 {sync['p95_ms']} ms  "
+              f"parsing {sync['parse_mean_ms']} ms  RSS di picco {case['peak_rss_mb']} MB")
+
+    if args.json:
+        report = {
+            'benchmark': 'sweep',
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'options': {key: value for key, value in vars(args).items() if key not in ('json', 'case', 'record')},
+            'cases': cases,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Risultati scritti in {args.json}")
+
+
+if __name__ == '__main__':
+    main()
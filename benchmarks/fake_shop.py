@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Finto negozio HTTP per i benchmark dei controlli
+Ogni server è un dominio con pagine prodotto realistiche di una
+piattaforma: Shopify (con /products/<handle>.js), WooCommerce (con la
+Store API), pagina con JSON-LD, tema pesante con molto JavaScript inline
+oppure pagina Next.js con la disponibilità solo in __NEXT_DATA__. Latenza, errori, risposte 304 e frequenza dei cambiamenti di
+disponibilità sono configurabili.
+
+    python benchmarks/fake_shop.py --port 8900 --kind shopify --latency 0.05
+"""
+
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+KINDS = ('shopify', 'woocommerce', 'jsonld', 'heavy', 'nextjs')
+
+# Testo di riempimento come nelle descrizioni e nei menu dei negozi veri
+FILLER = (
+    '<div class="collection-item"><a href="/products/{slug}-{i}">Tè verde {i}</a>'
+    '<span class="badge">Novità</span><p>Tè coltivato all\'ombra, macinato a pietra.</p></div>'
+)
+
+
+class FakeShop:
+    """Stato di un negozio: disponibilità e prezzo di ogni prodotto"""
+
+    def __init__(self, kind='shopify', latency=0.0, jitter=0.0, error_rate=0.0,
+                 etag=True, change_rate=0.0, page_kb=120, seed=0):
+        self.kind = kind
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.etag = etag
+        self.change_rate = change_rate
+        self.page_kb = page_kb
+        self.random = random.Random(seed)
+        self.products = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self._filler = None
+
+    def product(self, slug):
+        """(disponibile, prezzo in centesimi) del prodotto, eventualmente cambiato"""
+        with self.lock:
+            self.requests += 1
+            state = self.products.get(slug)
+            if state is None:
+                digest = int(hashlib.sha1(slug.encode()).hexdigest(), 16)
+                state = [digest % 3 != 0, 1500 + digest % 5000]
+                self.products[slug] = state
+            elif self.random.random() < self.change_rate:
+                state[0] = not state[0]
+            return tuple(state)
+
+    def fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def delay(self):
+        with self.lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+
+    # --- Contenuti ---
+
+    def filler(self, kb):
+        """Catalogo di riempimento (lo stesso per tutte le pagine del negozio)"""
+        if self._filler is None:
+            parts = []
+            size = 0
+            i = 0
+            while size < kb * 1024:
+                part = FILLER.format(slug=self.kind, i=i)
+                parts.append(part)
+                size += len(part)
+                i += 1
+            self._filler = ''.join(parts)
+        return self._filler
+
+    def html(self, slug, in_stock, price):
+        euros = f"{price // 100},{price % 100:02d}"
+        button = ('<button type="submit" name="add">Aggiungi al carrello</button>' if in_stock
+                  else '<button type="submit" disabled>Esaurito</button>')
+        head = f'<title>Matcha {slug}</title><meta charset="utf-8">'
+        body = f'<h1 class="product-title">Matcha {slug}</h1><span class="price">€ {euros}</span>'
+        token = hashlib.md5(f"{slug}{time.time()}".encode()).hexdigest()
+
+        if self.kind == 'shopify':
+            head += '<link rel="preconnect" href="https://cdn.shopify.com">'
+            head += f'<script>Shopify.shop = "bench.myshopify.com"; var csrf = "{token}";</script>'
+            body += (f'<form method="post" action="/cart/add"><input type="hidden" name="authenticity_token" '
+                     f'value="{token}">{button}</form>')
+        elif self.kind == 'woocommerce':
+            head += '<link rel="stylesheet" href="/wp-content/plugins/woocommerce/assets/css/woocommerce.css">'
+            body += (f'<form class="cart" action="/products/{slug}" method="post"><input type="hidden" name="_wpnonce" value="{token}">'
+                     + ('<button name="add-to-cart" value="1">Aggiungi al carrello</button>' if in_stock
+                        else '<p class="stock out-of-stock">Esaurito</p>') + '</form>')
+        elif self.kind == 'jsonld':
+            offer = {
+                '@context': 'https://schema.org', '@type': 'Product', 'name': f'Matcha {slug}',
+                'offers': {'@type': 'Offer', 'price': f"{price / 100:.2f}", 'priceCurrency': 'EUR',
+                           'availability': 'https://schema.org/' + ('InStock' if in_stock else 'OutOfStock')}
+            }
+            head += f'<script type="application/ld+json">{json.dumps(offer)}</script>'
+            body += button
+        elif self.kind == 'nextjs':
+            # Disegnata nel browser: il modello mostra sempre il pulsante, lo stato è in __NEXT_DATA__
+            state = {
+                'props': {'pageProps': {'product': {
+                    'name': f'Matcha {slug}', 'inStock': in_stock,
+                    'price': {'amount': f"{price / 100:.2f}", 'currencyCode': 'EUR'}
+                }}},
+                'buildId': token,
+            }
+            body = f'<h1 class="product-title">Matcha {slug}</h1><div id="__next"><button>Aggiungi al carrello</button></div>'
+            body += f'<script id="__NEXT_DATA__" type="application/json">{json.dumps(state)}</script>'
+        else:
+            # Tema pesante: metà della pagina è JavaScript inline
+            bundle = '{"k": "' + 'x' * 1000 + '"},'
+            head += f'<script>window.theme = [{bundle * (self.page_kb // 2)}{{}}]; var t = "{token}";</script>'
+            body += button
+
+        filler = self.filler(max(1, self.page_kb // (2 if self.kind == 'heavy' else 1)))
+        return (f'<!DOCTYPE html><html><head>{head}</head><body><header>{filler[:2000]}</header>'
+                f'<main>{body}</main><section>{filler}</section></body></html>')
+
+    def shopify_json(self, slug, in_stock, price):
+        return json.dumps({
+            'id': 1, 'title': f'Matcha {slug}', 'available': in_stock, 'price': price,
+            'variants': [{'id': 11, 'title': '30g', 'available': in_stock, 'price': price}]
+        })
+
+    def woocommerce_json(self, slug, in_stock, price):
+        return json.dumps([{
+            'id': 1, 'name': f'Matcha {slug}', 'is_in_stock': in_stock,
+            'prices': {'price': str(price), 'currency_code': 'EUR', 'currency_minor_unit': 2}
+        }])
+
+    def respond(self, path, if_none_match=None):
+        """(codice HTTP, header, corpo) per una richiesta GET"""
+        self.delay()
+        if self.fail():
+            return 503, {'Content-Type': 'text/plain'}, b'Service Unavailable'
+
+        parsed = urlparse(path)
+        if parsed.path.startswith('/wp-json/wc/store/v1/products'):
+            slug = parse_qs(parsed.query).get('slug', [''])[0]
+            content_type, render = 'application/json', self.woocommerce_json
+        elif parsed.path.startswith('/products/') and parsed.path.endswith('.js'):
+            slug = parsed.path[len('/products/'):-3]
+            content_type, render = 'application/json', self.shopify_json
+        elif parsed.path.startswith('/products/'):
+            slug = parsed.path[len('/products/'):].strip('/')
+            content_type, render = 'text/html; charset=utf-8', self.html
+        else:
+            return 404, {'Content-Type': 'text/plain'}, b'Not Found'
+
+        in_stock, price = self.product(slug)
+        etag = f'"{slug}-{int(in_stock)}-{price}"'
+        headers = {'Content-Type': content_type}
+        if self.etag:
+            headers['ETag'] = etag
+            if if_none_match == etag:
+                return 304, headers, b''
+        return 200, headers, render(slug, in_stock, price).encode('utf-8')
+
+
+def make_handler(shop):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            status, headers, body = shop.respond(self.path, self.headers.get('If-None-Match'))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=0, **options):
+    """Avvia un negozio in un thread; restituisce (server, stato, url di base)"""
+    shop = FakeShop(**options)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(shop))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, shop, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--kind', choices=KINDS, default='shopify')
+    parser.add_argument('--latency', type=float, default=0.0, help='secondi di attesa per risposta')
+    parser.add_argument('--jitter', type=float, default=0.0, help='attesa casuale aggiuntiva massima')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='frazione di risposte 503')
+    parser.add_argument('--no-etag', action='store_true', help='niente ETag né risposte 304')
+    parser.add_argument('--change-rate', type=float, default=0.0, help='probabilità di cambio disponibilità per richiesta')
+    parser.add_argument('--page-kb', type=int, default=120)
+    args = parser.parse_args()
+
+    server, shop, base = serve(
+        args.port, kind=args.kind, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        etag=not args.no_etag, change_rate=args.change_rate, page_kb=args.page_kb
+    )
+    print(f"Negozio {args.kind} su {base}/products/<slug> (Ctrl+C per uscire)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
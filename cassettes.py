@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Registrazione e riproduzione delle risposte HTTP (cassette)
+In registrazione ogni risposta dei negozi (stato, header e corpo così come
+arriva dalla rete) viene aggiunta a un archivio; in riproduzione lo stesso
+archivio, letto con mmap, risponde al posto della rete attraverso gli
+stessi client di http_pool.py usati dai controlli e da get_product_info.
+Così un controllo completo si può ripetere offline, per confrontare i
+risultati dei classificatori o misurare il throughput.
+
+Formato: intestazione MAGIC, poi per ogni risposta (lunghezza dei metadati,
+lunghezza del corpo) come due interi a 32 bit big-endian, i metadati JSON e
+il corpo. I corpi senza Content-Encoding sono salvati compressi con zlib.
+
+    HTTP_CASSETTE=sweep.cassette HTTP_CASSETTE_MODE=record python monitor_runner.py --all
+    python cassettes.py sweep.cassette
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import zlib
+import struct
+import threading
+from collections import Counter
+from urllib.parse import urlparse
+
+import httpx
+
+MAGIC = b'HTTPCAS1'
+RECORD_HEADER = struct.Struct('>II')
+
+# Host mai registrati né riprodotti: l'API di Telegram (l'URL contiene il token del bot)
+SKIP_HOSTS = {
+    urlparse(os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')).netloc.lower(),
+    *(host.strip().lower() for host in os.environ.get('HTTP_CASSETTE_SKIP_HOSTS', '').split(',') if host.strip()),
+}
+
+CONDITIONAL_HEADERS = ('if-none-match', 'if-modified-since')
+
+
+def covers(url):
+    """True se le richieste all'URL passano dalla cassetta"""
+    return urlparse(str(url)).netloc.lower() not in SKIP_HOSTS
+
+
+class CassetteWriter:
+    """Aggiunge le risposte all'archivio (anche da più thread o processi)"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+            os.write(self.fd, MAGIC)
+        except FileExistsError:
+            self.fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        self.lock = threading.Lock()
+        self.records = 0
+
+    def write(self, request, response, raw, elapsed):
+        headers = [[name, value] for name, value in response.headers.multi_items()]
+        encoding = None
+        body = raw
+        if 'content-encoding' not in response.headers and raw:
+            body = zlib.compress(raw, 6)
+            encoding = 'zlib'
+        meta = json.dumps({
+            'method': request.method,
+            'url': str(request.url),
+            'status': response.status_code,
+            'headers': headers,
+            'encoding': encoding,
+            'recorded_at': time.time(),
+            'elapsed': round(elapsed, 4),
+        }, ensure_ascii=False).encode('utf-8')
+        # Una sola write in append: i record di processi diversi non si mescolano
+        with self.lock:
+            os.write(self.fd, RECORD_HEADER.pack(len(meta), len(body)) + meta + body)
+            self.records += 1
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """Trasporto sincrono che inoltra alla rete e registra le risposte"""
+
+    def __init__(self, inner, writer):
+        self.inner = inner
+        self.writer = writer
+
+    def handle_request(self, request):
+        started = time.perf_counter()
+        response = self.inner.handle_request(request)
+        try:
+            raw = b''.join(response.iter_raw())
+        finally:
+            response.close()
+        self.writer.write(request, response, raw, time.perf_counter() - started)
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=httpx.ByteStream(raw), extensions=response.extensions)
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncRecordingTransport(httpx.AsyncBaseTransport):
+    """Trasporto asincrono che inoltra alla rete e registra le risposte"""
+
+    def __init__(self, inner, writer):
+        self.inner = inner
+        self.writer = writer
+
+    async def handle_async_request(self, request):
+        started = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        try:
+            raw = b''.join([chunk async for chunk in response.aiter_raw()])
+        finally:
+            await response.aclose()
+        self.writer.write(request, response, raw, time.perf_counter() - started)
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=httpx.ByteStream(raw), extensions=response.extensions)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+class Cassette:
+    """Archivio in sola lettura, mappato in memoria, con un indice (metodo, URL) -> risposte"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if size and self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} non è una cassetta")
+        self.records = {}
+        self.count = 0
+        offset = len(MAGIC)
+        while offset + RECORD_HEADER.size <= size:
+            meta_length, body_length = RECORD_HEADER.unpack_from(self.map, offset)
+            offset += RECORD_HEADER.size
+            if offset + meta_length + body_length > size:
+                # Ultimo record scritto a metà (registrazione interrotta)
+                break
+            meta = json.loads(self.map[offset:offset + meta_length])
+            offset += meta_length
+            self.records.setdefault((meta['method'], meta['url']), []).append((meta, offset, body_length))
+            self.count += 1
+            offset += body_length
+        self.positions = Counter()
+        self.lock = threading.Lock()
+
+    def urls(self, method='GET'):
+        return [url for record_method, url in self.records if record_method == method]
+
+    def body(self, meta, offset, length):
+        body = self.map[offset:offset + length]
+        return zlib.decompress(body) if meta.get('encoding') == 'zlib' else bytes(body)
+
+    def rewind(self):
+        with self.lock:
+            self.positions.clear()
+
+    def response(self, request):
+        """(stato, header, corpo) per la richiesta, None se non registrata
+
+        Le risposte di un URL vengono restituite nell'ordine di registrazione
+        (l'ultima si ripete). Un 304 registrato vale solo per una richiesta
+        condizionale; a una richiesta con If-None-Match uguale all'ETag
+        registrato si risponde 304 come farebbe il server.
+        """
+        key = (request.method, str(request.url))
+        records = self.records.get(key)
+        if not records:
+            return None
+        with self.lock:
+            index = min(self.positions[key], len(records) - 1)
+            self.positions[key] += 1
+
+        conditional = any(name in request.headers for name in CONDITIONAL_HEADERS)
+        meta, offset, length = records[index]
+        if meta['status'] == 304 and not conditional:
+            full = [record for record in records if record[0]['status'] != 304]
+            if not full:
+                return None
+            meta, offset, length = min(full, key=lambda record: abs(records.index(record) - index))
+
+        headers = meta['headers']
+        etag = next((value for name, value in headers if name.lower() == 'etag'), None)
+        if etag and meta['status'] == 200 and request.headers.get('if-none-match') == etag:
+            return 304, [[name, value] for name, value in headers if name.lower() in ('etag', 'last-modified')], b''
+        return meta['status'], headers, self.body(meta, offset, length)
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+
+class ReplayTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """Trasporto (sincrono e asincrono) che risponde dalla cassetta senza rete"""
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+
+    def _response(self, request):
+        found = self.cassette.response(request)
+        if found is None:
+            raise httpx.ConnectError(f"Nessuna risposta registrata per {request.method} {request.url}", request=request)
+        status, headers, body = found
+        return httpx.Response(status, headers=headers, stream=httpx.ByteStream(body),
+                              extensions={'http_version': b'HTTP/1.1'})
+
+    def handle_request(self, request):
+        return self._response(request)
+
+    async def handle_async_request(self, request):
+        return self._response(request)
+
+
+class Recorder:
+    """Modalità registrazione per HttpPool"""
+
+    def __init__(self, path):
+        self.writer = CassetteWriter(path)
+
+    def transport(self, limits, http2, asynchronous):
+        if asynchronous:
+            return AsyncRecordingTransport(httpx.AsyncHTTPTransport(limits=limits, http2=http2), self.writer)
+        return RecordingTransport(httpx.HTTPTransport(limits=limits, http2=http2), self.writer)
+
+
+class Player:
+    """Modalità riproduzione per HttpPool"""
+
+    def __init__(self, path):
+        self.cassette = Cassette(path)
+        self.replay = ReplayTransport(self.cassette)
+
+    def transport(self, limits, http2, asynchronous):
+        return self.replay
+
+
+def open_cassette(path, mode='replay'):
+    """Recorder o Player per HttpPool secondo la modalità ('record' o 'replay')"""
+    if mode == 'record':
+        return Recorder(path)
+    if mode == 'replay':
+        return Player(path)
+    raise ValueError(f"Modalità della cassetta sconosciuta: {mode}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Uso: python cassettes.py FILE")
+        sys.exit(2)
+    cassette = Cassette(sys.argv[1])
+    statuses = Counter()
+    hosts = Counter()
+    stored = 0
+    for (method, url), records in cassette.records.items():
+        hosts[urlparse(url).netloc] += len(records)
+        for meta, _, length in records:
+            statuses[meta['status']] += 1
+            stored += length
+    print(f"{cassette.count} risposte, {len(cassette.records)} URL, {stored / 1024:.0f} KB di corpi")
+    print("Stati: " + ", ".join(f"{status} × {count}" for status, count in sorted(statuses.items())))
+    for host, count in hosts.most_common(10):
+        print(f"  {host}: {count}")
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Motore di controllo asincrono per i prodotti monitorati
+Esegue download, parsing e confronto di molti prodotti in parallelo,
+rispettando i limiti di ogni dominio (vedi rate_limiter.py)
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+
+from domain_config import domain_of, get_domain_config
+from embedded_state import EmbeddedStateExtractor
+from extractors import ExtractorRegistry, JsonLdExtractor
+from fingerprint import region_fingerprint
+from http_pool import get_pool
+from metrics import RequestTrace, registry
+from rate_limiter import DomainRateLimiter, interleave_by_domain
+from streaming import decode_body, page_limit, read_body_async
+
+logger = logging.getLogger(__name__)
+
+# Numero massimo di richieste contemporanee (su tutti i siti)
+MAX_CONCURRENCY = int(os.environ.get('MONITOR_CONCURRENCY', '20'))
+
+
+class CheckEngine:
+    """Esegue i controlli dei prodotti in parallelo con un limite globale e per host"""
+
+    def __init__(self, monitor, concurrency=MAX_CONCURRENCY, limiter=None, pool=None):
+        self.monitor = monitor
+        self.concurrency = max(1, concurrency)
+        self.limiter = limiter
+        self.pool = pool or get_pool()
+        self.extractors = ExtractorRegistry(monitor.monitored_links)
+        self.jsonld = JsonLdExtractor()
+        self.state = EmbeddedStateExtractor(monitor.monitored_links)
+
+    def conditional_headers(self, data, fetch_url):
+        """Header per la GET condizionale in base all'ultimo controllo riuscito"""
+        headers = self.monitor.request_headers()
+        # Senza uno stato valido da riportare non ha senso chiedere un 304,
+        # e i validatori valgono solo per l'URL da cui sono stati ottenuti
+        if data.get('in_stock') is None or data.get('validator_url', data['url']) != fetch_url:
+            return headers
+        if data.get('etag'):
+            headers['If-None-Match'] = data['etag']
+        if data.get('last_modified'):
+            headers['If-Modified-Since'] = data['last_modified']
+        return headers
+
+    def unchanged_info(self, data, status_code):
+        """Riporta il risultato precedente quando la pagina non è cambiata"""
+        return {
+            'title': data.get('product_title') or data['name'],
+            'price': data.get('last_price'),
+            'price_minor': data.get('last_price_minor'),
+            'currency': data.get('currency'),
+            'in_stock': data.get('in_stock'),
+            'variants': data.get('variants'),
+            'status_code': status_code,
+            'not_modified': True
+        }
+
+    def parse_if_changed(self, url, data, fetch_url, page_text, status_code, validators, partial=False):
+        """Analizza la pagina solo se l'impronta delle regioni del prodotto è cambiata
+
+        L'impronta viene aggiunta ai validatori e salvata con il link; con una
+        ricetta dello stato incorporato comprende il valore letto dalla ricetta.
+        Con partial vedi parse_page.
+        """
+        domain = domain_of(url)
+        with registry.timer('fingerprint', domain):
+            fingerprint = region_fingerprint(page_text, domain, self.state.active_recipe(domain))
+        validators['fingerprint'] = fingerprint
+        if (fingerprint and data.get('in_stock') is not None and data.get('fingerprint') == fingerprint
+                and data.get('validator_url', data['url']) == fetch_url):
+            logger.debug(f"Regione del prodotto invariata, analisi saltata: {url}")
+            product_info = self.unchanged_info(data, status_code)
+            product_info['fingerprint_match'] = True
+            return product_info
+        with registry.timer('parse', domain):
+            return self.parse_page(url, page_text, status_code, partial)
+
+    def parse_page(self, url, page_text, status_code, partial=False):
+        """Analizza la pagina HTML: JSON-LD, stato incorporato, poi le euristiche HTML
+
+        Se il dominio ha già una ricetta dello stato incorporato si parte da quella.
+        Con partial (pagina tagliata dopo un blocco di dati strutturati) restituisce
+        None se i dati strutturati non si estraggono: le euristiche HTML vanno
+        applicate alla pagina intera.
+        """
+        has_recipe = self.state.recipe(domain_of(url)) is not None
+        product_info = self.state.extract(url, page_text, page_text) if has_recipe else None
+        if product_info is None:
+            product_info = self.jsonld.extract(url, page_text, page_text)
+        if product_info is None and not has_recipe:
+            product_info = self.state.extract(url, page_text, page_text)
+        if product_info is None and partial:
+            return None
+        self.extractors.detect(url, page_text)
+        if product_info is None:
+            product_info = self.monitor.parse_product_page(page_text, status_code, url)
+        if has_recipe and 'state_recipe' not in product_info:
+            # Ricetta non più valida: non va riproposta ai prossimi controlli
+            product_info['state_recipe'] = None
+        product_info['status_code'] = status_code
+        return product_info
+
+    async def fetch(self, url, data, fetch_url, extractor=None, full=False):
+        """Scarica fetch_url e ne estrae le informazioni
+
+        Con un estrattore dedicato restituisce None se l'endpoint non è
+        utilizzabile, così si può ripiegare sulla pagina del prodotto.
+        Le pagine HTML vengono lette a blocchi fino al limite di dimensione
+        del dominio, fermandosi dopo il form del prodotto o l'offerta JSON-LD;
+        se dalla pagina tagliata non si estraggono i dati strutturati (o con
+        full) la pagina viene scaricata per intero.
+        """
+        client = self.pool.async_client(fetch_url)
+        domain = domain_of(url)
+        max_bytes = page_limit(get_domain_config(domain))
+        trace = RequestTrace(domain)
+        headers = self.monitor.request_headers() if full else self.conditional_headers(data, fetch_url)
+        async with client.stream('GET', fetch_url, headers=headers, extensions={'trace': trace}) as response:
+            if response.status_code == 304:
+                return self.unchanged_info(data, 304)
+            if extractor and not response.is_success:
+                return None
+            response.raise_for_status()
+            started = time.perf_counter()
+            # Con una ricetta dello stato incorporato la lettura si ferma dopo il suo blob
+            detect = (self.state.signal_blocks(url) or True) if extractor is None and not full else False
+            body, truncated, signal = await read_body_async(response, max_bytes, detect=detect)
+            registry.observe('download', time.perf_counter() - started, domain)
+            registry.count('download_bytes_total', len(body), domain)
+            if truncated:
+                logger.warning(f"Pagina troncata a {max_bytes} byte: {fetch_url}")
+
+            headers = response.headers
+            status_code = response.status_code
+            page_text = decode_body(body, response)
+
+        content_hash = hashlib.sha1(body).hexdigest()
+        # Da qui in poi serve solo il testo: niente doppia copia della pagina
+        del body
+        validators = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'content_hash': content_hash,
+            'validator_url': fetch_url
+        }
+
+        if (data.get('in_stock') is not None and data.get('content_hash') == content_hash
+                and data.get('validator_url', data['url']) == fetch_url):
+            # Stesso contenuto anche senza validatori del server: niente parsing
+            product_info = self.unchanged_info(data, status_code)
+        elif extractor:
+            try:
+                product_info = extractor.extract(url, page_text, page_text)
+            except ValueError as e:
+                logger.warning(f"Risposta {extractor.name} non valida per {url}: {e}")
+                product_info = None
+            if product_info is None:
+                return None
+            product_info['status_code'] = status_code
+        else:
+            # Impronta e parsing sono CPU-bound: li eseguiamo in un thread separato
+            partial = signal is not None and signal.structured
+            product_info = await asyncio.to_thread(
+                self.parse_if_changed, url, data, fetch_url, page_text, status_code, validators, partial
+            )
+            if product_info is None:
+                logger.debug(f"Dati strutturati assenti nella pagina tagliata, lettura completa: {fetch_url}")
+                product_info = await self.fetch(url, data, fetch_url, full=True)
+                if data.get('state_recipe') and 'state_recipe' not in product_info and self.state.recipe(domain) is None:
+                    # Ricetta scartata sulla pagina tagliata: non va riproposta ai prossimi controlli
+                    product_info['state_recipe'] = None
+                return product_info
+
+        product_info['validators'] = validators
+        return product_info
+
+    async def fetch_product_info(self, url, data):
+        """Scarica il prodotto usando l'endpoint più leggero disponibile per il dominio"""
+        try:
+            extractor = self.extractors.for_url(url)
+            endpoint = extractor.endpoint(url) if extractor else None
+            product_info = None
+            if endpoint:
+                product_info = await self.fetch(url, data, endpoint, extractor)
+            if product_info is None:
+                product_info = await self.fetch(url, data, url)
+            product_info['platform'] = self.extractors.platform(url)
+            return product_info
+        except Exception as e:
+            logger.error(f"Errore nel controllo prodotto {url}: {e}")
+            return self.monitor.error_info(e)
+
+    async def fetch_limited(self, semaphore, url, data):
+        """Scarica un prodotto rispettando i limiti globali e dell'host"""
+        # Prima lo slot dell'host, poi quello globale: chi aspetta il proprio
+        # host non occupa posti che potrebbero servire ad altri negozi
+        domain = domain_of(url)
+        queued = time.perf_counter()
+        async with self.limiter.slot(url):
+            async with semaphore:
+                logger.info(f"Controllo prodotto: {data['name']}")
+                started = time.perf_counter()
+                registry.observe('wait', started - queued, domain)
+                product_info = await self.fetch_product_info(url, data)
+                product_info['latency'] = time.perf_counter() - started
+        registry.observe('check', product_info['latency'], domain)
+        registry.count('checks_total', domain=domain, outcome=self.outcome(product_info))
+        return product_info
+
+    def outcome(self, product_info):
+        """Esito di un controllo per le metriche"""
+        if product_info.get('error'):
+            return 'error'
+        if product_info.get('status_code') == 304:
+            return 'not_modified'
+        if product_info.get('not_modified'):
+            return 'unchanged'
+        return 'parsed'
+
+    async def check_product(self, semaphore, url, data, progress=None):
+        """Controlla un singolo prodotto e ne calcola le differenze"""
+        product_info = await self.fetch_limited(semaphore, url, data)
+        await self.monitor.scheduler.prepare_windows(url, data)
+        result = self.monitor.apply_check_result(url, data, product_info)
+        if progress:
+            progress(result)
+        return result
+
+    async def run(self, urls=None, progress=None):
+        """Controlla tutti i prodotti (o solo quelli indicati) e restituisce i risultati
+
+        progress, se indicato, viene chiamato con ogni risultato appena pronto.
+        """
+        links = self.monitor.monitored_links
+        if urls is None:
+            urls = list(links)
+
+        urls = [url for url in urls if url in links]
+
+        if self.limiter is None:
+            self.limiter = DomainRateLimiter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        # I task partono alternando i domini, i risultati restano nell'ordine dei link
+        tasks = {
+            url: asyncio.ensure_future(self.check_product(semaphore, url, links[url], progress))
+            for url in interleave_by_domain(urls)
+        }
+        return await asyncio.gather(*(tasks[url] for url in urls))
+
+    async def fetch_all(self, links, progress=None):
+        """Scarica i prodotti indicati ({url: dati}) senza aggiornare i link monitorati
+
+        Restituisce {url: informazioni}; progress riceve (url, informazioni).
+        """
+        if self.limiter is None:
+            self.limiter = DomainRateLimiter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_one(url):
+            product_info = await self.fetch_limited(semaphore, url, links[url])
+            if progress:
+                progress(url, product_info)
+            return url, product_info
+
+        results = await asyncio.gather(*(fetch_one(url) for url in interleave_by_domain(list(links))))
+        return dict(results)
+
+
+class SharedSweep:
+    """Controllo in corso condiviso da tutti quelli che lo richiedono mentre è attivo
+
+    Chi si aggancia a un controllo già avviato riceve subito i risultati
+    pronti e poi gli altri man mano che arrivano.
+    """
+
+    def __init__(self, run):
+        self.results = []
+        self.listeners = []
+        self.task = asyncio.ensure_future(run(self.notify))
+
+    def notify(self, result):
+        self.results.append(result)
+        for listener in list(self.listeners):
+            try:
+                listener(result)
+            except Exception as e:
+                logger.error(f"Errore nell'aggiornamento dell'avanzamento: {e}")
+
+    def subscribe(self, listener):
+        for result in self.results:
+            listener(result)
+        self.listeners.append(listener)
+
+    async def wait(self):
+        # shield: chi smette di aspettare non interrompe il controllo degli altri
+        return await asyncio.shield(self.task)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Configurazione per dominio dei negozi monitorati
+I valori predefiniti possono essere sovrascritti nel file domain_config.json
+"""
+
+import os
+import json
+import logging
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# File opzionale con le impostazioni per dominio
+DOMAIN_CONFIG_FILE = os.environ.get('DOMAIN_CONFIG_FILE', 'domain_config.json')
+
+# Impostazioni usate per i domini senza configurazione specifica
+DEFAULT_DOMAIN_CONFIG = {
+    'rate': 0.5,           # richieste al secondo verso lo stesso host
+    'burst': 2,            # richieste consecutive concesse senza attesa
+    'max_in_flight': 2,    # richieste contemporanee verso lo stesso host
+    'pool_size': 4,        # connessioni massime nel pool dell'host
+    'pool_keepalive': 4,   # connessioni tenute aperte tra un controllo e l'altro
+    'keepalive_expiry': 60,
+}
+
+_file_config = None
+
+
+def domain_of(url):
+    """Restituisce il dominio di un URL senza 'www.'"""
+    netloc = urlparse(url).netloc.lower()
+    if netloc.startswith('www.'):
+        netloc = netloc[4:]
+    return netloc
+
+
+def normalize_url(url):
+    """URL in forma canonica: schema (https se manca), host in minuscolo, senza frammento"""
+    url = url.strip()
+    if not url.lower().startswith(('http://', 'https://')):
+        url = 'https://' + url
+    parsed = urlparse(url)
+    return parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower(), fragment='').geturl()
+
+
+def load_domain_config(path=None):
+    """Carica (una sola volta) le impostazioni per dominio dal file JSON"""
+    global _file_config
+    if path is None and _file_config is not None:
+        return _file_config
+
+    path = path or DOMAIN_CONFIG_FILE
+    config = {}
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = {domain.lower(): values for domain, values in json.load(f).items()}
+        except Exception as e:
+            logger.error(f"Errore nel caricamento configurazione domini: {e}")
+
+    _file_config = config
+    return config
+
+
+def get_domain_config(domain):
+    """Impostazioni effettive per un dominio
+
+    Cerca prima il dominio esatto e poi i domini padre
+    (es. 'global.ippodo-tea.co.jp' usa anche 'ippodo-tea.co.jp').
+    """
+    overrides = load_domain_config()
+    config = dict(DEFAULT_DOMAIN_CONFIG)
+
+    parts = domain.lower().split('.')
+    # Dal dominio più generico al più specifico, così vince il più specifico
+    for i in range(len(parts) - 1, -1, -1):
+        candidate = '.'.join(parts[i:])
+        if candidate in overrides:
+            config.update(overrides[candidate])
+
+    return config
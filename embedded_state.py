@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Disponibilità e prezzo dallo stato incorporato nelle pagine
+Molti negozi disegnano la disponibilità nel browser: l'HTML contiene solo
+il modello della pagina, ma i dati sono nello stato incorporato
+(__NEXT_DATA__, window.__INITIAL_STATE__, ShopifyAnalytics.meta, JSON dei
+temi Shopify). Al primo controllo di un dominio si cerca in questi blob
+l'oggetto con disponibilità e prezzo e se ne ricava una "ricetta" (blob,
+percorso e chiavi), salvata con i link; i controlli successivi leggono solo
+quel blob. Si può indicare la ricetta per dominio con 'state_recipe' e
+disattivare l'estrattore con 'embedded_state': false.
+"""
+
+import re
+import json
+import html
+import logging
+
+from domain_config import domain_of, get_domain_config
+from extractors import AVAILABLE_STATES, Extractor, format_price
+from streaming import SignalBlock
+
+logger = logging.getLogger(__name__)
+
+# Inizio dei blob: script JSON con id (o data-product-json), variabili window.__X__ e meta di Shopify
+JSON_SCRIPT_RE = re.compile(r'<script\b([^>]*\btype=["\']application/json["\'][^>]*)>', re.IGNORECASE)
+SCRIPT_ID_RE = re.compile(r'\bid=["\']([^"\']+)["\']|\b(data-product-json)\b', re.IGNORECASE)
+WINDOW_STATE_RE = re.compile(r'\bwindow\.(__[A-Za-z0-9_]+__)\s*=\s*')
+SHOPIFY_META_RE = re.compile(r'\bvar meta\s*=\s*(?=\{)')
+SHOPIFY_META = 'ShopifyAnalytics.meta'
+
+# Stringhe JSON e parentesi, per trovare la fine di un oggetto assegnato in uno script
+JSON_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]]', re.DOTALL)
+TITLE_TAG_RE = re.compile(r'<title[^>]*>(.*?)</title\s*>', re.IGNORECASE | re.DOTALL)
+
+# Dimensione massima di un blob analizzato
+MAX_BLOB_CHARS = 4 * 1024 * 1024
+
+# Nodi visitati al massimo per imparare una ricetta
+MAX_LEARN_NODES = 50000
+
+AVAILABILITY_KEYS = (
+    'available', 'availability', 'isAvailable', 'is_available', 'availableForSale', 'available_for_sale',
+    'inStock', 'in_stock', 'isInStock', 'is_in_stock', 'stockStatus', 'stock_status',
+)
+SOLD_OUT_KEYS = ('soldOut', 'sold_out', 'isSoldOut', 'is_sold_out', 'outOfStock', 'out_of_stock', 'isOutOfStock')
+PRICE_KEYS = (
+    'price', 'salePrice', 'sale_price', 'currentPrice', 'current_price', 'finalPrice', 'final_price',
+    'priceAmount', 'price_amount', 'priceCents', 'price_cents',
+)
+# Chiavi dell'importo quando il prezzo è un oggetto ({"amount": ..., "currencyCode": ...})
+AMOUNT_KEYS = ('amount', 'value', 'centAmount', 'cents', 'amountInCents')
+CURRENCY_KEYS = ('currency', 'currencyCode', 'currency_code', 'priceCurrency')
+TITLE_KEYS = ('title', 'name', 'productName', 'product_name')
+
+UNAVAILABLE_STATES = {
+    'false', 'no', 'outofstock', 'out_of_stock', 'out of stock', 'soldout', 'sold_out', 'sold out',
+    'unavailable', 'discontinued', 'notavailable', 'not_available',
+}
+AVAILABLE_WORDS = {'true', 'yes', 'available', 'in_stock', 'in stock'}
+
+# Blob di Shopify: i prezzi interi sono in centesimi
+SHOPIFY_BLOBS = (SHOPIFY_META, 'data-product-json')
+
+_loads = None
+
+
+def json_loads(text):
+    """orjson se installato (pip install orjson, molto più veloce sui blob grandi), altrimenti json"""
+    global _loads
+    if _loads is None:
+        try:
+            import orjson
+            _loads = orjson.loads
+        except ImportError:
+            _loads = json.loads
+    return _loads(text)
+
+
+def value_end(text, start):
+    """Fine dell'oggetto o array JSON che inizia a start (None se non si chiude entro MAX_BLOB_CHARS)"""
+    depth = 0
+    for match in JSON_TOKEN_RE.finditer(text, start, start + MAX_BLOB_CHARS):
+        token = match.group(0)
+        if token[0] == '"':
+            continue
+        depth += 1 if token in '{[' else -1
+        if depth == 0:
+            return match.end()
+    return None
+
+
+def parse_assigned(page_text, start):
+    """Valore assegnato a partire da start: oggetto letterale oppure JSON.parse("...")"""
+    if page_text.startswith('JSON.parse(', start):
+        text, _ = json.JSONDecoder().raw_decode(page_text, start + len('JSON.parse('))
+        return json_loads(text)
+    if page_text[start:start + 1] not in ('{', '['):
+        raise ValueError("Valore non JSON")
+    end = value_end(page_text, start)
+    if end is None:
+        raise ValueError("Blob non chiuso")
+    return json_loads(page_text[start:end])
+
+
+def parse_script(page_text, start):
+    """Contenuto JSON di uno script che inizia a start"""
+    end = page_text.find('</script', start, start + MAX_BLOB_CHARS)
+    if end == -1:
+        raise ValueError("Script non chiuso")
+    return json_loads(page_text[start:end].strip())
+
+
+def find_blobs(page_text):
+    """Tutti i blob di stato della pagina: [(nome, valore)]"""
+    blobs = []
+    for match in JSON_SCRIPT_RE.finditer(page_text):
+        id_match = SCRIPT_ID_RE.search(match.group(1))
+        if not id_match:
+            continue
+        blobs.append((id_match.group(1) or id_match.group(2), parse_script, match.end()))
+    for match in WINDOW_STATE_RE.finditer(page_text):
+        blobs.append((f"window.{match.group(1)}", parse_assigned, match.end()))
+    for match in SHOPIFY_META_RE.finditer(page_text):
+        blobs.append((SHOPIFY_META, parse_assigned, match.end()))
+
+    parsed = []
+    for name, parse, start in blobs:
+        try:
+            parsed.append((name, parse(page_text, start)))
+        except ValueError:
+            continue
+    return parsed
+
+
+def find_blob(page_text, name):
+    """Solo il blob indicato dalla ricetta, cercato direttamente (None se assente)"""
+    if name == SHOPIFY_META:
+        match = SHOPIFY_META_RE.search(page_text)
+        return parse_assigned(page_text, match.end()) if match else None
+    if name.startswith('window.'):
+        match = re.search(rf'\b{re.escape(name)}\s*=\s*', page_text)
+        return parse_assigned(page_text, match.end()) if match else None
+    attribute = r'\bdata-product-json\b' if name == 'data-product-json' else rf'\bid=["\']{re.escape(name)}["\']'
+    match = re.search(rf'<script\b[^>]*{attribute}[^>]*>', page_text, re.IGNORECASE)
+    return parse_script(page_text, match.end()) if match else None
+
+
+def signal_of(name):
+    """Apertura del blob per streaming.SignalDetector (minuscola, come il testo che confronta)"""
+    if name == SHOPIFY_META:
+        return b'var meta'
+    return name.lower().encode('utf-8')
+
+
+def availability_value(value, sold_out=False):
+    """True/False dal valore di una chiave di disponibilità, None se non interpretabile"""
+    if isinstance(value, bool):
+        available = value
+    elif isinstance(value, (int, float)):
+        available = value > 0
+    elif isinstance(value, str):
+        state = value.rsplit('/', 1)[-1].strip().lower()
+        if state in AVAILABLE_STATES or state in AVAILABLE_WORDS:
+            available = True
+        elif state in UNAVAILABLE_STATES:
+            available = False
+        else:
+            return None
+    else:
+        return None
+    return not available if sold_out else available
+
+
+def first_key(node, keys):
+    return next((key for key in keys if key in node), None)
+
+
+def price_path(node):
+    """Percorso relativo dell'importo nell'oggetto ([chiave] o [chiave, sottochiave])"""
+    for key in PRICE_KEYS:
+        value = node.get(key)
+        if isinstance(value, (int, float, str)) and not isinstance(value, bool) and value != '':
+            return [key]
+        if isinstance(value, dict):
+            amount = first_key(value, AMOUNT_KEYS)
+            if amount is not None:
+                return [key, amount]
+    return None
+
+
+def currency_path(node, price):
+    """Percorso della valuta: accanto all'importo o nell'oggetto"""
+    if price and len(price) == 2 and isinstance(node.get(price[0]), dict):
+        key = first_key(node[price[0]], CURRENCY_KEYS)
+        if key:
+            return [price[0], key]
+    key = first_key(node, CURRENCY_KEYS)
+    return [key] if key else None
+
+
+def product_recipe(blob, node, path):
+    """Ricetta per l'oggetto node (None se non riporta una disponibilità interpretabile)"""
+    key = first_key(node, AVAILABILITY_KEYS)
+    sold_out = False
+    if key is None or availability_value(node[key]) is None:
+        key = first_key(node, SOLD_OUT_KEYS)
+        sold_out = True
+        if key is None or availability_value(node[key]) is None:
+            return None
+    price = price_path(node)
+    divisor = 1
+    if price:
+        amount = resolve(node, price)
+        if any(word in price[-1].lower() for word in ('cent', 'minor')) or (
+                blob in SHOPIFY_BLOBS and isinstance(amount, int)):
+            divisor = 100
+    return {
+        'blob': blob,
+        'path': path,
+        'availability': key,
+        'sold_out': sold_out,
+        'price': price,
+        'price_divisor': divisor,
+        'currency': currency_path(node, price),
+        'title': first_key(node, TITLE_KEYS),
+    }
+
+
+def learn_recipe(blobs):
+    """Prima ricetta trovata visitando i blob in ampiezza (prima gli oggetti con anche il prezzo)"""
+    fallback = None
+    for name, value in blobs:
+        queue = [(value, [])]
+        visited = 0
+        while queue and visited < MAX_LEARN_NODES:
+            next_queue = []
+            for node, path in queue:
+                visited += 1
+                if isinstance(node, dict):
+                    recipe = product_recipe(name, node, path)
+                    if recipe and recipe['price']:
+                        return recipe
+                    if recipe and fallback is None:
+                        fallback = recipe
+                    next_queue.extend((child, path + [key]) for key, child in node.items()
+                                      if isinstance(child, (dict, list)))
+                elif isinstance(node, list):
+                    next_queue.extend((child, path + [i]) for i, child in enumerate(node)
+                                      if isinstance(child, (dict, list)))
+            queue = next_queue
+    return fallback
+
+
+def resolve(node, path):
+    """Valore al percorso (chiavi e indici), None se manca"""
+    for key in path:
+        if isinstance(node, dict):
+            node = node.get(key)
+        elif isinstance(node, list) and isinstance(key, int) and -len(node) <= key < len(node):
+            node = node[key]
+        else:
+            return None
+    return node
+
+
+def apply_recipe(recipe, blob):
+    """Informazioni del prodotto secondo la ricetta, None se il blob non corrisponde più"""
+    node = resolve(blob, recipe['path'])
+    if not isinstance(node, dict) or recipe['availability'] not in node:
+        return None
+    in_stock = availability_value(node[recipe['availability']], recipe.get('sold_out', False))
+    if in_stock is None:
+        return None
+
+    price = None
+    amount = resolve(node, recipe['price']) if recipe.get('price') else None
+    currency = resolve(node, recipe['currency']) if recipe.get('currency') else None
+    currency = currency if isinstance(currency, str) and len(currency) == 3 else None
+    if isinstance(amount, str) and not amount.replace('.', '', 1).isdigit():
+        # Prezzo già formattato ("24,90 €"): lo interpreta pricing.py
+        price = amount
+    elif amount not in (None, ''):
+        try:
+            price = format_price(float(amount) / (recipe.get('price_divisor') or 1), currency)
+        except (TypeError, ValueError):
+            price = None
+
+    title = node.get(recipe['title']) if recipe.get('title') else None
+    return {
+        'title': html.unescape(str(title))[:100] if title else None,
+        'price': price,
+        'in_stock': in_stock,
+    }
+
+
+class EmbeddedStateExtractor(Extractor):
+    """Estrattore dello stato incorporato, con una ricetta per dominio"""
+
+    name = 'state'
+
+    def __init__(self, links=None):
+        self.recipes = {}
+        # La ricetta imparata viene salvata nei dati di ogni link
+        for url, data in (links or {}).items():
+            if data.get('state_recipe'):
+                self.recipes[domain_of(url)] = data['state_recipe']
+
+    def recipe(self, domain):
+        config = get_domain_config(domain)
+        return config.get('state_recipe') or self.recipes.get(domain)
+
+    def active_recipe(self, domain):
+        """Ricetta del dominio se l'estrattore è attivo, altrimenti None"""
+        if get_domain_config(domain).get('embedded_state') is False:
+            return None
+        return self.recipe(domain)
+
+    def signal_blocks(self, url):
+        """Blocchi che chiudono il download della pagina dopo il blob della ricetta (None senza ricetta)"""
+        recipe = self.active_recipe(domain_of(url))
+        if not recipe:
+            return None
+        return (SignalBlock(signal_of(recipe['blob']), b'</script', structured=True),)
+
+    def detect(self, page_text):
+        return learn_recipe(find_blobs(page_text)) is not None
+
+    def extract(self, url, content, page_text):
+        domain = domain_of(url)
+        config = get_domain_config(domain)
+        if config.get('embedded_state') is False:
+            return None
+
+        recipe = self.recipe(domain)
+        product_info = None
+        if recipe:
+            try:
+                blob = find_blob(page_text, recipe['blob'])
+            except ValueError:
+                blob = None
+            product_info = apply_recipe(recipe, blob) if blob is not None else None
+            if product_info is None and not config.get('state_recipe'):
+                logger.info(f"Ricetta dello stato non più valida per {domain}")
+                self.recipes.pop(domain, None)
+                recipe = None
+
+        if product_info is None and not config.get('state_recipe'):
+            blobs = find_blobs(page_text)
+            recipe = learn_recipe(blobs)
+            if recipe is None:
+                return None
+            product_info = apply_recipe(recipe, next(value for name, value in blobs if name == recipe['blob']))
+            if product_info is None:
+                return None
+            self.recipes[domain] = recipe
+            logger.info(f"Ricetta dello stato per {domain}: {recipe['blob']} {recipe['path']}")
+
+        if product_info is None:
+            return None
+        if not product_info['title']:
+            title = TITLE_TAG_RE.search(page_text)
+            product_info['title'] = html.unescape(title.group(1).strip())[:100] if title else 'Prodotto sconosciuto'
+        product_info['state_recipe'] = recipe
+        return product_info
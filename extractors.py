@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Estrattori di dati strutturati per piattaforme e-commerce
+Per Shopify e WooCommerce si usano gli endpoint JSON del prodotto,
+per gli altri siti il blocco JSON-LD della pagina; le euristiche HTML
+di ProductMonitor restano come ultima risorsa.
+"""
+
+import re
+import json
+import html
+import logging
+from urllib.parse import urlparse, parse_qs
+
+from domain_config import domain_of, get_domain_config
+from pricing import CURRENCY_SYMBOLS, ZERO_DECIMAL_CURRENCIES
+
+logger = logging.getLogger(__name__)
+
+JSON_LD_RE = re.compile(
+    r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>',
+    re.IGNORECASE | re.DOTALL
+)
+
+# Valori di schema.org/ItemAvailability che indicano un prodotto acquistabile
+AVAILABLE_STATES = {
+    'instock', 'limitedavailability', 'onlineonly', 'instoreonly',
+    'preorder', 'presale', 'backorder'
+}
+
+def format_price(amount, currency=None):
+    """Formatta un importo numerico come stringa di prezzo"""
+    if amount is None:
+        return None
+    try:
+        value = float(amount)
+    except (TypeError, ValueError):
+        return str(amount)
+    decimals = 0 if currency in ZERO_DECIMAL_CURRENCIES else 2
+    text = f"{value:.{decimals}f}"
+    if currency:
+        return f"{CURRENCY_SYMBOLS.get(currency, currency)} {text}"
+    return text
+
+
+class Extractor:
+    """Estrattore base: sottoclassi per ogni piattaforma"""
+
+    name = 'html'
+
+    def detect(self, page_text):
+        """True se la pagina appartiene alla piattaforma"""
+        return False
+
+    def endpoint(self, url):
+        """URL da scaricare al posto della pagina (None = usa la pagina)"""
+        return None
+
+    def extract(self, url, content, page_text):
+        """Restituisce le informazioni del prodotto o None se non trovate"""
+        return None
+
+
+class ShopifyExtractor(Extractor):
+    """Usa /products/<handle>.js, con disponibilità per variante
+
+    L'endpoint non indica la valuta: si usa la chiave 'currency' della
+    configurazione del dominio, altrimenti quella salvata con il link.
+    """
+
+    name = 'shopify'
+    PRODUCT_PATH_RE = re.compile(r'^(.*/products/[^/.?#]+)')
+
+    def detect(self, page_text):
+        return 'cdn.shopify.com' in page_text or 'Shopify.shop' in page_text
+
+    def endpoint(self, url):
+        parsed = urlparse(url)
+        match = self.PRODUCT_PATH_RE.match(parsed.path)
+        if not match:
+            return None
+        return f"{parsed.scheme}://{parsed.netloc}{match.group(1)}.js"
+
+    def extract(self, url, content, page_text):
+        product = json.loads(content)
+        currency = get_domain_config(domain_of(url)).get('currency')
+        variants = [
+            {
+                'id': variant.get('id'),
+                'title': variant.get('title'),
+                'available': bool(variant.get('available')),
+                'price': format_price(variant['price'] / 100, currency) if variant.get('price') is not None else None
+            }
+            for variant in product.get('variants', [])
+        ]
+
+        # Se il link punta a una variante specifica usiamo solo quella
+        variant_id = parse_qs(urlparse(url).query).get('variant', [None])[0]
+        selected = next((v for v in variants if str(v['id']) == variant_id), None)
+
+        if selected:
+            in_stock = selected['available']
+            price = selected['price']
+        else:
+            in_stock = bool(product.get('available'))
+            price = format_price(product['price'] / 100, currency) if product.get('price') is not None else None
+
+        return {
+            'title': (product.get('title') or '')[:100],
+            'price': price,
+            'in_stock': in_stock,
+            'variants': variants
+        }
+
+
+class WooCommerceExtractor(Extractor):
+    """Usa la Store API di WooCommerce (/wp-json/wc/store/v1/products?slug=...)"""
+
+    name = 'woocommerce'
+
+    def detect(self, page_text):
+        return 'wp-content/plugins/woocommerce' in page_text or 'woocommerce-page' in page_text
+
+    def endpoint(self, url):
+        parsed = urlparse(url)
+        segments = [s for s in parsed.path.split('/') if s]
+        if len(segments) < 2:
+            return None
+        return f"{parsed.scheme}://{parsed.netloc}/wp-json/wc/store/v1/products?slug={segments[-1]}"
+
+    def extract(self, url, content, page_text):
+        products = json.loads(content)
+        if not products:
+            return None
+        product = products[0]
+
+        price = None
+        prices = product.get('prices') or {}
+        if prices.get('price'):
+            minor_unit = int(prices.get('currency_minor_unit', 2))
+            price = format_price(int(prices['price']) / 10 ** minor_unit, prices.get('currency_code'))
+
+        return {
+            'title': html.unescape(product.get('name') or '')[:100],
+            'price': price,
+            'in_stock': bool(product.get('is_in_stock'))
+        }
+
+
+class JsonLdExtractor(Extractor):
+    """Legge Product/ProductGroup e Offer dal JSON-LD incorporato nella pagina"""
+
+    name = 'jsonld'
+
+    def detect(self, page_text):
+        return self.extract(None, None, page_text) is not None
+
+    def _products(self, node):
+        """Trova ricorsivamente i nodi Product e ProductGroup (anche dentro @graph)"""
+        if isinstance(node, list):
+            for item in node:
+                yield from self._products(item)
+        elif isinstance(node, dict):
+            types = node.get('@type')
+            types = types if isinstance(types, list) else [types]
+            if 'Product' in types or 'ProductGroup' in types:
+                yield node
+            elif '@graph' in node:
+                yield from self._products(node['@graph'])
+
+    def _product_offers(self, product):
+        """(offerta, nome della variante) del prodotto e, per un ProductGroup, delle varianti in hasVariant"""
+        for offer in self._offers(product.get('offers')):
+            yield offer, None
+        variants = product.get('hasVariant')
+        for variant in variants if isinstance(variants, list) else [variants]:
+            if isinstance(variant, dict):
+                for offer in self._offers(variant.get('offers')):
+                    yield offer, variant.get('name')
+
+    def _offers(self, offers):
+        if isinstance(offers, list):
+            for offer in offers:
+                yield from self._offers(offer)
+        elif isinstance(offers, dict):
+            if 'offers' in offers:
+                # AggregateOffer
+                yield from self._offers(offers['offers'])
+            else:
+                yield offers
+
+    def extract(self, url, content, page_text):
+        for block in JSON_LD_RE.findall(page_text):
+            product_info = self.extract_block(block)
+            if product_info is not None:
+                return product_info
+        return None
+
+    def extract_block(self, block):
+        """Informazioni del primo prodotto con offerte nel testo di un blocco JSON-LD, o None"""
+        try:
+            data = json.loads(block.strip())
+        except ValueError:
+            return None
+
+        for product in self._products(data):
+            variants = []
+            for offer, variant_name in self._product_offers(product):
+                if not isinstance(offer, dict):
+                    continue
+                availability = str(offer.get('availability', '')).rsplit('/', 1)[-1].lower()
+                if not availability:
+                    continue
+                variants.append({
+                    'id': offer.get('sku'),
+                    'title': offer.get('name') or variant_name,
+                    'available': availability in AVAILABLE_STATES,
+                    'price': format_price(offer.get('price'), offer.get('priceCurrency'))
+                    if offer.get('price') not in (None, '') else None
+                })
+
+            if variants:
+                available = [v for v in variants if v['available']]
+                priced = available or variants
+                return {
+                    'title': html.unescape(str(product.get('name') or ''))[:100],
+                    'price': next((v['price'] for v in priced if v['price']), None),
+                    'in_stock': bool(available),
+                    'variants': variants
+                }
+        return None
+
+
+class ExtractorRegistry:
+    """Sceglie l'estrattore per ogni dominio, rilevando la piattaforma una sola volta"""
+
+    # Ordine di rilevamento: le piattaforme con endpoint dedicato prima del JSON-LD
+    EXTRACTORS = [ShopifyExtractor(), WooCommerceExtractor(), JsonLdExtractor()]
+    FALLBACK = Extractor()
+
+    def __init__(self, links=None):
+        self.by_name = {e.name: e for e in self.EXTRACTORS + [self.FALLBACK]}
+        self.platforms = {}
+        # La piattaforma già rilevata viene salvata nei dati di ogni link
+        for url, data in (links or {}).items():
+            if data.get('platform') in self.by_name:
+                self.platforms[domain_of(url)] = data['platform']
+
+    def for_url(self, url):
+        """Estrattore del dominio, o None se la piattaforma non è ancora nota"""
+        name = self.platforms.get(domain_of(url))
+        return self.by_name[name] if name else None
+
+    def detect(self, url, page_text):
+        """Rileva la piattaforma del dominio a partire dall'HTML di una pagina"""
+        domain = domain_of(url)
+        if domain not in self.platforms:
+            extractor = next((e for e in self.EXTRACTORS if e.detect(page_text)), self.FALLBACK)
+            self.platforms[domain] = extractor.name
+            logger.info(f"Piattaforma rilevata per {domain}: {extractor.name}")
+        return self.by_name[self.platforms[domain]]
+
+    def platform(self, url):
+        return self.platforms.get(domain_of(url))
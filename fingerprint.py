@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Impronta della parte della pagina che descrive il prodotto
+Si calcola l'hash solo delle regioni utili (offerta JSON-LD, form di
+acquisto, nodo del prezzo e, con una ricetta dello stato incorporato, il
+valore che la ricetta legge), ripulite da token CSRF e spazi: se coincide
+con quella del controllo precedente la pagina non viene analizzata, anche
+quando script, token o statistiche della pagina sono cambiati.
+"""
+
+import re
+import json
+import hashlib
+
+from domain_config import get_domain_config
+from embedded_state import find_blob, resolve
+
+JSON_LD_RE = re.compile(
+    r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>.*?</script\s*>',
+    re.IGNORECASE | re.DOTALL
+)
+FORM_RE = re.compile(r'<form\b.*?</form\s*>', re.IGNORECASE | re.DOTALL)
+PRICE_NODE_RE = re.compile(r'<[a-z][^>]*\bclass=["\'][^"\']*price[^"\']*["\'][^>]*>.{0,300}', re.IGNORECASE | re.DOTALL)
+
+# Form di acquisto (Shopify, WooCommerce e simili)
+PRODUCT_FORM_MARKERS = ('/cart/add', 'add-to-cart', 'add_to_cart', 'addtocart')
+
+# Parti che cambiano a ogni richiesta senza che cambi il prodotto
+VOLATILE_RE = re.compile(
+    r'<input\b[^>]*type=["\']?hidden[^>]*>'
+    r'|\s(?:nonce|data-csrf|data-token|data-request-id)=["\'][^"\']*["\']'
+    r'|<!--.*?-->',
+    re.IGNORECASE | re.DOTALL
+)
+SPACES_RE = re.compile(r'\s+')
+
+# Nodi del prezzo considerati (i primi della pagina)
+MAX_PRICE_NODES = 3
+
+_domain_patterns = {}
+
+
+def region_patterns(domain):
+    """Espressioni regolari personalizzate del dominio ('fingerprint_regions'), None se non ce ne sono"""
+    if domain not in _domain_patterns:
+        patterns = get_domain_config(domain).get('fingerprint_regions') if domain else None
+        _domain_patterns[domain] = [re.compile(p, re.IGNORECASE | re.DOTALL) for p in patterns] if patterns else None
+    return _domain_patterns[domain]
+
+
+def state_region(page_text, recipe):
+    """Valore che la ricetta dello stato incorporato legge, serializzato (None se manca)"""
+    try:
+        blob = find_blob(page_text, recipe['blob'])
+    except ValueError:
+        return None
+    node = resolve(blob, recipe['path']) if blob is not None else None
+    if node is None:
+        return None
+    return json.dumps(node, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def product_regions(page_text, domain=None, recipe=None):
+    """Regioni della pagina che determinano disponibilità e prezzo
+
+    Senza una regione che riporti la disponibilità (offerta JSON-LD, form
+    di acquisto o valore della ricetta) restituisce una lista vuota: il solo
+    prezzo non basta. Con una ricetta dello stato incorporato la disponibilità
+    sta nel suo blob, che entra sempre nell'impronta; se il blob manca la
+    lista è vuota e la pagina va analizzata.
+    """
+    state = []
+    if recipe:
+        region = state_region(page_text, recipe)
+        if region is None:
+            return []
+        state.append(region)
+
+    patterns = region_patterns(domain)
+    if patterns:
+        return state + [match.group(0) for pattern in patterns for match in pattern.finditer(page_text)]
+
+    regions = state + [block for block in JSON_LD_RE.findall(page_text) if 'availability' in block.lower()]
+    for form in FORM_RE.findall(page_text):
+        lower = form.lower()
+        if any(marker in lower for marker in PRODUCT_FORM_MARKERS):
+            regions.append(form)
+    if not regions:
+        return []
+    regions.extend(match.group(0) for _, match in zip(range(MAX_PRICE_NODES), PRICE_NODE_RE.finditer(page_text)))
+    return regions
+
+
+def region_fingerprint(page_text, domain=None, recipe=None):
+    """Hash delle regioni del prodotto (None se la pagina non ne ha o il dominio lo disattiva)
+
+    recipe è la ricetta dello stato incorporato del dominio, se ce n'è una.
+    """
+    config = get_domain_config(domain) if domain else {}
+    if config.get('fingerprint') is False:
+        return None
+    regions = product_regions(page_text, domain, recipe)
+    if not regions:
+        return None
+    digest = hashlib.sha1()
+    # Cambiando lingue o parole chiave del dominio le impronte salvate non valgono più
+    digest.update(repr((config.get('languages'), config.get('keywords'))).encode('utf-8'))
+    for region in regions:
+        digest.update(SPACES_RE.sub(' ', VOLATILE_RE.sub('', region)).strip().encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
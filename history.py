@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Storico dei controlli (solo aggiunta)
+Ogni controllo registra ora, disponibilità, prezzo numerico, latenza e
+codice HTTP. I record di ogni link sono raggruppati in blocchi con codifica
+delta + varint (pochi byte per controllo); i blocchi completi non cambiano
+più e vengono compressi con zlib.
+"""
+
+import os
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from pricing import parse_price
+from storage import LINKS_DB
+
+logger = logging.getLogger(__name__)
+
+# Database dello storico (default: lo stesso dei link)
+HISTORY_DB = os.environ.get('HISTORY_DB', LINKS_DB)
+
+# Record per blocco: oltre questo numero il blocco viene chiuso e compresso
+CHUNK_RECORDS = 1024
+
+# Disponibilità nel record
+STOCK_UNKNOWN = 0
+STOCK_NO = 1
+STOCK_YES = 2
+
+# Bit del byte di flag (i primi due bit sono la disponibilità)
+FLAG_HAS_PRICE = 4
+FLAG_SAME_PRICE = 8
+FLAG_SAME_STATUS = 16
+FLAG_ERROR = 32
+
+CheckRecord = namedtuple('CheckRecord', 'ts stock price latency_ms status error')
+
+
+def price_minor(price):
+    """Prezzo in unità minime della valuta ('€ 1.234,50' -> 123450), None se assente"""
+    price = parse_price(price)
+    return price.minor if price else None
+
+
+def record_from_info(product_info, ts=None):
+    """Record di storico per il risultato di un controllo"""
+    in_stock = product_info.get('in_stock')
+    stock = STOCK_UNKNOWN if in_stock is None else (STOCK_YES if in_stock else STOCK_NO)
+    latency = product_info.get('latency')
+    return CheckRecord(
+        ts=int(ts if ts is not None else time.time()),
+        stock=stock,
+        price=product_info['price_minor'] if 'price_minor' in product_info else price_minor(product_info.get('price')),
+        latency_ms=int(latency * 1000) if latency is not None else 0,
+        status=int(product_info.get('status_code') or 0),
+        error=bool(product_info.get('error'))
+    )
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(value):
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+# Stato della codifica: (ts, ultimo prezzo noto, ultimo codice HTTP)
+INITIAL_STATE = (0, None, 0)
+
+
+def encode_record(out, record, state):
+    """Aggiunge a out il record codificato come differenza dallo stato; restituisce il nuovo stato"""
+    prev_ts, prev_price, prev_status = state
+
+    flags = record.stock
+    if record.price is not None:
+        flags |= FLAG_HAS_PRICE
+        if record.price == prev_price:
+            flags |= FLAG_SAME_PRICE
+    if record.status == prev_status:
+        flags |= FLAG_SAME_STATUS
+    if record.error:
+        flags |= FLAG_ERROR
+
+    write_varint(out, zigzag(record.ts - prev_ts))
+    out.append(flags)
+    if flags & FLAG_HAS_PRICE and not flags & FLAG_SAME_PRICE:
+        write_varint(out, zigzag(record.price - (prev_price or 0)))
+    if not flags & FLAG_SAME_STATUS:
+        write_varint(out, record.status)
+    write_varint(out, record.latency_ms)
+
+    return record.ts, record.price if record.price is not None else prev_price, record.status
+
+
+def decode_chunk(data):
+    """Record di un blocco, in ordine cronologico"""
+    pos = 0
+    ts = status = 0
+    price = None
+    end = len(data)
+    while pos < end:
+        delta, pos = read_varint(data, pos)
+        ts += unzigzag(delta)
+        flags = data[pos]
+        pos += 1
+        if flags & FLAG_HAS_PRICE:
+            if not flags & FLAG_SAME_PRICE:
+                delta, pos = read_varint(data, pos)
+                price = (price or 0) + unzigzag(delta)
+            record_price = price
+        else:
+            record_price = None
+        if not flags & FLAG_SAME_STATUS:
+            status, pos = read_varint(data, pos)
+        latency_ms, pos = read_varint(data, pos)
+        yield CheckRecord(ts, flags & 3, record_price, latency_ms, status, bool(flags & FLAG_ERROR))
+
+
+class Chunk:
+    """Blocco di record di un link ancora aperto alle aggiunte"""
+
+    def __init__(self, seq, data=b'', count=0, first_ts=None):
+        self.seq = seq
+        self.data = bytearray(data)
+        self.count = count
+        self.first_ts = first_ts
+        self.last_ts = first_ts
+        self.state = INITIAL_STATE
+        # Un blocco riaperto riparte dallo stato del suo ultimo record
+        price = None
+        for record in decode_chunk(self.data):
+            if record.price is not None:
+                price = record.price
+            self.state = (record.ts, price, record.status)
+            self.last_ts = record.ts
+
+    def append(self, record):
+        self.state = encode_record(self.data, record, self.state)
+        if self.first_ts is None:
+            self.first_ts = record.ts
+        self.last_ts = record.ts
+        self.count += 1
+
+
+class HistoryStore:
+    """Storico in SQLite: una riga per blocco di record di ogni link"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS history (
+            url TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            first_ts INTEGER NOT NULL,
+            last_ts INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            compressed INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (url, seq)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+        # Record in attesa del prossimo flush() e ultimo blocco scritto di ogni link
+        self.pending = {}
+        self.open_chunks = {}
+
+    def _latest_chunk(self, url):
+        """Blocco a cui aggiungere i record del link (dentro la transazione di flush())
+
+        Il blocco in memoria vale solo se nel database l'ultimo blocco è ancora
+        lo stesso (seq e numero di record): un altro processo sullo stesso
+        database (bot e runner) può averlo esteso nel frattempo, e allora
+        viene riletto.
+        """
+        row = self.conn.execute(
+            'SELECT seq, count, compressed FROM history WHERE url = ? ORDER BY seq DESC LIMIT 1', (url,)
+        ).fetchone()
+        if row is None:
+            return Chunk(0)
+        seq, count, compressed = row
+        if compressed:
+            return Chunk(seq + 1)
+        cached = self.open_chunks.get(url)
+        if cached is not None and cached.seq == seq and cached.count == count:
+            return cached
+        data, first_ts = self.conn.execute(
+            'SELECT data, first_ts FROM history WHERE url = ? AND seq = ?', (url, seq)
+        ).fetchone()
+        return Chunk(seq, data, count, first_ts)
+
+    def append(self, url, record):
+        """Aggiunge il record di un controllo (scritto al prossimo flush())"""
+        self.pending.setdefault(url, []).append(record)
+
+    def flush(self):
+        """Aggiunge i record in attesa ai blocchi del database in un'unica transazione
+
+        L'ultimo blocco di ogni link viene letto dentro la transazione (BEGIN
+        IMMEDIATE): due processi che scrivono sullo stesso database non si
+        sovrascrivono i record. I blocchi pieni vengono chiusi e compressi.
+        """
+        if not self.pending:
+            return
+        pending = self.pending
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = []
+                for url, records in pending.items():
+                    chunk = self._latest_chunk(url)
+                    for record in records:
+                        if chunk.count >= CHUNK_RECORDS:
+                            rows.append((url, chunk.seq, chunk.first_ts, chunk.last_ts, chunk.count, 1,
+                                         zlib.compress(bytes(chunk.data), 9)))
+                            chunk = Chunk(chunk.seq + 1)
+                        chunk.append(record)
+                    rows.append((url, chunk.seq, chunk.first_ts, chunk.last_ts, chunk.count, 0, bytes(chunk.data)))
+                    self.open_chunks[url] = chunk
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO history (url, seq, first_ts, last_ts, count, compressed, data) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    rows
+                )
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                # I blocchi in memoria potrebbero contenere record non scritti
+                for url in pending:
+                    self.open_chunks.pop(url, None)
+                raise
+        self.pending = {}
+
+    def records(self, url, since=None, until=None, flush=True):
+        """Record di un link nell'intervallo [since, until] (timestamp Unix)
+
+        Con flush=False i record non ancora scritti restano esclusi: serve per
+        leggere da un altro thread senza toccare i blocchi in scrittura.
+        """
+        if flush:
+            self.flush()
+        query = 'SELECT compressed, data FROM history WHERE url = ?'
+        params = [url]
+        # I blocchi fuori dall'intervallo non vengono nemmeno decompressi
+        if since is not None:
+            query += ' AND last_ts >= ?'
+            params.append(int(since))
+        if until is not None:
+            query += ' AND first_ts <= ?'
+            params.append(int(until))
+        with self._lock:
+            rows = self.conn.execute(query + ' ORDER BY seq', params).fetchall()
+
+        for compressed, data in rows:
+            for record in decode_chunk(zlib.decompress(data) if compressed else data):
+                if since is not None and record.ts < since:
+                    continue
+                if until is not None and record.ts > until:
+                    break
+                yield record
+
+    def summary(self, url, since=None, until=None, flush=True):
+        """Riepilogo di un link: controlli, restock, durata della disponibilità, prezzi, latenza"""
+        checks = errors = in_stock_checks = known_checks = 0
+        restocks = []
+        in_stock_periods = []
+        prices = []
+        latencies = []
+        first = last = None
+        previous_stock = STOCK_UNKNOWN
+        in_stock_since = None
+
+        for record in self.records(url, since, until, flush):
+            checks += 1
+            if first is None:
+                first = record
+            last = record
+            if record.error:
+                errors += 1
+                continue
+            latencies.append(record.latency_ms)
+            if record.price is not None:
+                prices.append(record.price)
+            if record.stock == STOCK_UNKNOWN:
+                continue
+
+            known_checks += 1
+            if record.stock == STOCK_YES:
+                in_stock_checks += 1
+                if previous_stock == STOCK_NO:
+                    restocks.append(record.ts)
+                if previous_stock != STOCK_YES:
+                    in_stock_since = record.ts
+            elif previous_stock == STOCK_YES and in_stock_since is not None:
+                in_stock_periods.append(record.ts - in_stock_since)
+                in_stock_since = None
+            previous_stock = record.stock
+
+        latencies.sort()
+        return {
+            'checks': checks,
+            'errors': errors,
+            'first_check': first.ts if first else None,
+            'last_check': last.ts if last else None,
+            'availability': in_stock_checks / known_checks if known_checks else None,
+            'restocks': len(restocks),
+            'last_restock': restocks[-1] if restocks else None,
+            'restock_hours': Counter(datetime.fromtimestamp(ts).hour for ts in restocks),
+            'restock_slots': Counter(
+                (datetime.fromtimestamp(ts).weekday(), datetime.fromtimestamp(ts).hour) for ts in restocks
+            ),
+            'avg_in_stock_seconds': sum(in_stock_periods) / len(in_stock_periods) if in_stock_periods else None,
+            'last_price': prices[-1] if prices else None,
+            'min_price': min(prices) if prices else None,
+            'max_price': max(prices) if prices else None,
+            'p50_latency_ms': latencies[len(latencies) // 2] if latencies else None,
+            'p95_latency_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        }
+
+    def size(self):
+        """Byte occupati dai blocchi dello storico e numero di record"""
+        self.flush()
+        with self._lock:
+            return self.conn.execute('SELECT COALESCE(SUM(LENGTH(data)), 0), COALESCE(SUM(count), 0) FROM history').fetchone()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            try:
+                self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error as e:
+                logger.warning(f"Checkpoint WAL non riuscito: {e}")
+            self.conn.close()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Pool di connessioni HTTP condiviso
+Un client httpx per host (sincrono e asincrono) con keep-alive,
+HTTP/2 opzionale e cache DNS in memoria. Con HTTP_CASSETTE le risposte
+vengono registrate o riprodotte da una cassetta (vedi cassettes.py).
+"""
+
+import os
+import time
+import socket
+import asyncio
+import logging
+import threading
+from urllib.parse import urlparse
+
+from domain_config import domain_of, get_domain_config
+
+logger = logging.getLogger(__name__)
+
+# Timeout predefinito delle richieste in secondi
+DEFAULT_TIMEOUT = 10
+
+# HTTP/2 richiede il pacchetto opzionale 'h2' (pip install httpx[http2])
+HTTP2_ENABLED = os.environ.get('HTTP2_ENABLED', '0') == '1'
+
+# Durata delle risposte DNS in cache (0 per disattivarla)
+DNS_CACHE_TTL = float(os.environ.get('DNS_CACHE_TTL', '300'))
+
+# Cassetta delle risposte HTTP e modalità ('record' o 'replay')
+HTTP_CASSETTE = os.environ.get('HTTP_CASSETTE')
+HTTP_CASSETTE_MODE = os.environ.get('HTTP_CASSETTE_MODE', 'replay')
+
+
+class DnsCache:
+    """Cache in memoria per socket.getaddrinfo
+
+    Viene usata sia dalle connessioni sincrone sia da quelle asincrone,
+    perché anche asyncio risolve i nomi tramite socket.getaddrinfo.
+    """
+
+    def __init__(self, ttl=DNS_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._original = None
+
+    def getaddrinfo(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        result = self._original(*args, **kwargs)
+        with self._lock:
+            self._entries[key] = (now + self.ttl, result)
+        return result
+
+    def install(self):
+        """Sostituisce socket.getaddrinfo con la versione in cache"""
+        if self._original is None and self.ttl > 0:
+            self._original = socket.getaddrinfo
+            socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self):
+        """Ripristina socket.getaddrinfo originale"""
+        if self._original is not None:
+            socket.getaddrinfo = self._original
+            self._original = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Cache DNS condivisa da tutti i pool del processo
+dns_cache = DnsCache()
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class HttpPool:
+    """Client HTTP condivisi, uno per host, con connessioni riutilizzate"""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, http2=HTTP2_ENABLED, cassette=None):
+        self.timeout = timeout
+        self.cassette = cassette
+        self.http2 = http2 and _http2_available()
+        if http2 and not self.http2:
+            logger.warning("HTTP/2 richiesto ma il pacchetto 'h2' non è installato: uso HTTP/1.1")
+
+        dns_cache.install()
+
+        self._clients = {}
+        self._async_clients = {}
+        self._async_loop = None
+        self._lock = threading.Lock()
+
+    def _host_key(self, url):
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc.lower()}"
+
+    def _limits(self, url):
+        """Dimensione del pool per l'host, dalla configurazione per dominio"""
+        import httpx
+        config = get_domain_config(domain_of(url))
+        return httpx.Limits(
+            max_connections=config['pool_size'],
+            max_keepalive_connections=config['pool_keepalive'],
+            keepalive_expiry=config['keepalive_expiry']
+        )
+
+    def _transport(self, url, asynchronous):
+        """Trasporto della cassetta per l'host (None: rete diretta)"""
+        if self.cassette is None:
+            return None
+        from cassettes import covers
+        if not covers(url):
+            return None
+        return self.cassette.transport(self._limits(url), self.http2, asynchronous)
+
+    def client(self, url):
+        """Client sincrono per l'host dell'URL"""
+        key = self._host_key(url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                import httpx
+                client = httpx.Client(
+                    limits=self._limits(url),
+                    timeout=self.timeout,
+                    http2=self.http2,
+                    transport=self._transport(url, False),
+                    follow_redirects=True
+                )
+                self._clients[key] = client
+        return client
+
+    def async_client(self, url):
+        """Client asincrono per l'host dell'URL, legato al loop corrente"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._async_loop:
+            # Le connessioni di un loop chiuso non sono riutilizzabili
+            self._async_clients = {}
+            self._async_loop = loop
+
+        key = self._host_key(url)
+        client = self._async_clients.get(key)
+        if client is None:
+            import httpx
+            client = httpx.AsyncClient(
+                limits=self._limits(url),
+                timeout=self.timeout,
+                http2=self.http2,
+                transport=self._transport(url, True),
+                follow_redirects=True
+            )
+            self._async_clients[key] = client
+        return client
+
+    def close(self):
+        """Chiude i client sincroni"""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.close()
+
+    async def aclose(self):
+        """Chiude i client asincroni del loop corrente"""
+        clients, self._async_clients = self._async_clients, {}
+        self._async_loop = None
+        for client in clients.values():
+            await client.aclose()
+
+
+_pool = None
+
+
+def get_pool():
+    """Pool condiviso dal processo (creato al primo utilizzo)"""
+    global _pool
+    if _pool is None:
+        cassette = None
+        if HTTP_CASSETTE:
+            from cassettes import open_cassette
+            cassette = open_cassette(HTTP_CASSETTE, HTTP_CASSETTE_MODE)
+            logger.info(f"Cassetta HTTP {HTTP_CASSETTE} in modalità {HTTP_CASSETTE_MODE}")
+        _pool = HttpPool(cassette=cassette)
+    return _pool
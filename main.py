@@ -4,15 +4,19 @@ Bot Telegram per monitoraggio prodotti - all_matcha_restock_bot3
 """
 
 import os
-import json
-import requests
+import sys
 import time
+import asyncio
 import logging
-from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from bs4 import BeautifulSoup
-import re
+from domain_config import normalize_url
+from http_pool import get_pool
+from menus import HISTORY_DAYS, cached_page, menu_page, page_urls, parse_menu_callback
+from metrics import start_metrics_server, start_profiler
+from notifications import NotificationDispatcher, summarize_results
+from product_monitor import ProductMonitor
 
 # Configurazione logging
 logging.basicConfig(
@@ -21,231 +25,134 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# File per salvare i link
-LINKS_FILE = 'monitored_links.json'
+# Modalità daemon: attesa massima tra due controlli della pianificazione (secondi)
+DAEMON_POLL_INTERVAL = int(os.environ.get('DAEMON_POLL_INTERVAL', '30'))
 
-class ProductMonitor:
-    def __init__(self):
-        self.monitored_links = self.load_links()
-    
-    def load_links(self):
-        """Carica i link dal file JSON"""
-        if os.path.exists(LINKS_FILE):
-            try:
-                with open(LINKS_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"Errore nel caricamento links: {e}")
-                return {}
-        return {}
-    
-    def save_links(self):
-        """Salva i link nel file JSON"""
-        try:
-            with open(LINKS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.monitored_links, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            logger.error(f"Errore nel salvataggio links: {e}")
+# Creato in main(): importare il modulo non apre l'archivio
+monitor = None
+
+# Intervallo minimo tra due modifiche del messaggio di avanzamento (secondi)
+CHECK_PROGRESS_INTERVAL = 2
+
+def format_check_result(result):
+    """Testo del risultato di un singolo controllo"""
+    if result.get('error'):
+        return f"❌ **{result['name']}**\n   Errore: {result['error']}\n\n"
     
-    def add_link(self, url, name=None):
-        """Aggiunge un nuovo link da monitorare"""
-        try:
-            # Pulisci l'URL
-            url = url.strip()
-            if not url.startswith(('http://', 'https://')):
-                url = 'https://' + url
-            
-            # Se non specificato un nome, usa il dominio
-            if not name:
-                from urllib.parse import urlparse
-                domain = urlparse(url).netloc
-                name = domain.replace('www.', '')
-            
-            # Ottieni info iniziali del prodotto
-            product_info = self.get_product_info(url)
-            
-            self.monitored_links[url] = {
-                'name': name,
-                'url': url,
-                'last_check': None,
-                'last_status': None,
-                'last_price': None,
-                'in_stock': None,
-                'product_title': product_info.get('title', ''),
-                'added_date': datetime.now().isoformat()
-            }
-            
-            self.save_links()
-            return True, f"✅ Link aggiunto: {name}\n🔗 {url}"
-            
-        except Exception as e:
-            logger.error(f"Errore nell'aggiunta del link: {e}")
-            return False, f"❌ Errore nell'aggiunta del link: {str(e)}"
-    
-    def remove_link(self, url):
-        """Rimuove un link dalla lista"""
-        if url in self.monitored_links:
-            name = self.monitored_links[url]['name']
-            del self.monitored_links[url]
-            self.save_links()
-            return True, f"✅ Link rimosso: {name}"
-        return False, "❌ Link non trovato nella lista"
-    
-    def remove_all_links(self):
-        """Rimuove tutti i link"""
-        count = len(self.monitored_links)
-        self.monitored_links = {}
-        self.save_links()
-        return f"✅ Rimossi tutti i {count} link dalla lista"
-    
-    def get_product_info(self, url):
-        """Ottiene informazioni sul prodotto"""
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'it-IT,it;q=0.8,en-US;q=0.5,en;q=0.3',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1'
-        }
-        
+    status_emoji = "✅" if result['in_stock'] else "❌"
+    change_emoji = ""
+    
+    if result['status_changed']:
+        if result['in_stock']:
+            change_emoji = " 🔄➡️✅ TORNATO DISPONIBILE!"
+        else:
+            change_emoji = " 🔄➡️❌ DIVENTATO NON DISPONIBILE!"
+    
+    message = f"{status_emoji} **{result['name']}**{change_emoji}\n"
+    
+    if result['price']:
+        price_change = ""
+        if result['price_changed'] and result['old_price']:
+            price_change = f" (era {result['old_price']})"
+        message += f"   💰 Prezzo: {result['price']}{price_change}\n"
+    
+    message += f"   🔗 {result['url'][:50]}{'...' if len(result['url']) > 50 else ''}\n\n"
+    return message
+
+def join_within_limit(header, blocks, limit=4096):
+    """Unisce i blocchi di testo senza superare il limite di Telegram"""
+    message = header
+    for i, block in enumerate(blocks):
+        if len(message) + len(block) > limit - 40:
+            return message + f"... e altri {len(blocks) - i} prodotti"
+        message += block
+    return message
+
+class ProgressMessage:
+    """Messaggio di stato aggiornato man mano che arrivano i risultati"""
+    
+    def __init__(self, edit, total, title):
+        # edit: query.edit_message_text oppure message.edit_text
+        self.edit_text = edit
+        self.total = total
+        self.title = title
+        self.blocks = []
+        self.last_edit = 0
+        self.editing = None
+    
+    def add(self, block):
+        self.blocks.append(block)
+        # Al massimo una modifica ogni CHECK_PROGRESS_INTERVAL e mai due insieme
+        if self.editing and not self.editing.done():
+            return
+        if time.monotonic() - self.last_edit < CHECK_PROGRESS_INTERVAL:
+            return
+        self.last_edit = time.monotonic()
+        header = f"{self.title} {len(self.blocks)}/{self.total}**\n\n"
+        self.editing = asyncio.ensure_future(self.edit(join_within_limit(header, self.blocks)))
+    
+    async def edit(self, text, reply_markup=None):
         try:
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Cerca il titolo del prodotto
-            title = ''
-            title_selectors = [
-                'h1', 'title', '.product-title', '.product-name', 
-                '.item-title', '#product-title', '.entry-title'
-            ]
-            
-            for selector in title_selectors:
-                title_elem = soup.select_one(selector)
-                if title_elem and title_elem.get_text(strip=True):
-                    title = title_elem.get_text(strip=True)
-                    break
-            
-            if not title:
-                title = soup.title.string if soup.title else 'Prodotto sconosciuto'
-            
-            # Cerca il prezzo
-            price = self.extract_price(soup)
-            
-            # Determina se è disponibile
-            in_stock = self.check_availability(soup, response.text)
-            
-            return {
-                'title': title[:100],  # Limita la lunghezza
-                'price': price,
-                'in_stock': in_stock,
-                'status_code': response.status_code
-            }
-            
-        except Exception as e:
-            logger.error(f"Errore nel controllo prodotto {url}: {e}")
-            return {
-                'title': 'Errore nel controllo',
-                'price': None,
-                'in_stock': None,
-                'error': str(e)
-            }
-    
-    def extract_price(self, soup):
-        """Estrae il prezzo dalla pagina"""
-        price_selectors = [
-            '.price', '.cost', '.amount', '.valor', '.prezzo',
-            '[class*="price"]', '[class*="cost"]', '[id*="price"]',
-            '.product-price', '.regular-price', '.sale-price'
-        ]
-        
-        for selector in price_selectors:
-            price_elem = soup.select_one(selector)
-            if price_elem:
-                price_text = price_elem.get_text(strip=True)
-                # Cerca pattern di prezzo (numeri con virgola/punto e simboli valuta)
-                price_match = re.search(r'[\€\$\£\¥]\s*(\d+(?:[.,]\d+)?)|(\d+(?:[.,]\d+)?)\s*[\€\$\£\¥]', price_text)
-                if price_match:
-                    return price_match.group(0)
-        
-        return None
-    
-    def check_availability(self, soup, page_text):
-        """Controlla se il prodotto è disponibile"""
-        # Parole che indicano non disponibilità
-        unavailable_keywords = [
-            'esaurito', 'non disponibile', 'out of stock', 'sold out',
-            'temporarily unavailable', 'currently unavailable', 'fuori stock',
-            'prodotto terminato', 'non in magazzino'
-        ]
-        
-        # Parole che indicano disponibilità
-        available_keywords = [
-            'disponibile', 'in stock', 'available', 'aggiungi al carrello',
-            'add to cart', 'buy now', 'acquista ora', 'in magazzino'
-        ]
-        
-        page_text_lower = page_text.lower()
-        
-        # Controlla le parole chiave di non disponibilità
-        for keyword in unavailable_keywords:
-            if keyword in page_text_lower:
-                return False
-        
-        # Controlla le parole chiave di disponibilità
-        for keyword in available_keywords:
-            if keyword in page_text_lower:
-                return True
-        
-        # Se non trova indicatori chiari, assume disponibile
-        return True
+            await self.edit_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        except TelegramError as e:
+            logger.warning(f"Impossibile aggiornare il messaggio di avanzamento: {e}")
     
-    def check_all_products(self):
-        """Controlla tutti i prodotti monitorati"""
-        results = []
-        
-        for url, data in self.monitored_links.items():
-            logger.info(f"Controllo prodotto: {data['name']}")
-            
-            product_info = self.get_product_info(url)
-            
-            # Aggiorna i dati
-            old_status = data.get('in_stock')
-            old_price = data.get('last_price')
-            
-            data['last_check'] = datetime.now().isoformat()
-            data['last_status'] = 'available' if product_info['in_stock'] else 'unavailable'
-            data['last_price'] = product_info['price']
-            data['in_stock'] = product_info['in_stock']
-            
-            # Determina se ci sono cambiamenti
-            status_changed = old_status is not None and old_status != product_info['in_stock']
-            price_changed = old_price is not None and old_price != product_info['price']
-            
-            result = {
-                'name': data['name'],
-                'url': url,
-                'title': product_info['title'],
-                'in_stock': product_info['in_stock'],
-                'price': product_info['price'],
-                'status_changed': status_changed,
-                'price_changed': price_changed,
-                'old_price': old_price,
-                'error': product_info.get('error')
-            }
-            
-            results.append(result)
-            
-            # Piccola pausa tra i controlli
-            time.sleep(2)
-        
-        self.save_links()
-        return results
+    async def finish(self, header, blocks, reply_markup=None):
+        if self.editing:
+            await self.editing
+        await self.edit(join_within_limit(header, blocks), reply_markup)
 
-# Inizializza il monitor
-monitor = ProductMonitor()
+async def run_check_now(query, chat_id):
+    """Esegue (o segue, se già avviato) il controllo dei link della chat aggiornando il messaggio"""
+    progress = ProgressMessage(query.edit_message_text, len(monitor.links_for(chat_id)), "🔍 **Controllo in corso...")
+    try:
+        results = await monitor.check_all_products_shared(lambda result: progress.add(format_check_result(result)), chat_id)
+    except Exception as e:
+        logger.error(f"Errore nel controllo manuale: {e}")
+        await progress.edit(f"❌ Errore durante il controllo: {e}")
+        return
+    keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data='back_to_menu')]]
+    await progress.finish(
+        "🔍 **Risultati controllo**\n\n",
+        [format_check_result(r) for r in results],
+        InlineKeyboardMarkup(keyboard)
+    )
+
+async def run_bulk_add(message, entries, chat_id):
+    """Aggiunge i link in background aggiornando il messaggio di stato"""
+    # Il totale conta i link una sola volta, come add_links_bulk
+    urls = set()
+    for url, _ in entries:
+        try:
+            urls.add(normalize_url(url))
+        except ValueError:
+            urls.add(url)
+    status = await message.reply_text(f"📎 Aggiunta di {len(urls)} link in corso...")
+    progress = ProgressMessage(status.edit_text, len(urls), "📎 **Aggiunta link in corso...")
+    try:
+        results = await monitor.add_links_bulk(entries, lambda success, msg: progress.add(msg + "\n"), chat_id)
+    except Exception as e:
+        logger.error(f"Errore nell'aggiunta dei link: {e}")
+        await progress.edit(f"❌ Errore nell'aggiunta dei link: {e}")
+        return
+    await progress.finish("📎 **Risultati aggiunta link:**\n\n", [msg + "\n" for _, msg in results])
+
+async def history_page(chat_id, page):
+    """Pagina dello storico: riepiloghi dei soli link della pagina, calcolati fuori dal loop"""
+    menu = cached_page(monitor, 'history', chat_id, page)
+    if menu is None:
+        summaries = await monitor.history_summaries(page_urls(monitor, chat_id, page), days=HISTORY_DAYS)
+        menu = menu_page(monitor, 'history', chat_id, page, summaries=summaries)
+    return menu
+
+def menu_markup(menu):
+    """Tastiera di una pagina di menu, con il ritorno al menu principale"""
+    keyboard = [
+        [InlineKeyboardButton(label, callback_data=data) for label, data in row]
+        for row in menu.rows if row
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 Indietro", callback_data='back_to_menu')])
+    return InlineKeyboardMarkup(keyboard)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler per il comando /start"""
@@ -254,6 +161,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("🗑️ Rimuovi Link", callback_data='remove_link')],
         [InlineKeyboardButton("📋 Lista Link", callback_data='list_links')],
         [InlineKeyboardButton("🔍 Controlla Ora", callback_data='check_now')],
+        [InlineKeyboardButton("📈 Storico", callback_data='history')],
         [InlineKeyboardButton("📎 Aggiungi Multi Link", callback_data='add_multi')],
         [InlineKeyboardButton("🗑️ Rimuovi Tutti", callback_data='remove_all')]
     ]
@@ -270,6 +178,7 @@ Ciao! Sono il tuo assistente per monitorare la disponibilità dei prodotti.
 • 🗑️ Rimuovere link specifici
 • 📋 Mostrare tutti i link monitorati
 • 🔍 Controllare immediatamente tutti i prodotti
+• 📈 Mostrare lo storico di disponibilità e prezzi
 • 📎 Aggiungere più link contemporaneamente
 • 🗑️ Rimuovere tutti i link in una volta
 
@@ -282,6 +191,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler per i pulsanti inline"""
     query = update.callback_query
     await query.answer()
+    chat_id = str(update.effective_chat.id)
     
     if query.data == 'add_link':
         await query.edit_message_text(
@@ -296,96 +206,44 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         context.user_data['waiting_for'] = 'single_link'
     
-    elif query.data == 'remove_link':
-        if not monitor.monitored_links:
+    elif parse_menu_callback(query.data):
+        # Lista, rimozione e storico a pagine ('list_links', 'remove_link:2', 'history:1', ...)
+        view, page = parse_menu_callback(query.data)
+        if view == 'remove_link' and not monitor.links_for(chat_id):
             await query.edit_message_text("❌ Nessun link da rimuovere!")
             return
         
-        keyboard = []
-        for url, data in monitor.monitored_links.items():
-            keyboard.append([InlineKeyboardButton(
-                f"🗑️ {data['name']}", 
-                callback_data=f'remove_{hash(url) % 10000}'
-            )])
-        keyboard.append([InlineKeyboardButton("🔙 Indietro", callback_data='back_to_menu')])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "🗑️ **Rimuovi link**\n\nSeleziona il link da rimuovere:",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-    
-    elif query.data.startswith('remove_'):
-        # Trova il link da rimuovere
-        link_hash = query.data.replace('remove_', '')
-        for url in monitor.monitored_links:
-            if str(hash(url) % 10000) == link_hash:
-                success, message = monitor.remove_link(url)
-                await query.edit_message_text(message)
-                return
-        await query.edit_message_text("❌ Link non trovato!")
-    
-    elif query.data == 'list_links':
-        if not monitor.monitored_links:
-            message = "📋 **Lista link monitorati**\n\n❌ Nessun link configurato!"
+        if view == 'history':
+            menu = await history_page(chat_id, page)
         else:
-            message = "📋 **Lista link monitorati**\n\n"
-            for i, (url, data) in enumerate(monitor.monitored_links.items(), 1):
-                status_emoji = "✅" if data.get('in_stock') else "❌"
-                last_check = data.get('last_check', 'Mai')
-                if last_check != 'Mai':
-                    last_check = datetime.fromisoformat(last_check).strftime('%d/%m %H:%M')
-                
-                message += f"{i}. {status_emoji} **{data['name']}**\n"
-                message += f"   🔗 {url[:50]}{'...' if len(url) > 50 else ''}\n"
-                message += f"   📅 Ultimo controllo: {last_check}\n"
-                if data.get('last_price'):
-                    message += f"   💰 Prezzo: {data['last_price']}\n"
-                message += "\n"
-        
-        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data='back_to_menu')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+            menu = menu_page(monitor, view, chat_id, page)
+        await query.edit_message_text(menu.text, reply_markup=menu_markup(menu), parse_mode='Markdown')
+    
+    elif query.data.startswith('remove:'):
+        # Pulsante di rimozione: ID breve del link
+        url = monitor.link_ids.url_of(query.data[len('remove:'):])
+        if url is None:
+            await query.edit_message_text("❌ Link non trovato!")
+            return
+        success, message = monitor.remove_link(url, chat_id)
+        await query.edit_message_text(message)
+    
+    elif query.data == 'noop':
+        # Indicatore della pagina corrente
+        return
     
     elif query.data == 'check_now':
-        if not monitor.monitored_links:
+        if not monitor.links_for(chat_id):
             await query.edit_message_text("❌ Nessun link da controllare!")
             return
         
-        await query.edit_message_text("🔍 **Controllo in corso...**\n\nSto verificando tutti i prodotti, attendere...")
-        
-        results = monitor.check_all_products()
-        
-        message = "🔍 **Risultati controllo**\n\n"
-        
-        for result in results:
-            if result.get('error'):
-                message += f"❌ **{result['name']}**\n   Errore: {result['error']}\n\n"
-                continue
-            
-            status_emoji = "✅" if result['in_stock'] else "❌"
-            change_emoji = ""
-            
-            if result['status_changed']:
-                if result['in_stock']:
-                    change_emoji = " 🔄➡️✅ TORNATO DISPONIBILE!"
-                else:
-                    change_emoji = " 🔄➡️❌ DIVENTATO NON DISPONIBILE!"
-            
-            message += f"{status_emoji} **{result['name']}**{change_emoji}\n"
-            
-            if result['price']:
-                price_change = ""
-                if result['price_changed'] and result['old_price']:
-                    price_change = f" (era {result['old_price']})"
-                message += f"   💰 Prezzo: {result['price']}{price_change}\n"
-            
-            message += f"   🔗 {result['url'][:50]}{'...' if len(result['url']) > 50 else ''}\n\n"
+        if monitor.sweep_running(chat_id):
+            await query.edit_message_text("🔍 **Controllo già in corso...**\n\nTi mostro i risultati man mano che arrivano.")
+        else:
+            await query.edit_message_text("🔍 **Controllo in corso...**\n\nSto verificando tutti i prodotti, attendere...")
         
-        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data='back_to_menu')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+        # Il controllo prosegue in background: il bot continua a rispondere agli altri
+        context.application.create_task(run_check_now(query, chat_id))
     
     elif query.data == 'add_multi':
         await query.edit_message_text(
@@ -411,7 +269,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        count = len(monitor.monitored_links)
+        count = len(monitor.links_for(chat_id))
         await query.edit_message_text(
             f"🗑️ **Conferma rimozione**\n\n"
             f"Sei sicuro di voler rimuovere tutti i {count} link monitorati?\n"
@@ -421,7 +279,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     
     elif query.data == 'confirm_remove_all':
-        message = monitor.remove_all_links()
+        message = monitor.remove_all_links(chat_id)
         await query.edit_message_text(message)
     
     elif query.data == 'back_to_menu':
@@ -431,6 +289,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("🗑️ Rimuovi Link", callback_data='remove_link')],
             [InlineKeyboardButton("📋 Lista Link", callback_data='list_links')],
             [InlineKeyboardButton("🔍 Controlla Ora", callback_data='check_now')],
+            [InlineKeyboardButton("📈 Storico", callback_data='history')],
             [InlineKeyboardButton("📎 Aggiungi Multi Link", callback_data='add_multi')],
             [InlineKeyboardButton("🗑️ Rimuovi Tutti", callback_data='remove_all')]
         ]
@@ -446,6 +305,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler per i messaggi di testo"""
     waiting_for = context.user_data.get('waiting_for')
+    chat_id = str(update.effective_chat.id)
     
     if waiting_for == 'single_link':
         text = update.message.text.strip()
@@ -459,17 +319,18 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             url = text
             name = None
         
-        success, message = monitor.add_link(url, name)
+        # Stesso percorso asincrono dell'aggiunta multipla: il download non blocca il loop
+        results = await monitor.add_links_bulk([(url, name)], chat_id=chat_id)
+        success, message = results[0]
         await update.message.reply_text(message)
         
         # Reset dello stato
         context.user_data.pop('waiting_for', None)
     
     elif waiting_for == 'multi_links':
-        lines = update.message.text.strip().split('\n')
-        results = []
+        entries = []
         
-        for line in lines:
+        for line in update.message.text.strip().split('\n'):
             line = line.strip()
             if not line:
                 continue
@@ -477,24 +338,19 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Controlla se c'è un nome personalizzato
             if '|' in line:
                 url, name = line.split('|', 1)
-                url = url.strip()
-                name = name.strip()
+                entries.append((url.strip(), name.strip() or None))
             else:
-                url = line
-                name = None
-            
-            success, msg = monitor.add_link(url, name)
-            results.append(msg)
-        
-        if results:
-            final_message = "📎 **Risultati aggiunta link:**\n\n" + "\n".join(results)
-        else:
-            final_message = "❌ Nessun link valido trovato!"
-        
-        await update.message.reply_text(final_message, parse_mode='Markdown')
+                entries.append((line, None))
         
         # Reset dello stato
         context.user_data.pop('waiting_for', None)
+        
+        if not entries:
+            await update.message.reply_text("❌ Nessun link valido trovato!")
+            return
+        
+        # Download e salvataggio in background: il bot continua a rispondere agli altri
+        context.application.create_task(run_bulk_add(update.message, entries, chat_id))
     
     else:
         # Messaggio non riconosciuto
@@ -502,6 +358,57 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "❓ Non ho capito. Usa /start per vedere i comandi disponibili."
         )
 
+async def monitor_loop(application):
+    """Controlli automatici in background, nello stesso event loop del bot"""
+    logger.info("Monitoraggio in background avviato")
+    dispatcher = application.bot_data['dispatcher']
+    # Messaggi rimasti nell'outbox da un'esecuzione precedente
+    await dispatcher.deliver()
+    while True:
+        try:
+            urls = monitor.due_links()
+            if urls:
+                logger.info(f"Controllo {len(urls)} prodotti su {len(monitor.monitored_links)}...")
+                results = await monitor.check_all_products_async(urls)
+                logger.info(f"Risultati: {summarize_results(results)}")
+                
+                # Ogni chat riceve solo i cambiamenti dei link che segue, raccolti
+                # in un solo messaggio per finestra
+                for chat_id, chat_results in monitor.subscriptions.fan_out(results).items():
+                    dispatcher.add_results(chat_id, chat_results)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Errore nel monitoraggio in background: {e}")
+        
+        # Attende il prossimo link in scadenza, ricontrollando spesso per i link appena aggiunti
+        next_due = monitor.scheduler.next_due()
+        delay = DAEMON_POLL_INTERVAL if next_due is None else next_due - time.time()
+        await asyncio.sleep(min(max(delay, 1), DAEMON_POLL_INTERVAL))
+
+async def start_monitor_loop(application):
+    """post_init: avvia il monitoraggio in background"""
+    application.bot_data['dispatcher'] = NotificationDispatcher(application.bot.token)
+    application.bot_data['monitor_task'] = asyncio.create_task(monitor_loop(application))
+
+async def stop_monitor_loop(application):
+    """post_shutdown: ferma il monitoraggio e salva lo stato"""
+    task = application.bot_data.pop('monitor_task', None)
+    if task:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    dispatcher = application.bot_data.pop('dispatcher', None)
+    if dispatcher:
+        # Le notifiche in attesa partono prima di uscire (o restano nell'outbox)
+        await dispatcher.close()
+        dispatcher.outbox.close()
+    await get_pool().aclose()
+    monitor.close()
+    logger.info("Monitoraggio fermato, stato salvato")
+
 def main():
     """Funzione principale"""
     # Ottieni il token dalle variabili d'ambiente (GitHub Secrets)
@@ -513,20 +420,38 @@ def main():
         return
     
     if not chat_id:
-        logger.error("TELEGRAM_CHAT_ID non trovato nelle variabili d'ambiente!")
-        return
+        # Ogni chat segue i propri link; TELEGRAM_CHAT_ID serve solo per i link
+        # salvati prima delle iscrizioni
+        logger.warning("TELEGRAM_CHAT_ID non impostato: i link senza iscrizioni non verranno notificati")
+    
+    # Con --daemon (o DAEMON_MODE=1) i controlli automatici girano insieme al bot
+    daemon = '--daemon' in sys.argv[1:] or os.environ.get('DAEMON_MODE') == '1'
+    
+    global monitor
+    monitor = ProductMonitor()
     
     # Crea l'applicazione
-    application = Application.builder().token(token).build()
+    builder = Application.builder().token(token)
+    if daemon:
+        builder = builder.post_init(start_monitor_loop).post_shutdown(stop_monitor_loop)
+    application = builder.build()
     
     # Aggiungi gli handler
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CallbackQueryHandler(button_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
     
+    # Metriche Prometheus (solo con METRICS_PORT) e profiler (solo con PROFILE_FILE)
+    start_metrics_server()
+    profiler, profile_path = start_profiler()
+    
     # Avvia il bot
-    logger.info("Bot avviato!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    logger.info("Bot avviato in modalità daemon!" if daemon else "Bot avviato!")
+    try:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        if profiler:
+            profiler.stop(profile_path)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Riconoscimento precompilato di disponibilità, prezzo e titolo
+Parole chiave, selettori CSS ed espressioni regolari vengono preparati
+una sola volta all'import; le parole chiave sono configurabili per
+lingua e per dominio (vedi domain_config.py).
+"""
+
+import re
+
+from domain_config import get_domain_config
+
+# Parole chiave per lingua
+LANGUAGE_KEYWORDS = {
+    'it': {
+        'unavailable': ('esaurito', 'non disponibile', 'fuori stock', 'prodotto terminato', 'non in magazzino'),
+        'available': ('disponibile', 'aggiungi al carrello', 'acquista ora', 'in magazzino'),
+    },
+    'en': {
+        'unavailable': ('out of stock', 'sold out', 'temporarily unavailable', 'currently unavailable'),
+        'available': ('in stock', 'available', 'add to cart', 'buy now'),
+    },
+    'ja': {
+        'unavailable': ('在庫切れ', '売り切れ', '品切れ', '完売'),
+        'available': ('在庫あり', 'カートに入れる', 'カートに追加'),
+    },
+    'fr': {
+        'unavailable': ('rupture de stock', 'épuisé', 'indisponible'),
+        'available': ('en stock', 'ajouter au panier'),
+    },
+    'de': {
+        'unavailable': ('ausverkauft', 'nicht verfügbar', 'nicht auf lager'),
+        'available': ('auf lager', 'in den warenkorb'),
+    },
+}
+
+DEFAULT_LANGUAGES = ('it', 'en')
+
+# Pattern di prezzo: simbolo o codice di valuta prima o dopo l'importo,
+# con eventuali separatori delle migliaia (interpretati da pricing.py)
+PRICE_CURRENCY = r'[€$£¥]|(?<![A-Za-z])(?:EUR|USD|GBP|CHF|JPY)(?![A-Za-z])'
+PRICE_NUMBER = r"\d{1,3}(?:[.,'\u00a0\u202f]\d{3})+(?:[.,]\d+)?|\d+(?:[.,]\d+)?"
+PRICE_RE = re.compile(
+    rf'(?P<before>{PRICE_CURRENCY})\s*(?P<number_before>{PRICE_NUMBER})'
+    rf'|(?P<number_after>{PRICE_NUMBER})\s*(?P<after>{PRICE_CURRENCY})'
+)
+
+PRICE_SELECTORS = (
+    '.price', '.cost', '.amount', '.valor', '.prezzo',
+    '[class*="price"]', '[class*="cost"]', '[id*="price"]',
+    '.product-price', '.regular-price', '.sale-price'
+)
+
+TITLE_SELECTORS = (
+    'h1', 'title', '.product-title', '.product-name',
+    '.item-title', '#product-title', '.entry-title'
+)
+
+
+# Forme di selettore valutate direttamente in Python, senza soupsieve
+TAG_SELECTOR_RE = re.compile(r'^[a-z][a-z0-9]*$')
+CLASS_SELECTOR_RE = re.compile(r'^\.([\w-]+)$')
+ID_SELECTOR_RE = re.compile(r'^#([\w-]+)$')
+ATTR_CONTAINS_RE = re.compile(r'^\[([\w-]+)\*="([^"]*)"\]$')
+
+
+def compile_rule(selector):
+    """Trasforma un selettore CSS semplice in un predicato (elemento, tag, classi, id)
+
+    Sono gestiti tag, .classe, #id e [attributo*="valore"], sia per gli
+    elementi BeautifulSoup sia per quelli lxml; gli altri selettori vengono
+    compilati con soupsieve (solo BeautifulSoup).
+    """
+    match = CLASS_SELECTOR_RE.match(selector)
+    if match:
+        name = match.group(1)
+        return lambda element, tag, classes, ident: name in classes
+    match = ID_SELECTOR_RE.match(selector)
+    if match:
+        name = match.group(1)
+        return lambda element, tag, classes, ident: ident == name
+    if TAG_SELECTOR_RE.match(selector):
+        return lambda element, tag, classes, ident: tag == selector
+
+    match = ATTR_CONTAINS_RE.match(selector)
+    if match:
+        attr, value = match.groups()
+        if attr == 'class':
+            return lambda element, tag, classes, ident: value in ' '.join(classes)
+        if attr == 'id':
+            return lambda element, tag, classes, ident: ident is not None and value in ident
+
+        def attr_contains(element, tag, classes, ident):
+            attr_value = element.get(attr)
+            if isinstance(attr_value, list):
+                attr_value = ' '.join(attr_value)
+            return attr_value is not None and value in attr_value
+        return attr_contains
+
+    # soupsieve (e BeautifulSoup) solo per i selettori complessi
+    import soupsieve
+    compiled = soupsieve.compile(selector)
+    return lambda element, tag, classes, ident: compiled.match(element)
+
+
+class PrioritySelector:
+    """Lista di selettori CSS in ordine di priorità, risolta con una sola visita
+
+    Equivale a chiamare select_one() per ogni selettore nell'ordine dato,
+    ma l'albero viene percorso una volta sola e ci si ferma appena ogni
+    selettore ha trovato il suo primo elemento. Gli elementi arrivano come
+    tuple (elemento, tag, classi, id), così lo stesso codice serve sia per
+    BeautifulSoup (soup_elements) sia per lxml.
+    """
+
+    def __init__(self, selectors):
+        self.selectors = tuple(selectors)
+        self.rules = tuple(compile_rule(s) for s in self.selectors)
+
+    def first_matches(self, elements):
+        """Primo elemento (in ordine di documento) per ciascun selettore"""
+        found = [None] * len(self.rules)
+        pending = list(range(len(self.rules)))
+
+        for element, tag, classes, ident in elements:
+            matched = False
+            for i in pending:
+                if self.rules[i](element, tag, classes, ident):
+                    found[i] = element
+                    matched = True
+            if matched:
+                pending = [i for i in pending if found[i] is None]
+                if not pending:
+                    break
+
+        return found
+
+    def candidates(self, elements):
+        """Per ogni selettore, il primo elemento che lo soddisfa (in ordine di priorità)"""
+        for element in self.first_matches(elements):
+            if element is not None:
+                yield element
+
+
+def soup_elements(soup):
+    """Elementi di un albero BeautifulSoup nel formato di PrioritySelector"""
+    from bs4 import Tag
+    for element in soup.descendants:
+        if isinstance(element, Tag):
+            attrs = element.attrs
+            yield element, element.name, attrs.get('class') or (), attrs.get('id')
+
+
+PRICE_SELECTOR = PrioritySelector(PRICE_SELECTORS)
+TITLE_SELECTOR = PrioritySelector(TITLE_SELECTORS)
+
+# Dentro l'elemento del prezzo: prezzo barrato o "confronta con", cioè il prezzo pieno
+STRUCK_PRICE_SELECTORS = (
+    's', 'del', 'strike', '[class*="compare"]', '[class*="was-price"]', '[class*="old-price"]'
+)
+STRUCK_PRICE_RULES = tuple(compile_rule(s) for s in STRUCK_PRICE_SELECTORS)
+
+
+def is_struck_price(element, tag, classes, ident):
+    """True per un elemento di STRUCK_PRICE_SELECTORS (nel formato di PrioritySelector)"""
+    return any(rule(element, tag, classes, ident) for rule in STRUCK_PRICE_RULES)
+
+
+class StockMatcher:
+    """Classifica la disponibilità a partire dal testo della pagina
+
+    Il testo viene convertito in minuscolo una sola volta; per la ricerca si usa
+    la ricerca di sottostringhe di CPython, che sulle pagine grandi è più veloce
+    di una regex combinata (vedi benchmarks/bench_matcher.py).
+    """
+
+    def __init__(self, unavailable, available):
+        self.unavailable = tuple(dict.fromkeys(k.lower() for k in unavailable))
+        self.available = tuple(dict.fromkeys(k.lower() for k in available))
+
+    @classmethod
+    def for_languages(cls, languages, extra_unavailable=(), extra_available=()):
+        unavailable = [k for lang in languages for k in LANGUAGE_KEYWORDS.get(lang, {}).get('unavailable', ())]
+        available = [k for lang in languages for k in LANGUAGE_KEYWORDS.get(lang, {}).get('available', ())]
+        return cls(unavailable + list(extra_unavailable), available + list(extra_available))
+
+    def scan(self, page_text):
+        """Tutte le parole chiave trovate, divise per tipo"""
+        text = page_text.lower()
+        return {
+            'unavailable': [k for k in self.unavailable if k in text],
+            'available': [k for k in self.available if k in text],
+        }
+
+    def is_available(self, page_text):
+        """True/False secondo le parole chiave; senza indicatori assume disponibile"""
+        text = page_text.lower()
+        for keyword in self.unavailable:
+            if keyword in text:
+                return False
+        for keyword in self.available:
+            if keyword in text:
+                return True
+        return True
+
+
+_matchers = {}
+
+
+def get_matcher(domain=None):
+    """Matcher per un dominio (in cache per combinazione di lingue e parole chiave)"""
+    config = get_domain_config(domain) if domain else {}
+    languages = tuple(config.get('languages') or DEFAULT_LANGUAGES)
+    keywords = config.get('keywords') or {}
+    key = (
+        languages,
+        tuple(keywords.get('unavailable', ())),
+        tuple(keywords.get('available', ()))
+    )
+
+    matcher = _matchers.get(key)
+    if matcher is None:
+        matcher = StockMatcher.for_languages(languages, key[1], key[2])
+        _matchers[key] = matcher
+    return matcher
+
+
+def find_price_texts(soup):
+    """(testo, testo barrato) del primo elemento con un prezzo seguendo la priorità dei selettori"""
+    for element in PRICE_SELECTOR.candidates(soup_elements(soup)):
+        text = element.get_text(strip=True)
+        if PRICE_RE.search(text):
+            struck = [item[0].get_text(strip=True) for item in soup_elements(element) if is_struck_price(*item)]
+            return text, ' '.join(struck)
+    return None, ''
+
+
+def find_price_text(soup):
+    """Testo del primo elemento con un prezzo seguendo la priorità dei selettori"""
+    return find_price_texts(soup)[0]
+
+
+def find_price(soup):
+    """Primo prezzo trovato seguendo la priorità dei selettori"""
+    price_match = PRICE_RE.search(find_price_text(soup) or '')
+    return price_match.group(0) if price_match else None
+
+
+def find_title(soup):
+    """Primo titolo non vuoto seguendo la priorità dei selettori"""
+    for element in TITLE_SELECTOR.candidates(soup_elements(soup)):
+        title = element.get_text(strip=True)
+        if title:
+            return title
+    return ''
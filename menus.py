@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Menu a pagine della lista, della rimozione e dello storico dei link
+Ogni link ha un ID breve stabile (derivato dall'URL, uguale dopo un
+riavvio) usato nei callback dei pulsanti, con un indice ID -> URL per
+risolverlo senza scorrere i link. Le pagine vengono preparate solo per la
+parte di lista mostrata e tenute in una cache LRU, invalidata quando un
+link o le iscrizioni di una chat cambiano. Il modulo non dipende da
+python-telegram-bot: le pagine sono testo e righe di (etichetta, callback).
+"""
+
+import os
+import base64
+import hashlib
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+# Link per pagina dei menu (Telegram accetta al massimo 100 pulsanti per messaggio)
+MENU_PAGE_SIZE = int(os.environ.get('MENU_PAGE_SIZE', '10'))
+
+# Pagine preparate tenute in memoria
+MENU_CACHE_SIZE = int(os.environ.get('MENU_CACHE_SIZE', '256'))
+
+# Limite di Telegram per il testo di un messaggio
+MESSAGE_LIMIT = 4096
+
+# Giorni di storico riassunti nel menu Storico
+HISTORY_DAYS = 30
+
+# Caratteri dell'ID breve: 8 caratteri base32 (40 bit)
+LINK_ID_LENGTH = 8
+
+MenuPage = namedtuple('MenuPage', 'text rows')
+
+
+def link_id(url, attempt=0):
+    """ID breve dell'URL; attempt > 0 solo in caso di collisione"""
+    key = url if not attempt else f"{url}#{attempt}"
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return base64.b32encode(digest).decode('ascii')[:LINK_ID_LENGTH].lower()
+
+
+class LinkIdIndex:
+    """Indice ID breve -> URL (e inverso) dei link monitorati"""
+
+    def __init__(self, links):
+        self.rebuild(links)
+
+    def rebuild(self, links):
+        self.by_id = {}
+        self.by_url = {}
+        for url in links:
+            self.add(url)
+
+    def add(self, url):
+        if url in self.by_url:
+            return self.by_url[url]
+        attempt = 0
+        short_id = link_id(url)
+        while short_id in self.by_id:
+            attempt += 1
+            short_id = link_id(url, attempt)
+        self.by_id[short_id] = url
+        self.by_url[url] = short_id
+        return short_id
+
+    def remove(self, url):
+        short_id = self.by_url.pop(url, None)
+        if short_id is not None:
+            self.by_id.pop(short_id, None)
+
+    def id_of(self, url):
+        return self.by_url.get(url) or self.add(url)
+
+    def url_of(self, short_id):
+        return self.by_id.get(short_id)
+
+
+class MenuCache:
+    """Cache LRU delle pagine preparate, per (chat, menu, pagina)
+
+    Ogni pagina ricorda i link che mostra: la modifica di un link invalida
+    solo le pagine che lo contengono, un cambio delle iscrizioni tutte le
+    pagine della chat (la numerazione si sposta).
+    """
+
+    def __init__(self, size=MENU_CACHE_SIZE):
+        self.size = size
+        self.pages = OrderedDict()
+        self.by_url = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.pages.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.pages.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, page, urls):
+        self._drop(key)
+        self.pages[key] = (page, urls)
+        for url in urls:
+            self.by_url.setdefault(url, set()).add(key)
+        while len(self.pages) > self.size:
+            self._drop(next(iter(self.pages)))
+
+    def _drop(self, key):
+        entry = self.pages.pop(key, None)
+        if entry is None:
+            return
+        for url in entry[1]:
+            keys = self.by_url.get(url)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_url[url]
+
+    def invalidate_url(self, url):
+        for key in list(self.by_url.get(url, ())):
+            self._drop(key)
+
+    def invalidate_chat(self, chat_id):
+        chat_id = str(chat_id) if chat_id is not None else None
+        for key in [key for key in self.pages if key[0] == chat_id]:
+            self._drop(key)
+
+    def clear(self):
+        self.pages.clear()
+        self.by_url.clear()
+
+
+def page_count(total, page_size=MENU_PAGE_SIZE):
+    return max(1, -(-total // page_size))
+
+
+def navigation_row(view, page, pages):
+    """Pulsanti per pagina precedente e successiva (vuota con una sola pagina)"""
+    if pages <= 1:
+        return []
+    row = []
+    if page > 0:
+        row.append(("◀️", f"{view}:{page - 1}"))
+    row.append((f"{page + 1}/{pages}", 'noop'))
+    if page < pages - 1:
+        row.append(("▶️", f"{view}:{page + 1}"))
+    return row
+
+
+def format_link_entry(number, url, data):
+    """Voce della lista link"""
+    status_emoji = "✅" if data.get('in_stock') else "❌"
+    last_check = data.get('last_check') or 'Mai'
+    if last_check != 'Mai':
+        last_check = datetime.fromisoformat(last_check).strftime('%d/%m %H:%M')
+    entry = f"{number}. {status_emoji} **{data['name']}**\n"
+    entry += f"   🔗 {url[:50]}{'...' if len(url) > 50 else ''}\n"
+    entry += f"   📅 Ultimo controllo: {last_check}\n"
+    if data.get('last_price'):
+        entry += f"   💰 Prezzo: {data['last_price']}\n"
+    return entry + "\n"
+
+
+def render_list_page(monitor, urls, page):
+    """Pagina della lista link: solo le voci della pagina"""
+    pages = page_count(len(urls))
+    start = page * MENU_PAGE_SIZE
+    shown = urls[start:start + MENU_PAGE_SIZE]
+    if not urls:
+        return MenuPage("📋 **Lista link monitorati**\n\n❌ Nessun link configurato!", []), shown
+    title = "📋 **Lista link monitorati**"
+    if pages > 1:
+        title += f" ({len(urls)} link, pagina {page + 1}/{pages})"
+    text = title + "\n\n"
+    for i, url in enumerate(shown, start + 1):
+        entry = format_link_entry(i, url, monitor.monitored_links[url])
+        if len(text) + len(entry) > MESSAGE_LIMIT:
+            break
+        text += entry
+    return MenuPage(text, [navigation_row('list_links', page, pages)]), shown
+
+
+def render_remove_page(monitor, urls, page):
+    """Pagina del menu di rimozione: un pulsante per link della pagina"""
+    pages = page_count(len(urls))
+    start = page * MENU_PAGE_SIZE
+    shown = urls[start:start + MENU_PAGE_SIZE]
+    text = "🗑️ **Rimuovi link**\n\nSeleziona il link da rimuovere:"
+    if pages > 1:
+        text += f"\n(pagina {page + 1}/{pages})"
+    rows = [
+        [(f"🗑️ {monitor.monitored_links[url]['name']}", f"remove:{monitor.link_ids.id_of(url)}")]
+        for url in shown
+    ]
+    rows.append(navigation_row('remove_link', page, pages))
+    return MenuPage(text, rows), shown
+
+
+def format_duration(seconds):
+    """Durata leggibile (giorni, ore o minuti)"""
+    if seconds >= 86400:
+        return f"{seconds / 86400:.1f} giorni"
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f} ore"
+    return f"{max(1, round(seconds / 60))} min"
+
+
+def format_history_summary(data, summary):
+    """Testo del riepilogo storico di un prodotto"""
+    message = f"📈 **{data['name']}**\n"
+    if not summary['checks']:
+        return message + "   Nessun controllo registrato\n"
+
+    message += f"   🔍 Controlli: {summary['checks']} ({summary['errors']} errori)\n"
+    if summary['availability'] is not None:
+        message += f"   ✅ Disponibile nel {summary['availability'] * 100:.0f}% dei controlli\n"
+    if summary['restocks']:
+        last_restock = datetime.fromtimestamp(summary['last_restock']).strftime('%d/%m %H:%M')
+        message += f"   🔄 Restock: {summary['restocks']} (ultimo {last_restock})\n"
+        hours = ", ".join(f"{hour}:00" for hour, _ in summary['restock_hours'].most_common(3))
+        message += f"   🕐 Orari più frequenti: {hours}\n"
+    if summary['avg_in_stock_seconds'] is not None:
+        message += f"   ⏳ Resta disponibile in media {format_duration(summary['avg_in_stock_seconds'])}\n"
+    if summary['min_price'] is not None:
+        message += (
+            f"   💰 Prezzo: {summary['last_price'] / 100:.2f} "
+            f"(min {summary['min_price'] / 100:.2f}, max {summary['max_price'] / 100:.2f})\n"
+        )
+    return message
+
+
+def render_history_page(monitor, urls, page, summaries=None):
+    """Pagina dello storico: riepiloghi dei soli link della pagina
+
+    summaries ({url: riepilogo}) viene preparato fuori dal loop con
+    ProductMonitor.history_summaries; i link mancanti vengono riassunti qui.
+    """
+    pages = page_count(len(urls))
+    start = page * MENU_PAGE_SIZE
+    shown = urls[start:start + MENU_PAGE_SIZE]
+    if not urls:
+        return MenuPage("📈 **Storico prodotti**\n\n❌ Nessun link configurato!", []), shown
+    title = f"📈 **Storico prodotti (ultimi {HISTORY_DAYS} giorni)**"
+    if pages > 1:
+        title += f" (pagina {page + 1}/{pages})"
+    text = title + "\n\n"
+    for url in shown:
+        summary = (summaries or {}).get(url) or monitor.history_summary(url, days=HISTORY_DAYS)
+        entry = format_history_summary(monitor.monitored_links[url], summary) + "\n"
+        if len(text) + len(entry) > MESSAGE_LIMIT:
+            break
+        text += entry
+    return MenuPage(text, [navigation_row('history', page, pages)]), shown
+
+
+RENDERERS = {
+    'list_links': render_list_page,
+    'remove_link': render_remove_page,
+    'history': render_history_page,
+}
+
+
+def page_key(chat_id, view, page):
+    return (str(chat_id) if chat_id is not None else None, view, page)
+
+
+def clamp_page(monitor, chat_id, page):
+    """(pagina limitata a quelle esistenti, link della chat)"""
+    urls = monitor.links_for(chat_id)
+    return min(max(page, 0), page_count(len(urls)) - 1), urls
+
+
+def cached_page(monitor, view, chat_id, page=0):
+    """Pagina del menu già preparata, None se va preparata"""
+    page, _ = clamp_page(monitor, chat_id, page)
+    return monitor.menu_cache.pages.get(page_key(chat_id, view, page), (None,))[0]
+
+
+def page_urls(monitor, chat_id, page=0):
+    """Link mostrati in una pagina dei menu"""
+    page, urls = clamp_page(monitor, chat_id, page)
+    start = page * MENU_PAGE_SIZE
+    return urls[start:start + MENU_PAGE_SIZE]
+
+
+def menu_page(monitor, view, chat_id, page=0, **prepared):
+    """Pagina del menu (dalla cache se non è cambiato nulla); la pagina viene limitata a quelle esistenti
+
+    prepared passa al renderer i dati calcolati prima (es. summaries per lo storico).
+    """
+    page, urls = clamp_page(monitor, chat_id, page)
+    key = page_key(chat_id, view, page)
+    cached = monitor.menu_cache.get(key)
+    if cached is not None:
+        return cached
+    rendered, shown = RENDERERS[view](monitor, urls, page, **prepared)
+    monitor.menu_cache.put(key, rendered, shown)
+    return rendered
+
+
+def parse_menu_callback(data):
+    """'list_links:2' -> ('list_links', 2); None se non è la pagina di un menu"""
+    view, _, page = data.partition(':')
+    if view not in RENDERERS:
+        return None
+    try:
+        return view, int(page) if page else 0
+    except ValueError:
+        return None
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Metriche delle fasi del controllo
+Durate per fase e per dominio (connessione, TTFB, download, parsing,
+riconoscimento della disponibilità, salvataggio, notifiche), byte
+scaricati ed esiti dei controlli. Le metriche sono esposte in formato
+Prometheus da un piccolo server HTTP opzionale (METRICS_PORT) e
+riassunte in JSON alla fine di ogni esecuzione del runner. Un profiler a
+campionamento opzionale registra gli stack più frequenti.
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Porta e indirizzo del server delle metriche (nessun server se la porta non è impostata)
+METRICS_PORT = os.environ.get('METRICS_PORT')
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+
+# Limiti superiori (secondi) delle classi degli istogrammi
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Osservazioni recenti tenute per serie per calcolare i percentili del riepilogo
+RECENT_SAMPLES = 1024
+
+STAGE_HELP = {
+    'wait': 'attesa dei limiti globali e per host',
+    'connect': 'DNS, connessione TCP e TLS',
+    'ttfb': "dall'invio della richiesta agli header della risposta",
+    'download': 'lettura del corpo',
+    'fingerprint': 'impronta delle regioni del prodotto',
+    'parse': 'analisi della pagina (JSON-LD e HTML)',
+    'match': 'riconoscimento della disponibilità',
+    'check': 'controllo completo di un link',
+    'persist': 'salvataggio di link e storico',
+    'notify': 'invio di un messaggio Telegram',
+}
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Series:
+    """Istogramma di una fase per un dominio"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def summary(self):
+        recent = list(self.recent)
+        return {
+            'count': self.count,
+            'total_seconds': round(self.sum, 4),
+            'p50_ms': round(percentile(recent, 50) * 1000, 2) if recent else None,
+            'p95_ms': round(percentile(recent, 95) * 1000, 2) if recent else None,
+            'max_ms': round(max(recent) * 1000, 2) if recent else None,
+        }
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Registro delle metriche del processo (usato da più thread)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.series = {}
+            self.counters = Counter()
+            self.started_at = time.time()
+
+    def observe(self, stage, seconds, domain=''):
+        with self._lock:
+            series = self.series.get((stage, domain))
+            if series is None:
+                series = self.series[(stage, domain)] = Series()
+            series.observe(seconds)
+
+    def count(self, name, value=1, domain='', **labels):
+        with self._lock:
+            self.counters[(name, domain, tuple(sorted(labels.items())))] += value
+
+    @contextmanager
+    def timer(self, stage, domain=''):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, domain)
+
+    def render(self):
+        """Metriche in formato testo di Prometheus"""
+        lines = [
+            '# HELP monitor_stage_seconds Durata delle fasi del controllo per dominio',
+            '# TYPE monitor_stage_seconds histogram',
+        ]
+        with self._lock:
+            series = sorted(self.series.items())
+            counters = sorted(self.counters.items())
+        for (stage, domain), data in series:
+            labels = f'stage="{escape_label(stage)}",domain="{escape_label(domain)}"'
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ('+Inf',), data.buckets):
+                cumulative += bucket
+                lines.append(f'monitor_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'monitor_stage_seconds_sum{{{labels}}} {data.sum:.6f}')
+            lines.append(f'monitor_stage_seconds_count{{{labels}}} {data.count}')
+
+        declared = set()
+        for (name, domain, labels), value in counters:
+            if name not in declared:
+                lines.append(f'# TYPE monitor_{name} counter')
+                declared.add(name)
+            pairs = ([('domain', domain)] if domain else []) + list(labels)
+            label_text = ','.join(f'{key}="{escape_label(val)}"' for key, val in pairs)
+            lines.append(f'monitor_{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Riepilogo JSON: fasi complessive, per dominio e domini più lenti"""
+        with self._lock:
+            series = dict(self.series)
+            counters = dict(self.counters)
+            started_at = self.started_at
+
+        stages = {}
+        domains = {}
+        for (stage, domain), data in series.items():
+            if domain:
+                domains.setdefault(domain, {}).setdefault('stages', {})[stage] = data.summary()
+            else:
+                stages[stage] = data.summary()
+        # Fasi complessive anche per quelle registrate solo per dominio
+        for stage in {stage for stage, domain in series if domain} - set(stages):
+            merged = Series()
+            for (name, domain), data in series.items():
+                if name == stage:
+                    merged.buckets = [a + b for a, b in zip(merged.buckets, data.buckets)]
+                    merged.count += data.count
+                    merged.sum += data.sum
+                    merged.recent.extend(data.recent)
+            stages[stage] = merged.summary()
+
+        totals = {}
+        for (name, domain, labels), value in counters.items():
+            key = name + ''.join(f'.{val}' for _, val in labels)
+            totals[key] = totals.get(key, 0) + value
+            if domain:
+                domains.setdefault(domain, {}).setdefault('counters', {})[key] = value
+
+        slowest = sorted(
+            ((domain, info['stages']['check']['p95_ms']) for domain, info in domains.items()
+             if info.get('stages', {}).get('check', {}).get('p95_ms') is not None),
+            key=lambda item: item[1], reverse=True
+        )[:5]
+        return {
+            'started_at': started_at,
+            'finished_at': time.time(),
+            'duration_seconds': round(time.time() - started_at, 3),
+            'stages': stages,
+            'counters': totals,
+            'slowest_domains': [{'domain': domain, 'check_p95_ms': p95} for domain, p95 in slowest],
+            'domains': domains,
+        }
+
+    def write_summary(self, path, **extra):
+        summary = self.summary()
+        summary.update(extra)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        logger.info(f"Riepilogo delle metriche scritto in {path}")
+        return summary
+
+
+# Registro condiviso da tutto il processo
+registry = Metrics()
+
+
+class RequestTrace:
+    """Callback 'trace' di httpx: tempo di connessione e TTFB di una richiesta"""
+
+    def __init__(self, domain, metrics=registry):
+        self.domain = domain
+        self.metrics = metrics
+        self.started = {}
+
+    async def __call__(self, event_name, info):
+        self.event(event_name)
+
+    def event(self, event_name):
+        step, _, phase = event_name.rpartition('.')
+        now = time.perf_counter()
+        if phase == 'started':
+            self.started[step] = now
+            return
+        if phase != 'complete' or step not in self.started:
+            return
+        elapsed = now - self.started[step]
+        # connect_tcp comprende la risoluzione DNS; start_tls la negoziazione TLS
+        if step.endswith(('connect_tcp', 'connect_unix_socket', 'start_tls')):
+            self.metrics.observe('connect', elapsed, self.domain)
+        elif step.endswith('receive_response_headers'):
+            request_started = self.started.get(step.replace('receive_response_headers', 'send_request_headers'))
+            if request_started is not None:
+                self.metrics.observe('ttfb', now - request_started, self.domain)
+
+
+def make_handler(metrics):
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/metrics.json'):
+                body = json.dumps(metrics.summary(), ensure_ascii=False).encode('utf-8')
+                content_type = 'application/json'
+            elif self.path.startswith('/metrics'):
+                body = metrics.render().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_metrics_server(port=None, host=METRICS_HOST, metrics=registry):
+    """Avvia in un thread il server di /metrics e /metrics.json (None se METRICS_PORT non è impostata)"""
+    port = port if port is not None else METRICS_PORT
+    if port in (None, ''):
+        return None
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((host, int(port)), make_handler(metrics))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Metriche disponibili su http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+class SamplingProfiler:
+    """Profiler a campionamento: ogni interval secondi registra lo stack di tutti i thread
+
+    Il risultato è nel formato 'collapsed' (uno stack per riga con il numero
+    di campioni), leggibile da flamegraph.pl e speedscope.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = ';'.join(
+                    f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                    for entry in traceback.extract_stack(frame)
+                )
+                self.stacks[stack] += 1
+
+    def stop(self, path=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, samples in self.stacks.most_common():
+                    f.write(f"{stack} {samples}\n")
+            logger.info(f"Profilo ({sum(self.stacks.values())} campioni) scritto in {path}")
+        return self.stacks
+
+
+def start_profiler(path=None):
+    """Avvia il profiler se PROFILE_FILE (o path) è indicato; restituisce (profiler, percorso)"""
+    path = path or os.environ.get('PROFILE_FILE')
+    if not path:
+        return None, None
+    interval = float(os.environ.get('PROFILE_INTERVAL', '0.01'))
+    return SamplingProfiler(interval).start(), path
@@ -4,105 +4,158 @@ Runner per il monitoraggio automatico dei prodotti
 Questo script viene eseguito da GitHub Actions
 """
 
+import time
+
+# Inizio del processo, per misurare il tempo di avvio (import compresi)
+STARTED = time.perf_counter()
+
 import os
 import sys
 import json
-import requests
+import asyncio
+import argparse
 import logging
 from datetime import datetime
 
-# Importa il monitor dal file principale
+# Il nucleo del monitoraggio, senza python-telegram-bot
 sys.path.append('.')
-from main import ProductMonitor
+from product_monitor import ProductMonitor
+from http_pool import get_pool
+from notifications import NotificationDispatcher, is_change, summarize_results
+from metrics import registry, start_profiler
+from sharding import SHARD_DIR, merge_shards, parse_shard, run_local, run_shard, shard_files, shard_metrics
+
+# Numero massimo di controlli per esecuzione (0 = nessun limite)
+MAX_CHECKS_PER_RUN = int(os.environ.get('MAX_CHECKS_PER_RUN', '0'))
 
 # Configurazione logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def send_telegram_message(token, chat_id, message, parse_mode='Markdown'):
-    """Invia un messaggio via Telegram"""
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    data = {
-        'chat_id': chat_id,
-        'text': message,
-        'parse_mode': parse_mode
-    }
-    
+async def send_notifications(token, results_by_chat):
+    """Accoda i cambiamenti per chat e consegna l'outbox (compresi i messaggi rimasti da esecuzioni precedenti)"""
+    dispatcher = NotificationDispatcher(token, window=0)
     try:
-        response = requests.post(url, data=data)
-        response.raise_for_status()
-        return True
-    except Exception as e:
-        logger.error(f"Errore nell'invio messaggio Telegram: {e}")
-        return False
+        for chat_id, results in results_by_chat.items():
+            dispatcher.add_results(chat_id, results)
+        return await dispatcher.close()
+    finally:
+        dispatcher.outbox.close()
+        await get_pool().aclose()
 
-def main():
-    """Funzione principale per il controllo automatico"""
-    # Ottieni le variabili d'ambiente
-    token = os.environ.get('TELEGRAM_BOT_TOKEN')
-    chat_id = os.environ.get('TELEGRAM_CHAT_ID')
-    
-    if not token or not chat_id:
-        logger.error("Token Telegram o Chat ID mancanti!")
-        return
-    
-    # Inizializza il monitor
-    monitor = ProductMonitor()
-    
+def run_checks(monitor, token, check_all=False):
+    """Controlla i prodotti scaduti (o tutti) e notifica i cambiamenti"""
     if not monitor.monitored_links:
         logger.info("Nessun link da monitorare")
         return
     
-    logger.info(f"Controllo {len(monitor.monitored_links)} prodotti...")
-    
-    # Esegui il controllo
-    results = monitor.check_all_products()
-    
-    # Prepara il messaggio di notifica
-    notifications = []
-    status_changes = []
-    price_changes = []
+    # Solo i link il cui prossimo controllo è già scaduto, dal più in ritardo
+    urls = None if check_all else monitor.due_links(MAX_CHECKS_PER_RUN or None)
+    if urls is not None and not urls:
+        next_due = monitor.scheduler.next_due()
+        logger.info(f"Nessun link da controllare ora (prossimo alle {datetime.fromtimestamp(next_due).strftime('%H:%M')})")
+        # Eventuali messaggi rimasti in coda dall'esecuzione precedente
+        asyncio.run(send_notifications(token, {}))
+        return
     
-    for result in results:
-        if result.get('error'):
-            continue
-        
-        # Controlla cambiamenti di stato
-        if result['status_changed']:
-            if result['in_stock']:
-                status_changes.append(f"✅ **{result['name']}** è tornato DISPONIBILE!")
-            else:
-                status_changes.append(f"❌ **{result['name']}** è diventato NON DISPONIBILE!")
-        
-        # Controlla cambiamenti di prezzo
-        if result['price_changed'] and result['price'] and result['old_price']:
-            price_changes.append(f"💰 **{result['name']}** - Prezzo cambiato: {result['old_price']} → {result['price']}")
+    logger.info(f"Controllo {len(urls) if urls is not None else len(monitor.monitored_links)} prodotti su {len(monitor.monitored_links)}...")
     
+    # Esegui il controllo
+    results = monitor.check_all_products(urls)
+    notify_results(monitor, token, results)
+
+def notify_results(monitor, token, results):
+    """Invia alle chat iscritte i cambiamenti dei risultati"""
     # Invia notifiche se ci sono cambiamenti importanti
-    if status_changes or price_changes:
-        message = "🔔 **Aggiornamenti Prodotti**\n\n"
-        
-        if status_changes:
-            message += "**📦 Cambiamenti di disponibilità:**\n"
-            message += "\n".join(status_changes) + "\n\n"
-        
-        if price_changes:
-            message += "**💰 Cambiamenti di prezzo:**\n"
-            message += "\n".join(price_changes) + "\n\n"
-        
-        message += f"🕐 Controllo eseguito: {datetime.now().strftime('%d/%m/%Y %H:%M')}"
-        
-        send_telegram_message(token, chat_id, message)
-        logger.info("Notifiche inviate!")
-    else:
+    has_changes = any(is_change(result) for result in results)
+    # Ogni chat riceve solo i cambiamenti dei link che segue
+    remaining = asyncio.run(send_notifications(token, monitor.subscriptions.fan_out(results)))
+    if not has_changes:
         logger.info("Nessun cambiamento rilevato")
+    elif not remaining:
+        logger.info("Notifiche inviate!")
     
     # Crea un report di stato
-    available_count = sum(1 for r in results if r['in_stock'] and not r.get('error'))
-    unavailable_count = sum(1 for r in results if not r['in_stock'] and not r.get('error'))
-    error_count = sum(1 for r in results if r.get('error'))
+    logger.info(f"Risultati: {summarize_results(results)}")
+
+def main():
+    """Funzione principale per il controllo automatico"""
+    parser = argparse.ArgumentParser(description="Controllo automatico dei prodotti monitorati")
+    # Con --all si controllano tutti i link ignorando la pianificazione
+    parser.add_argument('--all', action='store_true', help='controlla tutti i link ignorando la pianificazione')
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('MONITOR_SHARDS', '1')),
+                        help='divide i link in N shard controllati da processi paralleli')
+    parser.add_argument('--shard', help="controlla solo lo shard I/N e ne scrive il file di stato (job di una matrice)")
+    parser.add_argument('--merge', nargs='?', const=SHARD_DIR, metavar='CARTELLA',
+                        help='unisce i file di stato degli shard e invia le notifiche')
+    parser.add_argument('--summary', default=os.environ.get('METRICS_SUMMARY'), metavar='FILE',
+                        help='scrive il riepilogo JSON delle metriche della esecuzione')
+    parser.add_argument('--profile', metavar='FILE', help='profilo a campionamento (formato collapsed)')
+    args = parser.parse_args()
+    limit = MAX_CHECKS_PER_RUN or None
+    
+    profiler, profile_path = start_profiler(args.profile)
+    extra = {}
+    try:
+        extra = run(args, limit) or {}
+    finally:
+        if profiler:
+            profiler.stop(profile_path)
+        if args.summary:
+            registry.write_summary(args.summary, mode=run_mode(args), **extra)
+        slowest = registry.summary()['slowest_domains']
+        if slowest:
+            logger.info("Domini più lenti (p95): " + ", ".join(f"{d['domain']} {d['check_p95_ms']} ms" for d in slowest))
+
+def run_mode(args):
+    """Modalità dell'esecuzione, riportata nel riepilogo delle metriche"""
+    if args.shard:
+        return f"shard {args.shard}"
+    if args.merge:
+        return 'merge'
+    return f"{args.shards} shard" if args.shards > 1 else 'single'
+
+def run(args, limit):
+    """Esegue i controlli nella modalità scelta dagli argomenti; restituisce i dati extra del riepilogo"""
+    # Import e argomenti soltanto: misurato prima di shard, controlli e caricamento dei link
+    logger.info(f"Avvio completato in {(time.perf_counter() - STARTED) * 1000:.0f} ms")
+    if args.shard:
+        # Job di una matrice: niente database né notifiche, solo il file di stato
+        shard, shards = parse_shard(args.shard)
+        path = run_shard(shard, shards, args.all, limit and max(1, limit // shards))
+        logger.info(f"Stato dello shard scritto in {path}")
+        return
     
-    logger.info(f"Risultati: {available_count} disponibili, {unavailable_count} non disponibili, {error_count} errori")
+    # Ottieni le variabili d'ambiente
+    # TELEGRAM_CHAT_ID serve solo per i link salvati prima delle iscrizioni per chat
+    token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    
+    if not token:
+        logger.error("Token Telegram mancante!")
+        return
+    
+    if not args.merge and args.shards > 1:
+        paths = run_local(args.shards, args.all, limit and max(1, limit // args.shards))
+    elif args.merge:
+        paths = shard_files(args.merge)
+    else:
+        paths = None
+    
+    # Inizializza il monitor
+    loading = time.perf_counter()
+    monitor = ProductMonitor()
+    logger.info(f"{len(monitor.monitored_links)} link caricati in {(time.perf_counter() - loading) * 1000:.0f} ms")
+    try:
+        if paths is None:
+            run_checks(monitor, token, args.all)
+        else:
+            results = merge_shards(monitor, paths)
+            notify_results(monitor, token, results)
+    finally:
+        # Salva le modifiche e riporta il WAL nel database
+        monitor.close()
+    # I controlli degli shard sono misurati nei loro processi
+    return {'shards': shard_metrics(paths)} if paths is not None else {}
 
 if __name__ == '__main__':
     main()
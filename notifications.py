@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Notifiche dei cambiamenti via Telegram
+I cambiamenti vengono salvati nel database appena arrivano; al momento della
+consegna quelli arrivati entro una breve finestra vengono raccolti in un
+solo messaggio per chat, diviso al limite di lunghezza di Telegram. I
+messaggi passano da una coda persistente (outbox) e vengono eliminati solo
+dopo l'invio riuscito, rispettando i limiti per chat e globali e il
+retry_after delle risposte 429.
+"""
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+from http_pool import get_pool
+from metrics import registry
+from pricing import price_change_percent
+from rate_limiter import TokenBucket
+from storage import LINKS_DB
+
+logger = logging.getLogger(__name__)
+
+# Endpoint dell'API di Telegram (sovrascrivibile per i test, vedi tools/fake_telegram.py)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Database della coda dei messaggi (default: lo stesso dei link)
+OUTBOX_DB = os.environ.get('OUTBOX_DB', LINKS_DB)
+
+# Lunghezza massima di un messaggio Telegram
+MESSAGE_LIMIT = 4096
+
+# Secondi durante i quali i cambiamenti vengono raccolti in un solo messaggio
+COALESCE_WINDOW = float(os.environ.get('NOTIFY_COALESCE_WINDOW', '10'))
+
+# Limiti di Telegram: circa 1 messaggio al secondo per chat e 30 in totale
+PER_CHAT_RATE = 1.0
+GLOBAL_RATE = 30.0
+
+# Tentativi per messaggio in una stessa consegna e attesa massima tra due tentativi
+MAX_ATTEMPTS = 5
+MAX_RETRY_DELAY = 60
+
+
+def build_notification_message(results):
+    """Messaggio con i cambiamenti di disponibilità e prezzo (None se non ce ne sono)"""
+    status_changes = []
+    price_changes = []
+
+    for result in results:
+        if result.get('error'):
+            continue
+
+        # Controlla cambiamenti di stato
+        if result['status_changed']:
+            if result['in_stock']:
+                status_changes.append(f"✅ **{result['name']}** è tornato DISPONIBILE!")
+            else:
+                status_changes.append(f"❌ **{result['name']}** è diventato NON DISPONIBILE!")
+
+        # Controlla cambiamenti di prezzo
+        if result['price_changed'] and result['price'] and result['old_price']:
+            change = price_change_percent(result.get('old_price_minor'), result.get('price_minor'))
+            percent = f" ({change:+.1f}%)" if change is not None else ""
+            price_changes.append(
+                f"💰 **{result['name']}** - Prezzo cambiato: {result['old_price']} → {result['price']}{percent}"
+            )
+
+    if not status_changes and not price_changes:
+        return None
+
+    message = "🔔 **Aggiornamenti Prodotti**\n\n"
+
+    if status_changes:
+        message += "**📦 Cambiamenti di disponibilità:**\n"
+        message += "\n".join(status_changes) + "\n\n"
+
+    if price_changes:
+        message += "**💰 Cambiamenti di prezzo:**\n"
+        message += "\n".join(price_changes) + "\n\n"
+
+    message += f"🕐 Controllo eseguito: {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+    return message
+
+
+def summarize_results(results):
+    """Conteggio di disponibili, non disponibili ed errori"""
+    available_count = sum(1 for r in results if r['in_stock'] and not r.get('error'))
+    unavailable_count = sum(1 for r in results if not r['in_stock'] and not r.get('error'))
+    error_count = sum(1 for r in results if r.get('error'))
+    return f"{available_count} disponibili, {unavailable_count} non disponibili, {error_count} errori"
+
+
+def is_change(result):
+    return not result.get('error') and (
+        result['status_changed'] or (result['price_changed'] and result['price'] and result['old_price'])
+    )
+
+
+def coalesce_changes(results):
+    """Un solo risultato per prodotto: l'ultimo, con il prezzo precedente del primo"""
+    latest = {}
+    for result in results:
+        if result['url'] in latest:
+            first = latest[result['url']]
+            result = dict(result, old_price=first['old_price'], old_price_minor=first.get('old_price_minor'))
+        latest[result['url']] = result
+    return list(latest.values())
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """Divide il testo in parti di al massimo limit caratteri, preferendo le righe intere"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    if text:
+        parts.append(text)
+    return parts
+
+
+class Outbox:
+    """Coda persistente dei messaggi da inviare (tabelle outbox e outbox_changes di SQLite)
+
+    I cambiamenti non ancora trasformati in messaggi restano in outbox_changes:
+    un'interruzione prima della consegna non li perde.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT
+        );
+        CREATE TABLE IF NOT EXISTS outbox_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path=OUTBOX_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+    def add(self, chat_id, texts, parse_mode='Markdown'):
+        """Accoda i messaggi (in un'unica transazione)"""
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT INTO outbox (chat_id, text, parse_mode, created_at) VALUES (?, ?, ?, ?)',
+                [(str(chat_id), text, parse_mode, now) for text in texts]
+            )
+
+    def add_changes(self, chat_id, results):
+        """Salva i cambiamenti di una chat (in un'unica transazione)"""
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT INTO outbox_changes (chat_id, result, created_at) VALUES (?, ?, ?)',
+                [(str(chat_id), json.dumps(result, ensure_ascii=False, default=str), now) for result in results]
+            )
+
+    def pending_changes(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM outbox_changes').fetchone()[0]
+
+    def compose(self, render, parse_mode='Markdown'):
+        """Trasforma i cambiamenti salvati in messaggi con render(risultati) -> [testi]
+
+        Inserimento dei messaggi e rimozione dei cambiamenti avvengono nella
+        stessa transazione. Restituisce il numero di messaggi accodati.
+        """
+        now = time.time()
+        with self._lock, self.conn:
+            rows = self.conn.execute('SELECT id, chat_id, result FROM outbox_changes ORDER BY id').fetchall()
+            if not rows:
+                return 0
+            by_chat = {}
+            for _, chat_id, result in rows:
+                by_chat.setdefault(chat_id, []).append(json.loads(result))
+            messages = [(chat_id, text, parse_mode, now)
+                        for chat_id, results in by_chat.items() for text in render(results)]
+            self.conn.executemany(
+                'INSERT INTO outbox (chat_id, text, parse_mode, created_at) VALUES (?, ?, ?, ?)', messages
+            )
+            self.conn.execute('DELETE FROM outbox_changes WHERE id <= ?', (rows[-1][0],))
+        return len(messages)
+
+    def pending(self):
+        """Messaggi in attesa, dal più vecchio: [(id, chat_id, text, parse_mode)]"""
+        with self._lock:
+            return self.conn.execute('SELECT id, chat_id, text, parse_mode FROM outbox ORDER BY id').fetchall()
+
+    def sent(self, message_id):
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM outbox WHERE id = ?', (message_id,))
+
+    def failed(self, message_id, error):
+        with self._lock, self.conn:
+            self.conn.execute(
+                'UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?',
+                (str(error)[:500], message_id)
+            )
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class TelegramError(Exception):
+    """Risposta di errore dell'API di Telegram"""
+
+    def __init__(self, status_code, description, retry_after=None):
+        super().__init__(f"{status_code}: {description}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class NotificationDispatcher:
+    """Salva i cambiamenti per chat nell'outbox e li consegna raccolti in messaggi"""
+
+    def __init__(self, token, outbox=None, window=COALESCE_WINDOW, api_url=None, pool=None):
+        self.token = token
+        self.outbox = outbox or Outbox()
+        self.window = window
+        self.api_url = (api_url or TELEGRAM_API_URL).rstrip('/')
+        self.pool = pool or get_pool()
+        # Task che consegnerà i cambiamenti alla fine della finestra
+        self.flush_task = None
+        self.chat_buckets = {}
+        self.global_bucket = None
+        self._deliver_lock = None
+
+    def add_results(self, chat_id, results):
+        """Salva subito i cambiamenti di un controllo; vengono inviati alla fine della finestra"""
+        changes = [r for r in results if is_change(r)]
+        if not changes:
+            return
+        self.outbox.add_changes(chat_id, changes)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        while True:
+            await asyncio.sleep(self.window)
+            await self.flush()
+            # Cambiamenti arrivati durante la consegna: un'altra finestra
+            if not self.outbox.pending_changes():
+                return
+
+    def enqueue(self):
+        """Trasforma i cambiamenti salvati (anche da esecuzioni precedenti) in messaggi nell'outbox"""
+        def render(results):
+            # Lo stesso prodotto cambiato più volte nella finestra compare una volta sola
+            message = build_notification_message(coalesce_changes(results))
+            return split_message(message) if message else []
+        return self.outbox.compose(render)
+
+    async def flush(self):
+        """Consegna subito i cambiamenti salvati e l'outbox"""
+        return await self.deliver()
+
+    async def close(self):
+        """Invia tutto quello che è in attesa (da chiamare prima di uscire)"""
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+        return await self.flush()
+
+    def _bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(PER_CHAT_RATE, 1)
+        return bucket
+
+    async def send(self, chat_id, text, parse_mode):
+        """Una chiamata a sendMessage; solleva TelegramError in caso di errore"""
+        url = f"{self.api_url}/bot{self.token}/sendMessage"
+        data = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            data['parse_mode'] = parse_mode
+        started = time.perf_counter()
+        response = await self.pool.async_client(url).post(url, data=data)
+        registry.observe('notify', time.perf_counter() - started)
+        registry.count('notifications_total', status=response.status_code)
+        if response.is_success:
+            return
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        retry_after = (payload.get('parameters') or {}).get('retry_after')
+        raise TelegramError(response.status_code, payload.get('description', response.text[:200]), retry_after)
+
+    async def deliver_one(self, message_id, chat_id, text, parse_mode):
+        """Invia un messaggio dell'outbox riprovando; True se consegnato o da scartare"""
+        delay = 1
+        for attempt in range(MAX_ATTEMPTS):
+            await self._bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.send(chat_id, text, parse_mode)
+                return True
+            except TelegramError as e:
+                if e.status_code == 429:
+                    wait = e.retry_after or delay
+                    logger.warning(f"Telegram limita gli invii: nuovo tentativo tra {wait}s")
+                    await asyncio.sleep(wait)
+                    continue
+                if e.status_code == 400 and parse_mode:
+                    # Markdown non valido (es. nomi con caratteri speciali): testo semplice
+                    logger.warning(f"Messaggio rifiutato con {parse_mode}, invio come testo: {e}")
+                    parse_mode = None
+                    continue
+                if 400 <= e.status_code < 500:
+                    logger.error(f"Messaggio scartato per la chat {chat_id}: {e}")
+                    return True
+                error = e
+            except Exception as e:
+                error = e
+            self.outbox.failed(message_id, error)
+            logger.warning(f"Invio non riuscito (tentativo {attempt + 1}/{MAX_ATTEMPTS}): {error}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+        return False
+
+    async def deliver(self):
+        """Consegna i messaggi dell'outbox (anche quelli rimasti da esecuzioni precedenti)
+
+        Prima i cambiamenti salvati diventano messaggi. I messaggi di una stessa chat partono in ordine; chat diverse in parallelo.
+        Restituisce il numero di messaggi ancora in attesa.
+        """
+        if self._deliver_lock is None:
+            self._deliver_lock = asyncio.Lock()
+            self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        async with self._deliver_lock:
+            self.enqueue()
+            by_chat = {}
+            for message in self.outbox.pending():
+                by_chat.setdefault(message[1], []).append(message)
+
+            async def deliver_chat(messages):
+                for message in messages:
+                    if not await self.deliver_one(*message):
+                        # I successivi restano in coda per non invertire l'ordine
+                        return
+                    self.outbox.sent(message[0])
+
+            await asyncio.gather(*(deliver_chat(messages) for messages in by_chat.values()))
+            remaining = len(self.outbox.pending())
+        if remaining:
+            logger.warning(f"{remaining} messaggi restano nell'outbox per il prossimo invio")
+        return remaining
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Backend di parsing HTML per le pagine prodotto
+Prima del parsing la pagina viene ridotta alle parti utili (via script,
+stili, SVG e commenti, tenendo il JSON-LD), poi analizzata con lxml
+(predefinito), selectolax o html.parser. Titolo e prezzo sono gli stessi
+per tutti i backend.
+"""
+
+import os
+import re
+
+from matcher import (
+    PRICE_RE, PRICE_SELECTOR, PRICE_SELECTORS, TITLE_SELECTOR, TITLE_SELECTORS,
+    STRUCK_PRICE_SELECTORS, find_price_texts, find_title, is_struck_price
+)
+
+# Backend da usare: lxml, selectolax oppure html.parser
+HTML_PARSER = os.environ.get('HTML_PARSER', 'lxml')
+
+# Riduzione della pagina prima del parsing: 'auto' la usa solo con html.parser,
+# dove il costo del parsing supera quello della riduzione
+HTML_PARSER_SCOPED = os.environ.get('HTML_PARSER_SCOPED', 'auto')
+
+# Blocchi che non contengono titolo o prezzo e che su molti negozi
+# occupano la maggior parte della pagina
+IRRELEVANT_BLOCKS_RE = re.compile(
+    r'<script(?![^>]*application/ld\+json)[^>]*>.*?</script\s*>'
+    r'|<style[^>]*>.*?</style\s*>'
+    r'|<svg[^>]*>.*?</svg\s*>'
+    r'|<!--.*?-->',
+    re.IGNORECASE | re.DOTALL
+)
+
+XML_DECLARATION_RE = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+STRUCK_PRICE_CSS = ', '.join(STRUCK_PRICE_SELECTORS)
+
+
+def scope_page(page_text):
+    """Rimuove dalla pagina i blocchi irrilevanti per titolo e prezzo (tranne il JSON-LD)"""
+    return IRRELEVANT_BLOCKS_RE.sub('', XML_DECLARATION_RE.sub('', page_text, count=1))
+
+
+def strip_join(strings):
+    """Concatena i testi rimuovendo gli spazi di ognuno (come get_text(strip=True))"""
+    return ''.join(s.strip() for s in strings)
+
+
+class ParsedPage:
+    """Interfaccia comune dei backend"""
+
+    # Se ridurre la pagina prima del parsing quando HTML_PARSER_SCOPED è 'auto'
+    scoped_by_default = False
+
+    def title(self):
+        """Primo titolo non vuoto secondo TITLE_SELECTORS"""
+        raise NotImplementedError
+
+    def title_tag(self):
+        """Testo del tag <title>, se presente"""
+        raise NotImplementedError
+
+    def price_texts(self):
+        """(testo, testo barrato) del primo elemento con un prezzo secondo PRICE_SELECTORS
+
+        Il testo può contenere più importi (prezzo pieno e prezzo scontato,
+        risparmio, prezzo unitario), vedi pricing.label_prices; il testo
+        barrato è quello degli elementi di STRUCK_PRICE_SELECTORS al suo interno.
+        """
+        raise NotImplementedError
+
+    def price_text(self):
+        """Testo del primo elemento con un prezzo secondo PRICE_SELECTORS"""
+        return self.price_texts()[0]
+
+    def price(self):
+        """Primo prezzo trovato secondo PRICE_SELECTORS"""
+        price_match = PRICE_RE.search(self.price_text() or '')
+        return price_match.group(0) if price_match else None
+
+
+class SoupPage(ParsedPage):
+    """BeautifulSoup con il builder indicato (html.parser o lxml)"""
+
+    scoped_by_default = True
+
+    def __init__(self, page_text, builder='html.parser'):
+        from bs4 import BeautifulSoup
+        self.soup = BeautifulSoup(page_text, builder)
+
+    def title(self):
+        return find_title(self.soup)
+
+    def title_tag(self):
+        return self.soup.title.string if self.soup.title else None
+
+    def price_texts(self):
+        return find_price_texts(self.soup)
+
+
+def lxml_elements(root):
+    """Elementi di un albero lxml nel formato di matcher.PrioritySelector"""
+    from lxml import etree
+    for element in root.iter(etree.Element):
+        yield element, element.tag, (element.get('class') or '').split(), element.get('id')
+
+
+class LxmlPage(ParsedPage):
+    """lxml.html, con gli stessi selettori precompilati di matcher.py"""
+
+    def __init__(self, page_text):
+        import lxml.html
+        # lxml non accetta documenti vuoti
+        self.root = lxml.html.document_fromstring(page_text if page_text.strip() else '<html></html>')
+
+    def title(self):
+        for element in TITLE_SELECTOR.candidates(lxml_elements(self.root)):
+            title = strip_join(element.itertext())
+            if title:
+                return title
+        return ''
+
+    def title_tag(self):
+        title = self.root.find('.//title')
+        return title.text if title is not None else None
+
+    def price_texts(self):
+        for element in PRICE_SELECTOR.candidates(lxml_elements(self.root)):
+            text = strip_join(element.itertext())
+            if PRICE_RE.search(text):
+                struck = [strip_join(item[0].itertext()) for item in lxml_elements(element)
+                          if item[0] is not element and is_struck_price(*item)]
+                return text, ' '.join(struck)
+        return None, ''
+
+
+class SelectolaxPage(ParsedPage):
+    """selectolax (motore lexbor), opzionale: pip install selectolax"""
+
+    def __init__(self, page_text):
+        from selectolax.lexbor import LexborHTMLParser
+        self.tree = LexborHTMLParser(page_text)
+
+    def _first_elements(self, selectors):
+        for selector in selectors:
+            node = self.tree.css_first(selector)
+            if node is not None:
+                yield node
+
+    def title(self):
+        for node in self._first_elements(TITLE_SELECTORS):
+            title = node.text(deep=True, separator='', strip=True)
+            if title:
+                return title
+        return ''
+
+    def title_tag(self):
+        node = self.tree.css_first('title')
+        return node.text() if node is not None else None
+
+    def price_texts(self):
+        for node in self._first_elements(PRICE_SELECTORS):
+            text = node.text(deep=True, separator='', strip=True)
+            if PRICE_RE.search(text):
+                struck = [item.text(deep=True, separator='', strip=True) for item in node.css(STRUCK_PRICE_CSS)]
+                return text, ' '.join(struck)
+        return None, ''
+
+
+BACKENDS = {
+    'lxml': LxmlPage,
+    'selectolax': SelectolaxPage,
+    'html.parser': SoupPage,
+}
+
+
+def parse_page(page_text, backend=None, scoped=None):
+    """Analizza la pagina con il backend scelto (default: HTML_PARSER)"""
+    backend = backend or HTML_PARSER
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend HTML sconosciuto: {backend}")
+    page_class = BACKENDS[backend]
+
+    if scoped is None:
+        scoped = page_class.scoped_by_default if HTML_PARSER_SCOPED == 'auto' else HTML_PARSER_SCOPED == '1'
+    if scoped:
+        page_text = scope_page(page_text)
+    else:
+        page_text = XML_DECLARATION_RE.sub('', page_text, count=1)
+    return page_class(page_text)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Normalizzazione dei prezzi
+Trasforma il testo di un prezzo ('€ 1.234,50', '24.90€', 'USD 1,299.00')
+in importo Decimal e codice ISO della valuta, così i confronti tra due
+controlli sono numerici e non dipendono dalla formattazione della pagina.
+Il separatore dei decimali riconosciuto su un dominio viene ricordato e
+usato per i casi ambigui (es. '1.234') delle pagine successive.
+"""
+
+import re
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from domain_config import get_domain_config
+from matcher import PRICE_NUMBER, PRICE_RE
+
+CURRENCY_SYMBOLS = {'EUR': '€', 'USD': '$', 'GBP': '£', 'JPY': '¥'}
+SYMBOL_CURRENCIES = {symbol: code for code, symbol in CURRENCY_SYMBOLS.items()}
+
+# Valute senza decimali
+ZERO_DECIMAL_CURRENCIES = {'JPY', 'KRW'}
+
+# Separatori delle migliaia che non sono anche separatori dei decimali
+THOUSANDS_SPACES_RE = re.compile(r"[\s']")
+
+BARE_NUMBER_RE = re.compile(PRICE_NUMBER)
+
+# Etichette subito prima di un importo (nel testo dopo l'importo precedente). Il
+# testo degli elementi è unito senza spazi ('Regular priceSale price€20'): le
+# etichette di più parole valgono anche attaccate, le parole brevi solo intere
+SAVING_RE = re.compile(r'(?:you save|saving|risparmi\w*|sconto|\bsave|-)\s*(?:di)?\s*:?\s*$', re.IGNORECASE)
+REGULAR_RE = re.compile(
+    r'(?:regular price|compare at|original price|list price|prezzo pieno|prezzo di listino|prezzo originale'
+    r'|invece di|anziché|\bwas|\brrp|\bprima)\s*:?\s*$',
+    re.IGNORECASE
+)
+SALE_RE = re.compile(r'(?:sale price|prezzo scontato|prezzo in offerta|in offerta|\bnow|\bora)\s*:?\s*$',
+                     re.IGNORECASE)
+
+# Suffisso di un prezzo unitario: '/g', '/ 100 g', 'al kg', 'per 100 ml'
+UNIT_RE = re.compile(r'\s*(?:/|\bal\b|\bper\b)\s*[\d.,]*\s*(?:g|gr|kg|mg|ml|cl|l|lt|lb|oz|pz|pc|unit\w*)\b',
+                     re.IGNORECASE)
+
+# Separatore dei decimali riconosciuto per dominio ('.' o ',')
+_domain_separators = {}
+
+
+class Price(namedtuple('Price', 'amount currency text')):
+    """Importo (Decimal), codice ISO della valuta e testo originale"""
+
+    __slots__ = ()
+
+    @property
+    def minor(self):
+        """Importo intero nell'unità minima della valuta (centesimi per l'euro)"""
+        digits = minor_digits(self.currency)
+        return int((self.amount * 10 ** digits).to_integral_value(ROUND_HALF_UP))
+
+
+def minor_digits(currency):
+    return 0 if currency in ZERO_DECIMAL_CURRENCIES else 2
+
+
+def currency_of(symbol, domain=None):
+    """Codice ISO per il simbolo o codice trovato nel prezzo
+
+    '$' e '¥' sono usati da più valute: la chiave 'currency' della
+    configurazione del dominio ha la precedenza.
+    """
+    configured = get_domain_config(domain).get('currency') if domain else None
+    if configured:
+        return configured.upper()
+    symbol = symbol.strip().upper()
+    return SYMBOL_CURRENCIES.get(symbol, symbol or None)
+
+
+def decimal_separator(number, domain=None):
+    """Separatore dei decimali del numero ('.', ',' o None se è intero)"""
+    last_dot = number.rfind('.')
+    last_comma = number.rfind(',')
+    if last_dot >= 0 and last_comma >= 0:
+        return '.' if last_dot > last_comma else ','
+    separator = '.' if last_dot >= 0 else ',' if last_comma >= 0 else None
+    if separator is None:
+        return None
+    if number.count(separator) > 1:
+        # '1.234.567' : il separatore ripetuto è quello delle migliaia
+        return None
+    if len(number) - number.rfind(separator) - 1 != 3:
+        return separator
+    # '1.234' o '1,234': migliaia, a meno che il dominio non usi proprio quel separatore per i decimali
+    known = domain_separator(domain)
+    return separator if known == separator else None
+
+
+def domain_separator(domain):
+    if not domain:
+        return None
+    if domain not in _domain_separators:
+        _domain_separators[domain] = get_domain_config(domain).get('decimal_separator')
+    return _domain_separators[domain]
+
+
+def learn_separator(number, separator, domain):
+    """Ricorda il separatore dei decimali del dominio se il numero non è ambiguo"""
+    if not domain or separator is None or _domain_separators.get(domain):
+        return
+    digits_after = len(number) - number.rfind(separator) - 1
+    if digits_after != 3 or ('.' in number and ',' in number):
+        _domain_separators[domain] = separator
+
+
+def parse_amount(number, domain=None):
+    """Decimal dal numero così come compare nella pagina (None se non valido)"""
+    number = THOUSANDS_SPACES_RE.sub('', number).strip('.,')
+    if not number:
+        return None
+    separator = decimal_separator(number, domain)
+    learn_separator(number, separator, domain)
+    if separator is None:
+        integer, decimals = number, ''
+    else:
+        cut = number.rfind(separator)
+        integer, decimals = number[:cut], number[cut + 1:]
+    integer = re.sub(r'[.,]', '', integer) or '0'
+    try:
+        return Decimal(f"{integer}.{decimals}" if decimals else integer)
+    except InvalidOperation:
+        return None
+
+
+def price_of(match, domain=None):
+    """Price da un match di PRICE_RE (None se l'importo non è valido)"""
+    symbol = match.group('before') or match.group('after') or ''
+    number = match.group('number_before') or match.group('number_after')
+    amount = parse_amount(number, domain)
+    if amount is None:
+        return None
+    return Price(amount, currency_of(symbol, domain), match.group(0).strip())
+
+
+def parse_prices(text, domain=None):
+    """Tutti i prezzi presenti nel testo, nell'ordine in cui compaiono"""
+    if not text:
+        return []
+    prices = (price_of(match, domain) for match in PRICE_RE.finditer(str(text)))
+    return [price for price in prices if price is not None]
+
+
+def label_prices(text, domain=None, struck_text=None):
+    """[(prezzo, ruolo)] degli importi del testo, nell'ordine in cui compaiono
+
+    Il ruolo dipende dall'etichetta tra l'importo precedente e questo:
+    'sale' per il prezzo scontato, 'regular' per un prezzo pieno esplicito
+    (anche se compare in struck_text, il testo barrato), 'current' senza
+    etichetta, None per un risparmio ('Save €5') o un prezzo unitario ('€ 0,83/g').
+    """
+    if not text:
+        return []
+    text = str(text)
+    struck = {(price.amount, price.currency) for price in parse_prices(struck_text, domain)}
+    labelled = []
+    previous_end = 0
+    for match in PRICE_RE.finditer(text):
+        before = text[previous_end:match.start()]
+        previous_end = match.end()
+        price = price_of(match, domain)
+        if price is None:
+            continue
+        if SAVING_RE.search(before) or UNIT_RE.match(text, match.end()):
+            role = None
+        elif REGULAR_RE.search(before) or (price.amount, price.currency) in struck:
+            role = 'regular'
+        elif SALE_RE.search(before):
+            role = 'sale'
+        else:
+            role = 'current'
+        labelled.append((price, role))
+    return labelled
+
+
+def parse_price(text, domain=None):
+    """Primo prezzo del testo (None se non ce ne sono)
+
+    Accetta anche un numero o un importo senza valuta ('24.90').
+    """
+    if isinstance(text, (int, float, Decimal)):
+        return Price(Decimal(str(text)), None, str(text))
+    prices = parse_prices(text, domain)
+    if prices:
+        return prices[0]
+    if text and BARE_NUMBER_RE.fullmatch(str(text).strip()):
+        amount = parse_amount(str(text).strip(), domain)
+        if amount is not None:
+            return Price(amount, None, str(text).strip())
+    return None
+
+
+def pick_price(prices):
+    """(prezzo attuale, prezzo pieno) tra i prezzi di uno stesso elemento, da label_prices
+
+    Il prezzo attuale è il primo prezzo scontato o, senza etichette, il primo
+    importo; risparmi e prezzi unitari non contano. Il prezzo pieno è solo
+    quello esplicito (etichetta o testo barrato), nella stessa valuta e più
+    alto dell'attuale; altrimenti è None.
+    """
+    candidates = ([price for price, role in prices if role == 'sale']
+                  or [price for price, role in prices if role == 'current']
+                  or [price for price, role in prices if role == 'regular'])
+    if not candidates:
+        return None, None
+    current = candidates[0]
+    regular = next((price for price, role in prices if role == 'regular' and price.currency == current.currency
+                    and price.amount > current.amount), None)
+    return current, regular
+
+
+def price_fields(price, regular=None):
+    """Campi numerici del prezzo per product_info e per i dati del link"""
+    if price is None:
+        return {'price_minor': None, 'currency': None}
+    fields = {'price_minor': price.minor, 'currency': price.currency}
+    if regular is not None:
+        fields['regular_price_minor'] = regular.minor
+    return fields
+
+
+def normalize_info(product_info, domain=None):
+    """Aggiunge a product_info i campi numerici del prezzo se mancano"""
+    if 'price_minor' not in product_info:
+        product_info.update(price_fields(parse_price(product_info.get('price'), domain)))
+    return product_info
+
+
+def price_change_percent(old_minor, new_minor):
+    """Variazione percentuale tra due importi (None se non calcolabile)"""
+    if not old_minor or new_minor is None:
+        return None
+    return (new_minor - old_minor) * 100 / old_minor
@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+"""
+Nucleo del monitoraggio: link, controlli, storico e pianificazione
+Non dipende da python-telegram-bot ed è usato sia dal bot (main.py) sia
+dal runner; importarlo non apre l'archivio né carica i parser HTML, che
+vengono importati al primo uso.
+"""
+
+import time
+import asyncio
+import logging
+from datetime import datetime
+from check_engine import CheckEngine, SharedSweep
+from domain_config import domain_of, get_domain_config, normalize_url
+from extractors import format_price
+from history import HistoryStore, record_from_info
+from http_pool import get_pool
+from matcher import get_matcher
+from menus import LinkIdIndex, MenuCache
+from metrics import registry
+from parsers import parse_page
+from pricing import Price, label_prices, normalize_info, parse_price, pick_price, price_change_percent, price_fields
+from scheduler import Scheduler
+from storage import open_store
+from subscriptions import SubscriptionIndex
+from streaming import FORM_BLOCKS, decode_body, page_limit, read_body
+
+logger = logging.getLogger(__name__)
+
+class ProductMonitor:
+    def __init__(self, store=None, history=None):
+        self.store = store or open_store()
+        self.history = history or HistoryStore()
+        self.monitored_links = self.load_links()
+        # Link modificati dall'ultimo salvataggio: aggiunte, nomi e iscrizioni
+        # (riga intera) ed esiti dei controlli (solo i campi del controllo)
+        self.dirty_links = set()
+        self.checked_links = set()
+        self.scheduler = Scheduler(self)
+        self.subscriptions = SubscriptionIndex(self.monitored_links)
+        # ID brevi dei pulsanti e pagine dei menu già preparate
+        self.link_ids = LinkIdIndex(self.monitored_links)
+        self.menu_cache = MenuCache()
+        # Risultato atteso dei link in controllo in questo momento e
+        # controlli completi in corso per chat (None = tutti i link)
+        self.in_progress = {}
+        self.active_sweeps = {}
+    
+    def load_links(self):
+        """Carica i link dall'archivio"""
+        try:
+            return self.store.load_all()
+        except Exception as e:
+            logger.error(f"Errore nel caricamento links: {e}")
+            return {}
+    
+    def mark_dirty(self, url):
+        """Segna un link come da salvare al prossimo save_links()"""
+        self.dirty_links.add(url)
+        self.menu_cache.invalidate_url(url)
+    
+    def mark_checked(self, url):
+        """Segna l'esito di un controllo come da salvare al prossimo save_links()"""
+        self.checked_links.add(url)
+        self.menu_cache.invalidate_url(url)
+    
+    def lists_changed(self, url, chat_ids):
+        """Il link è entrato o uscito dalle liste delle chat: le loro pagine dei menu vanno rifatte"""
+        self.menu_cache.invalidate_url(url)
+        for chat_id in list(chat_ids) + [None]:
+            self.menu_cache.invalidate_chat(chat_id)
+    
+    def save_links(self):
+        """Salva solo i link modificati, in un'unica scrittura"""
+        with registry.timer('persist'):
+            try:
+                self.history.flush()
+            except Exception as e:
+                logger.error(f"Errore nel salvataggio storico: {e}")
+            if not self.dirty_links and not self.checked_links:
+                return
+            try:
+                if self.dirty_links:
+                    self.store.save(self.monitored_links, self.dirty_links)
+                # Gli esiti dei controlli non fanno ricomparire link rimossi da un altro processo
+                checked = self.checked_links - self.dirty_links
+                removed = self.store.update_checks(self.monitored_links, checked) if checked else []
+                self.dirty_links = set()
+                self.checked_links = set()
+            except Exception as e:
+                logger.error(f"Errore nel salvataggio links: {e}")
+                return
+            for url in removed:
+                logger.info(f"Link rimosso da un altro processo: {url}")
+                self.forget_link(url)
+    
+    def close(self):
+        """Salva le modifiche in sospeso e chiude l'archivio"""
+        self.save_links()
+        self.store.close()
+        self.history.close()
+    
+    def new_link_data(self, url, name, product_info, chat_id=None):
+        """Dati iniziali di un link appena aggiunto"""
+        data = {
+            'name': name,
+            'url': url,
+            'last_check': None,
+            'last_status': None,
+            'last_price': None,
+            'in_stock': None,
+            'product_title': product_info.get('title', ''),
+            'added_date': datetime.now().isoformat()
+        }
+        # Lo stato letto durante l'aggiunta vale come primo controllo: senza,
+        # il primo controllo programmato lo scambierebbe per un cambiamento
+        if not product_info.get('error') and product_info.get('in_stock') is not None:
+            normalize_info(product_info, domain_of(url))
+            self.store_check_fields(data, product_info)
+        # Senza chat (runner) il link resta della chat predefinita
+        if chat_id is not None:
+            data['subscribers'] = [str(chat_id)]
+        return data
+    
+    def links_for(self, chat_id=None):
+        """Link seguiti da una chat (tutti se chat_id è None)"""
+        if chat_id is None:
+            return list(self.monitored_links)
+        return self.subscriptions.urls_for(chat_id)
+    
+    def subscribe_existing(self, url, chat_id):
+        """Iscrive la chat a un link già monitorato: (successo, messaggio)"""
+        data = self.monitored_links[url]
+        if chat_id is None or not self.subscriptions.subscribe(url, data, chat_id):
+            return False, f"⚠️ Già monitorato: {data['name']}\n🔗 {url}"
+        self.mark_dirty(url)
+        self.lists_changed(url, [chat_id])
+        return True, f"✅ Link aggiunto: {data['name']}\n🔗 {url}"
+    
+    def add_link(self, url, name=None, chat_id=None):
+        """Aggiunge un nuovo link da monitorare"""
+        try:
+            # Pulisci l'URL
+            url = normalize_url(url)
+            
+            # Link già monitorato per altre chat: basta l'iscrizione, niente download
+            if url in self.monitored_links:
+                success, message = self.subscribe_existing(url, chat_id)
+                self.save_links()
+                return success, message
+            
+            # Se non specificato un nome, usa il dominio
+            if not name:
+                name = domain_of(url)
+            
+            # Ottieni info iniziali del prodotto
+            product_info = self.get_product_info(url)
+            
+            self.monitored_links[url] = self.new_link_data(url, name, product_info, chat_id)
+            self.subscriptions.index_link(url, self.monitored_links[url])
+            self.link_ids.add(url)
+            self.lists_changed(url, self.subscriptions.subscribers(url))
+            
+            # Il primo controllo è subito
+            self.scheduler.schedule(url, 0)
+            self.mark_dirty(url)
+            self.save_links()
+            return True, f"✅ Link aggiunto: {name}\n🔗 {url}"
+            
+        except Exception as e:
+            logger.error(f"Errore nell'aggiunta del link: {e}")
+            return False, f"❌ Errore nell'aggiunta del link: {str(e)}"
+    
+    async def add_links_bulk(self, entries, progress=None, chat_id=None):
+        """Aggiunge più link insieme: [(url, nome o None)] -> [(successo, messaggio)]
+        
+        Gli URL vengono normalizzati e deduplicati prima di scaricare qualcosa;
+        le pagine sono scaricate in parallelo con i limiti per host e il
+        salvataggio avviene una sola volta alla fine. progress riceve
+        (successo, messaggio) per ogni link appena elaborato.
+        """
+        messages = {}
+        pending = {}
+        order = []
+        for url, name in entries:
+            try:
+                url = normalize_url(url)
+            except ValueError as e:
+                order.append(url)
+                messages[url] = (False, f"❌ Link non valido: {url} ({e})")
+                continue
+            if url in messages or url in pending:
+                continue
+            order.append(url)
+            if url in self.monitored_links:
+                messages[url] = self.subscribe_existing(url, chat_id)
+                continue
+            pending[url] = {'name': name or domain_of(url), 'url': url}
+        
+        if progress:
+            for url in order:
+                if url in messages:
+                    progress(*messages[url])
+        
+        def added(url, product_info):
+            data = pending[url]
+            self.monitored_links[url] = self.new_link_data(url, data['name'], product_info, chat_id)
+            self.subscriptions.index_link(url, self.monitored_links[url])
+            self.link_ids.add(url)
+            self.lists_changed(url, self.subscriptions.subscribers(url))
+            self.scheduler.schedule(url, 0)
+            self.mark_dirty(url)
+            messages[url] = (True, f"✅ Link aggiunto: {data['name']}\n🔗 {url}")
+            if progress:
+                progress(*messages[url])
+        
+        try:
+            if pending:
+                await CheckEngine(self).fetch_all(pending, added)
+        finally:
+            # Un solo salvataggio per tutti i link aggiunti (e le nuove iscrizioni)
+            self.save_links()
+        return [messages[url] for url in order if url in messages]
+    
+    def remove_link(self, url, chat_id=None):
+        """Rimuove un link dalla lista della chat (del tutto se nessun'altra lo segue)"""
+        if url not in self.monitored_links or (chat_id is not None and not self.subscriptions.is_subscribed(url, chat_id)):
+            return False, "❌ Link non trovato nella lista"
+        
+        data = self.monitored_links[url]
+        if chat_id is not None and self.subscriptions.unsubscribe(url, data, chat_id):
+            # Altre chat seguono ancora il link: si toglie solo l'iscrizione
+            self.mark_dirty(url)
+            self.lists_changed(url, [chat_id])
+            self.save_links()
+            return True, f"✅ Link rimosso: {data['name']}"
+        
+        self.forget_link(url)
+        self.store.delete([url])
+        return True, f"✅ Link rimosso: {data['name']}"
+    
+    def forget_link(self, url):
+        """Toglie il link dalla memoria (liste, indici e salvataggi in sospeso)"""
+        self.lists_changed(url, self.subscriptions.subscribers(url))
+        del self.monitored_links[url]
+        self.subscriptions.remove_url(url)
+        self.link_ids.remove(url)
+        self.dirty_links.discard(url)
+        self.checked_links.discard(url)
+    
+    def remove_all_links(self, chat_id=None):
+        """Rimuove tutti i link (o tutti quelli della chat)"""
+        if chat_id is not None:
+            urls = self.links_for(chat_id)
+            for url in urls:
+                data = self.monitored_links[url]
+                if self.subscriptions.unsubscribe(url, data, chat_id):
+                    self.mark_dirty(url)
+                else:
+                    self.forget_link(url)
+                self.lists_changed(url, [chat_id])
+            self.store.delete([url for url in urls if url not in self.monitored_links])
+            self.save_links()
+            return f"✅ Rimossi tutti i {len(urls)} link dalla lista"
+        
+        count = len(self.monitored_links)
+        self.monitored_links = {}
+        self.dirty_links = set()
+        self.checked_links = set()
+        self.store.clear()
+        self.scheduler.rebuild()
+        self.subscriptions.rebuild(self.monitored_links)
+        self.link_ids.rebuild(self.monitored_links)
+        self.menu_cache.clear()
+        return f"✅ Rimossi tutti i {count} link dalla lista"
+    
+    def request_headers(self):
+        """Header HTTP usati per scaricare le pagine dei prodotti"""
+        return {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Language': 'it-IT,it;q=0.8,en-US;q=0.5,en;q=0.3',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1'
+        }
+    
+    def get_product_info(self, url):
+        """Ottiene informazioni sul prodotto"""
+        try:
+            client = get_pool().client(url)
+            max_bytes = page_limit(get_domain_config(domain_of(url)))
+            with client.stream('GET', url, headers=self.request_headers()) as response:
+                response.raise_for_status()
+                # Solo euristiche HTML: fermarsi dopo un JSON-LD non servirebbe
+                body, truncated, _ = read_body(response, max_bytes, detect=FORM_BLOCKS)
+                if truncated:
+                    logger.warning(f"Pagina troncata a {max_bytes} byte: {url}")
+                page_text = decode_body(body, response)
+            
+            return self.parse_product_page(page_text, response.status_code, url)
+            
+        except Exception as e:
+            logger.error(f"Errore nel controllo prodotto {url}: {e}")
+            return self.error_info(e)
+    
+    def parse_product_page(self, page_text, status_code, url=None):
+        """Estrae titolo, prezzo e disponibilità dalla pagina scaricata"""
+        page = parse_page(page_text)
+        
+        # Cerca il titolo del prodotto
+        title = page.title()
+        
+        if not title:
+            title = page.title_tag() or 'Prodotto sconosciuto'
+        
+        # Cerca il prezzo (attuale e, se la pagina mostra uno sconto, pieno)
+        domain = domain_of(url) if url else None
+        price, regular_price = self.extract_price(page, domain)
+        
+        # Determina se è disponibile
+        in_stock = self.check_availability(page, page_text, domain)
+        
+        product_info = {
+            'title': title[:100],  # Limita la lunghezza
+            'price': price.text if price else None,
+            'in_stock': in_stock,
+            'status_code': status_code
+        }
+        product_info.update(price_fields(price, regular_price))
+        if regular_price:
+            product_info['regular_price'] = regular_price.text
+        return product_info
+    
+    def error_info(self, error):
+        """Risultato di un controllo fallito"""
+        response = getattr(error, 'response', None)
+        return {
+            'title': 'Errore nel controllo',
+            'price': None,
+            'in_stock': None,
+            'status_code': getattr(response, 'status_code', None),
+            'error': str(error)
+        }
+    
+    def extract_price(self, page, domain=None):
+        """Estrae dalla pagina (prezzo attuale, prezzo pieno) come pricing.Price"""
+        text, struck_text = page.price_texts()
+        return pick_price(label_prices(text, domain, struck_text))
+    
+    def check_availability(self, page, page_text, domain=None):
+        """Controlla se il prodotto è disponibile (parole chiave per lingua/dominio)"""
+        with registry.timer('match', domain or ''):
+            return get_matcher(domain).is_available(page_text)
+    
+    def apply_check_result(self, url, data, product_info):
+        """Aggiorna i dati del link e calcola i cambiamenti rispetto al controllo precedente"""
+        self.mark_checked(url)
+        normalize_info(product_info, domain_of(url))
+        self.fill_currency(data, product_info)
+        self.history.append(url, record_from_info(product_info))
+        old_status = data.get('in_stock')
+        old_price = data.get('last_price')
+        old_amount = self.stored_price(url, data)
+        self.store_check_fields(data, product_info)
+        
+        # Determina se ci sono cambiamenti
+        status_changed = old_status is not None and old_status != product_info['in_stock']
+        price_changed = self.is_price_change(url, old_price, old_amount, product_info)
+        
+        # Prossimo controllo in base all'esito
+        self.scheduler.update(url, data, product_info, status_changed, price_changed)
+        
+        return {
+            'name': data['name'],
+            'url': url,
+            'title': product_info['title'],
+            'in_stock': product_info['in_stock'],
+            'price': product_info['price'],
+            'status_changed': status_changed,
+            'price_changed': price_changed,
+            'old_price': old_price,
+            'price_minor': product_info['price_minor'],
+            'old_price_minor': old_amount[0] if old_amount else None,
+            'currency': product_info['currency'],
+            'regular_price': product_info.get('regular_price'),
+            'variants': product_info.get('variants'),
+            'error': product_info.get('error')
+        }
+    
+    def store_check_fields(self, data, product_info):
+        """Copia nei dati del link stato, prezzo, piattaforma e validatori di un controllo"""
+        data['last_check'] = datetime.now().isoformat()
+        data['last_status'] = 'available' if product_info['in_stock'] else 'unavailable'
+        data['last_price'] = product_info['price']
+        data['last_price_minor'] = product_info['price_minor']
+        data['currency'] = product_info['currency']
+        data['in_stock'] = product_info['in_stock']
+        
+        # Validatori per la GET condizionale del prossimo controllo
+        if 'validators' in product_info:
+            data.update(product_info['validators'])
+        if product_info.get('platform'):
+            data['platform'] = product_info['platform']
+        if 'state_recipe' in product_info:
+            if product_info['state_recipe']:
+                data['state_recipe'] = product_info['state_recipe']
+            else:
+                data.pop('state_recipe', None)
+        if product_info.get('variants'):
+            data['variants'] = product_info['variants']
+    
+    def fill_currency(self, data, product_info):
+        """Valuta salvata del link per un prezzo letto senza (es. /products/<handle>.js di Shopify)"""
+        currency = data.get('currency')
+        if product_info.get('currency') or not currency:
+            return
+        price = parse_price(product_info.get('price'))
+        if price is None or price.currency:
+            return
+        price = Price(price.amount, currency, price.text)
+        product_info['price'] = format_price(price.amount, currency)
+        product_info.update(price_fields(price))
+    
+    def stored_price(self, url, data):
+        """(importo in unità minime, valuta) dell'ultimo prezzo salvato, None se assente"""
+        if data.get('last_price_minor') is not None:
+            return data['last_price_minor'], data.get('currency')
+        # Link salvati prima della normalizzazione: solo il testo del prezzo
+        price = parse_price(data.get('last_price'), domain_of(url))
+        return (price.minor, price.currency) if price else None
+    
+    def is_price_change(self, url, old_price, old_amount, product_info):
+        """Cambiamento di prezzo da segnalare
+        
+        Il confronto è numerico, quindi la sola formattazione diversa non conta;
+        le variazioni sotto 'price_change_threshold' (percentuale, per dominio)
+        vengono ignorate.
+        """
+        if old_price is None:
+            return False
+        new_minor = product_info.get('price_minor')
+        if old_amount is None or new_minor is None:
+            return old_price != product_info['price']
+        old_minor, old_currency = old_amount
+        new_currency = product_info.get('currency')
+        # Una valuta assente è sconosciuta, non diversa: si confrontano gli importi
+        if old_currency and new_currency and old_currency != new_currency:
+            return True
+        if old_minor == new_minor:
+            return False
+        threshold = float(get_domain_config(domain_of(url)).get('price_change_threshold') or 0)
+        change = price_change_percent(old_minor, new_minor)
+        return change is None or abs(change) >= threshold
+    
+    def history_summary(self, url, days=None):
+        """Riepilogo dello storico di un link (ultimi days giorni, o tutto)"""
+        since = time.time() - days * 86400 if days else None
+        return self.history.summary(url, since)
+    
+    async def history_summaries(self, urls, days=None):
+        """Riepiloghi dello storico dei link indicati, calcolati in un thread per non bloccare il loop"""
+        # I record in sospeso vengono scritti qui, nel thread del loop che li aggiunge
+        self.history.flush()
+        since = time.time() - days * 86400 if days else None
+        return await asyncio.to_thread(
+            lambda: {url: self.history.summary(url, since, flush=False) for url in urls}
+        )
+    
+    async def check_all_products_async(self, urls=None, progress=None):
+        """Controlla tutti i prodotti monitorati (o solo quelli indicati) in parallelo
+        
+        Ogni URL viene scaricato una sola volta anche se più controlli lo
+        richiedono insieme: chi lo trova già in controllo ne attende il risultato.
+        """
+        urls = list(self.monitored_links) if urls is None else [url for url in urls if url in self.monitored_links]
+        loop = asyncio.get_running_loop()
+        own = [url for url in urls if url not in self.in_progress]
+        for url in own:
+            self.in_progress[url] = loop.create_future()
+        futures = [self.in_progress[url] for url in urls]
+        
+        if progress:
+            for future in futures:
+                future.add_done_callback(lambda f: progress(f.result()) if not f.cancelled() else None)
+        
+        def completed(result):
+            future = self.in_progress.get(result['url'])
+            if future is not None and not future.done():
+                future.set_result(result)
+        
+        try:
+            await CheckEngine(self).run(own, completed)
+        finally:
+            for url in own:
+                future = self.in_progress.pop(url)
+                if not future.done():
+                    future.cancel()
+            # Una sola scrittura per controllo, con le sole righe aggiornate
+            self.save_links()
+        
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        return [result for result in results if isinstance(result, dict)]
+    
+    def sweep_running(self, chat_id=None):
+        sweep = self.active_sweeps.get(chat_id)
+        return sweep is not None and not sweep.task.done()
+    
+    async def check_all_products_shared(self, progress=None, chat_id=None):
+        """Controllo completo dei link della chat; se ce n'è già uno in corso si aggancia a quello"""
+        if not self.sweep_running(chat_id):
+            urls = self.links_for(chat_id)
+            self.active_sweeps[chat_id] = SharedSweep(lambda notify: self.check_all_products_async(urls, notify))
+        sweep = self.active_sweeps[chat_id]
+        if progress:
+            sweep.subscribe(progress)
+        return await sweep.wait()
+    
+    def due_links(self, limit=None):
+        """Link da controllare ora secondo la pianificazione adattiva"""
+        return self.scheduler.due(limit=limit)
+    
+    async def _check_all_products_once(self, urls=None):
+        try:
+            return await self.check_all_products_async(urls)
+        finally:
+            # Il loop di asyncio.run viene chiuso: chiudiamo anche le sue connessioni
+            await get_pool().aclose()
+    
+    def check_all_products(self, urls=None):
+        """Controlla tutti i prodotti monitorati (o solo quelli indicati)"""
+        return asyncio.run(self._check_all_products_once(urls))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Limitatore di richieste per dominio
+Ogni host ha il suo token bucket e un numero massimo di richieste in corso,
+così i negozi diversi vengono controllati in parallelo senza farsi bloccare.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+from domain_config import domain_of, get_domain_config
+
+
+class TokenBucket:
+    """Token bucket asincrono: `rate` token al secondo, al massimo `burst` accumulati"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = None
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self.updated is not None:
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Attende finché è disponibile un token e lo consuma"""
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                self._refill(loop.time())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                if self.rate <= 0:
+                    raise ValueError("Il rate del token bucket deve essere positivo")
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostLimiter:
+    """Limiti di un singolo host"""
+
+    def __init__(self, domain, config):
+        self.domain = domain
+        self.bucket = TokenBucket(config['rate'], config['burst'])
+        self.in_flight = asyncio.Semaphore(max(1, int(config['max_in_flight'])))
+
+
+class DomainRateLimiter:
+    """Raggruppa le richieste per host e applica i limiti di ciascuno"""
+
+    def __init__(self, config_getter=get_domain_config):
+        self.config_getter = config_getter
+        self.hosts = {}
+
+    def host(self, url):
+        """Restituisce (creandolo se serve) il limitatore dell'host di un URL"""
+        domain = domain_of(url)
+        limiter = self.hosts.get(domain)
+        if limiter is None:
+            limiter = HostLimiter(domain, self.config_getter(domain))
+            self.hosts[domain] = limiter
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, url):
+        """Occupa uno slot dell'host per la durata della richiesta"""
+        limiter = self.host(url)
+        async with limiter.in_flight:
+            await limiter.bucket.acquire()
+            yield
+
+
+def group_by_domain(urls):
+    """Raggruppa gli URL per dominio mantenendo l'ordine"""
+    groups = {}
+    for url in urls:
+        groups.setdefault(domain_of(url), []).append(url)
+    return groups
+
+
+def interleave_by_domain(urls):
+    """Ordina gli URL alternando i domini (round-robin)
+
+    Così i primi slot globali vengono dati a host diversi invece di
+    esaurirsi tutti sullo stesso negozio.
+    """
+    groups = list(group_by_domain(urls).values())
+    ordered = []
+    for i in range(max((len(g) for g in groups), default=0)):
+        for group in groups:
+            if i < len(group):
+                ordered.append(group[i])
+    return ordered
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Pianificazione adattiva dei controlli
+Ogni link ha il suo prossimo controllo ('next_due' nei dati del link) e una
+coda a priorità restituisce solo i link scaduti. L'intervallo si accorcia
+dopo un cambiamento e nelle fasce orarie in cui il prodotto è già tornato
+disponibile in passato, si allunga per le pagine stabili e raddoppia a ogni
+errore consecutivo (fino a un giorno per le pagine che non esistono più).
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+from datetime import datetime
+
+from domain_config import domain_of, get_domain_config
+
+logger = logging.getLogger(__name__)
+
+# Intervalli in secondi
+BASE_INTERVAL = int(os.environ.get('SCHEDULER_BASE_INTERVAL', '900'))
+MIN_INTERVAL = int(os.environ.get('SCHEDULER_MIN_INTERVAL', '120'))
+MAX_INTERVAL = int(os.environ.get('SCHEDULER_MAX_INTERVAL', str(6 * 3600)))
+DEAD_INTERVAL = 24 * 3600
+
+# Crescita dell'intervallo a ogni controllo senza cambiamenti
+STABLE_GROWTH = 1.5
+
+# Codici HTTP di pagine che difficilmente torneranno
+DEAD_STATUS_CODES = {404, 410}
+
+# Margine attorno all'ora di un restock passato e numero massimo di fasce seguite
+WINDOW_MARGIN = 30 * 60
+MAX_WINDOWS = 6
+
+WEEK_HOURS = 7 * 24
+
+
+def slot_key(ts):
+    """Fascia 'giorno:ora' (ora locale) di un timestamp"""
+    moment = datetime.fromtimestamp(ts)
+    return f"{moment.weekday()}:{moment.hour}"
+
+
+def restock_window(slots, now):
+    """(siamo in una fascia di restock, inizio della prossima fascia)
+
+    Le fasce sono le ore della settimana in cui il prodotto è tornato
+    disponibile, allargate di WINDOW_MARGIN prima e dopo.
+    """
+    if not slots:
+        return False, None
+    moment = datetime.fromtimestamp(now)
+    week_hour = moment.weekday() * 24 + moment.hour
+    hour_start = now - moment.minute * 60 - moment.second
+
+    top = sorted(slots.items(), key=lambda item: item[1], reverse=True)[:MAX_WINDOWS]
+    next_start = None
+    for key, _ in top:
+        weekday, hour = (int(part) for part in key.split(':'))
+        ahead = (weekday * 24 + hour - week_hour) % WEEK_HOURS
+        start = hour_start + ahead * 3600 - WINDOW_MARGIN
+        # La fascia della settimana scorsa può essere ancora in corso
+        previous = start - WEEK_HOURS * 3600
+        for window_start in (previous, start):
+            if window_start <= now < window_start + 3600 + 2 * WINDOW_MARGIN:
+                return True, window_start
+        if next_start is None or start < next_start:
+            next_start = start
+    return False, next_start
+
+
+class Scheduler:
+    """Coda a priorità dei link ordinata per prossimo controllo"""
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.heap = []
+        self.rebuild()
+
+    def rebuild(self):
+        """Ricostruisce la coda dai dati dei link"""
+        self.heap = [(data.get('next_due', 0), url) for url, data in self.monitor.monitored_links.items()]
+        heapq.heapify(self.heap)
+
+    def schedule(self, url, due):
+        data = self.monitor.monitored_links[url]
+        data['next_due'] = due
+        heapq.heappush(self.heap, (due, url))
+
+    def _is_current(self, due, url):
+        # Le voci di link rimossi o ripianificati restano nella coda e vengono scartate qui
+        data = self.monitor.monitored_links.get(url)
+        return data is not None and data.get('next_due', 0) == due
+
+    def due(self, now=None, limit=None):
+        """Link da controllare ora, dal più in ritardo (al massimo limit)"""
+        now = time.time() if now is None else now
+        urls = []
+        seen = set()
+        while self.heap and self.heap[0][0] <= now and (limit is None or len(urls) < limit):
+            due, url = heapq.heappop(self.heap)
+            if self._is_current(due, url) and url not in seen:
+                seen.add(url)
+                urls.append(url)
+        # I link estratti tornano in coda alla stessa scadenza finché non vengono controllati
+        for url in urls:
+            heapq.heappush(self.heap, (self.monitor.monitored_links[url].get('next_due', 0), url))
+        return urls
+
+    def next_due(self):
+        """Timestamp del prossimo controllo previsto (None se non ci sono link)"""
+        while self.heap and not self._is_current(*self.heap[0]):
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def learn_windows(self, url, data):
+        """Ricava le fasce di restock dallo storico (solo la prima volta)
+
+        Restituisce True se le fasce sono state appena ricavate: in quel caso
+        includono già il controllo appena registrato nello storico.
+        """
+        if 'restock_slots' in data:
+            return False
+        data['restock_slots'] = self.restock_slots(url)
+        self.monitor.mark_checked(url)
+        return True
+
+    async def prepare_windows(self, url, data):
+        """Ricava le fasce di restock in un thread prima di registrare il controllo
+
+        Il riepilogo dello storico legge SQLite: nel daemon non deve bloccare il
+        loop. Le fasce così ricavate non includono il controllo in corso, che
+        update() conta poi come per i link che le avevano già.
+        """
+        if 'restock_slots' in data:
+            return
+        # I record in sospeso vengono scritti qui, nel thread del loop che li aggiunge
+        self.monitor.history.flush()
+        slots = await asyncio.to_thread(self.restock_slots, url, False)
+        if 'restock_slots' not in data:
+            data['restock_slots'] = slots
+            self.monitor.mark_checked(url)
+
+    def restock_slots(self, url, flush=True):
+        """Fasce di restock {'giorno:ora': restock} dallo storico di un link"""
+        summary = self.monitor.history.summary(url, flush=flush)
+        return {
+            f"{weekday}:{hour}": count for (weekday, hour), count in summary['restock_slots'].items()
+        }
+
+    def next_interval(self, url, data, product_info, changed):
+        """Intervallo fino al prossimo controllo, in base all'esito di quello appena fatto"""
+        config = get_domain_config(domain_of(url))
+        base = int(config.get('check_interval') or BASE_INTERVAL)
+
+        if product_info.get('error'):
+            data['error_streak'] = data.get('error_streak', 0) + 1
+            ceiling = DEAD_INTERVAL if product_info.get('status_code') in DEAD_STATUS_CODES else MAX_INTERVAL
+            return min(base * 2 ** data['error_streak'], ceiling)
+
+        data['error_streak'] = 0
+        if changed:
+            return MIN_INTERVAL
+        previous = data.get('check_interval') or base
+        return min(max(previous, MIN_INTERVAL) * STABLE_GROWTH, MAX_INTERVAL)
+
+    def update(self, url, data, product_info, status_changed=False, price_changed=False, now=None):
+        """Ripianifica un link dopo un controllo"""
+        now = time.time() if now is None else now
+        learned = self.learn_windows(url, data)
+        if status_changed and product_info.get('in_stock') and not learned:
+            key = slot_key(now)
+            data['restock_slots'][key] = data['restock_slots'].get(key, 0) + 1
+
+        interval = self.next_interval(url, data, product_info, status_changed or price_changed)
+        data['check_interval'] = int(interval)
+        due = now + interval
+
+        if not product_info.get('error'):
+            # Nelle fasce di restock si controlla spesso, e non si salta l'inizio della prossima
+            in_window, window_start = restock_window(data['restock_slots'], now)
+            if in_window:
+                due = min(due, now + MIN_INTERVAL)
+            elif window_start is not None:
+                due = min(due, window_start)
+
+        self.schedule(url, int(due))
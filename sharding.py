@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Esecuzione dei controlli divisa in shard
+I link vengono assegnati agli shard con un hash consistente sul dominio,
+così ogni negozio è controllato da un solo processo e i limiti per host
+restano validi. Ogni shard scrive il proprio file di stato (link
+aggiornati, nuovi record di storico e risultati) senza toccare il
+database; il passo di unione li applica al database e invia una sola
+volta le notifiche. Gli shard possono girare in un pool di processi locale
+o come job paralleli di GitHub Actions.
+"""
+
+import os
+import json
+import glob
+import time
+import bisect
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from domain_config import domain_of
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Cartella dei file di stato degli shard
+SHARD_DIR = os.environ.get('SHARD_DIR', 'shards')
+
+# Punti di ogni shard sull'anello: più punti, distribuzione più uniforme
+VIRTUAL_NODES = 64
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Anello di hash consistente: cambiando il numero di shard si sposta solo una parte dei domini"""
+
+    def __init__(self, shards, replicas=VIRTUAL_NODES):
+        self.shards = shards
+        points = sorted(
+            (ring_hash(f"shard-{shard}-{replica}"), shard)
+            for shard in range(shards) for replica in range(replicas)
+        )
+        self.keys = [key for key, _ in points]
+        self.owners = [shard for _, shard in points]
+
+    def shard_of(self, domain):
+        index = bisect.bisect(self.keys, ring_hash(domain)) % len(self.keys)
+        return self.owners[index]
+
+
+def shard_urls(urls, shard, shards):
+    """URL assegnati allo shard (tutti i link di un dominio finiscono nello stesso shard)"""
+    ring = HashRing(shards)
+    return [url for url in urls if ring.shard_of(domain_of(url)) == shard]
+
+
+def parse_shard(value):
+    """'2/4' -> (2, 4), con lo shard contato da 0"""
+    shard, shards = (int(part) for part in value.split('/'))
+    if not 0 <= shard < shards:
+        raise ValueError(f"Shard non valido: {value}")
+    return shard, shards
+
+
+def shard_path(shard, shards, output_dir=SHARD_DIR):
+    return os.path.join(output_dir, f"shard-{shard}-of-{shards}.json")
+
+
+class ShardStore:
+    """Archivio dei link in sola lettura: le modifiche finiscono nel file dello shard"""
+
+    def __init__(self, store):
+        self.store = store
+        self.saved = {}
+
+    def save(self, links, urls=None):
+        for url in (links if urls is None else urls):
+            if url in links:
+                self.saved[url] = links[url]
+
+    def update_checks(self, links, urls):
+        self.save(links, urls)
+        return []
+
+    def delete(self, urls):
+        raise RuntimeError("Gli shard non possono rimuovere link")
+
+    def clear(self):
+        raise RuntimeError("Gli shard non possono rimuovere link")
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+class ShardHistory:
+    """Storico in lettura dal database, con i nuovi record tenuti da parte per l'unione"""
+
+    def __init__(self, history):
+        self.history = history
+        self.pending = {}
+
+    def append(self, url, record):
+        self.pending.setdefault(url, []).append(list(record))
+
+    def flush(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.history, name)
+
+
+def run_shard(shard, shards, check_all=False, limit=None, output_dir=SHARD_DIR):
+    """Controlla i link dello shard e ne scrive il file di stato; restituisce il percorso"""
+    from history import HistoryStore
+    from product_monitor import ProductMonitor
+    from storage import open_store
+
+    store = ShardStore(open_store())
+    history = ShardHistory(HistoryStore())
+    monitor = ProductMonitor(store, history)
+    try:
+        due = list(monitor.monitored_links) if check_all else monitor.due_links()
+        urls = shard_urls(due, shard, shards)[:limit]
+        logger.info(f"Shard {shard}/{shards}: {len(urls)} link da controllare")
+        results = monitor.check_all_products(urls) if urls else []
+        monitor.save_links()
+
+        os.makedirs(output_dir, exist_ok=True)
+        path = shard_path(shard, shards, output_dir)
+        state = {
+            'shard': shard,
+            'shards': shards,
+            'finished_at': time.time(),
+            'links': store.saved,
+            'history': history.pending,
+            'results': results,
+            'metrics': registry.summary(),
+        }
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+        return path
+    finally:
+        monitor.close()
+
+
+def load_shard_files(paths):
+    """Stati degli shard; per un link presente in più file vale il controllo più recente"""
+    links = {}
+    history = {}
+    results = {}
+    for path in sorted(paths):
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        for url, data in state['links'].items():
+            previous = links.get(url)
+            if previous is None or (data.get('last_check') or '') >= (previous.get('last_check') or ''):
+                links[url] = data
+        for url, records in state['history'].items():
+            history.setdefault(url, []).extend(records)
+        for result in state['results']:
+            results[result['url']] = result
+    return links, history, list(results.values())
+
+
+def merge_shards(monitor, paths):
+    """Applica al monitor i file degli shard; restituisce i risultati di tutti gli shard"""
+    from history import CheckRecord
+
+    links, history, results = load_shard_files(paths)
+    for url, data in links.items():
+        current = monitor.monitored_links.get(url)
+        if current is None:
+            # Link rimosso mentre lo shard era in esecuzione
+            continue
+        # Le iscrizioni restano quelle attuali: gli shard non le modificano
+        subscribers = current.get('subscribers')
+        current.clear()
+        current.update(data)
+        if subscribers is not None:
+            current['subscribers'] = subscribers
+        monitor.mark_checked(url)
+
+    for url, records in history.items():
+        if url in monitor.monitored_links:
+            for record in sorted(records, key=lambda record: record[0]):
+                monitor.history.append(url, CheckRecord(*record))
+
+    monitor.scheduler.rebuild()
+    monitor.save_links()
+    logger.info(f"Uniti {len(paths)} shard: {len(links)} link aggiornati, {len(results)} risultati")
+    return [result for result in results if result['url'] in monitor.monitored_links]
+
+
+def shard_metrics(paths):
+    """Riepiloghi delle metriche scritti dagli shard, uno per file"""
+    summaries = []
+    for path in sorted(paths):
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('metrics'):
+            summaries.append({'shard': state['shard'], **state['metrics']})
+    return summaries
+
+
+def shard_files(output_dir=SHARD_DIR):
+    return glob.glob(os.path.join(output_dir, 'shard-*-of-*.json'))
+
+
+def run_local(shards, check_all=False, limit=None, output_dir=SHARD_DIR):
+    """Esegue tutti gli shard in un pool di processi locale; restituisce i file scritti"""
+    for path in shard_files(output_dir):
+        os.remove(path)
+    # spawn: ogni processo apre le proprie connessioni SQLite e HTTP
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=shards, mp_context=context) as pool:
+        futures = [
+            pool.submit(run_shard, shard, shards, check_all, limit, output_dir)
+            for shard in range(shards)
+        ]
+        paths = []
+        for shard, future in enumerate(futures):
+            try:
+                paths.append(future.result())
+            except Exception as e:
+                logger.error(f"Shard {shard}/{shards} non riuscito: {e}")
+    return paths
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Archiviazione dei link monitorati
+Backend SQLite (predefinito, in modalità WAL) con scritture incrementali
+per riga, oppure il vecchio file JSON.
+
+Importazione manuale di un file JSON esistente:
+    python storage.py import monitored_links.json
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+from domain_config import domain_of
+
+logger = logging.getLogger(__name__)
+
+# Backend: 'sqlite' oppure 'json'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'sqlite')
+
+# File JSON storico (e sorgente dell'importazione iniziale)
+LINKS_FILE = 'monitored_links.json'
+
+# Database SQLite
+LINKS_DB = os.environ.get('LINKS_DB', 'monitored_links.db')
+
+# Campi del link gestiti dal bot (nome, iscrizioni): i controlli non li scrivono
+LINK_FIELDS = ('name', 'url', 'subscribers', 'added_date', 'product_title')
+
+
+def merge_check_fields(current, checked):
+    """Dati salvati con i campi del controllo presi da checked e quelli del link da current"""
+    merged = {key: value for key, value in checked.items() if key not in LINK_FIELDS}
+    merged.update({key: current[key] for key in LINK_FIELDS if key in current})
+    return merged
+
+
+class LinkStore:
+    """Interfaccia comune dei backend"""
+
+    def load_all(self):
+        """Tutti i link, nell'ordine di inserimento"""
+        raise NotImplementedError
+
+    def save(self, links, urls=None):
+        """Salva i link indicati (tutti se urls è None)"""
+        raise NotImplementedError
+
+    def update_checks(self, links, urls):
+        """Salva l'esito dei controlli dei link indicati
+
+        Aggiorna solo i link ancora presenti e solo i campi del controllo:
+        un link rimosso o un'iscrizione cambiata nel frattempo da un altro
+        processo restano come sono. Restituisce gli URL non più presenti.
+        """
+        raise NotImplementedError
+
+    def delete(self, urls):
+        """Rimuove i link indicati"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Rimuove tutti i link"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonLinkStore(LinkStore):
+    """Un unico file JSON riscritto a ogni salvataggio (comportamento storico)"""
+
+    def __init__(self, path=LINKS_FILE):
+        self.path = path
+        self._links = {}
+
+    def load_all(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._links = json.load(f)
+            except Exception as e:
+                logger.error(f"Errore nel caricamento links: {e}")
+                self._links = {}
+        return dict(self._links)
+
+    def _write(self):
+        # Scrittura atomica: chi legge non vede mai un file a metà
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._links, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def save(self, links, urls=None):
+        self._links = links
+        self._write()
+
+    def update_checks(self, links, urls):
+        # Un solo processo scrive il file: basta il salvataggio normale
+        self.save(links, urls)
+        return []
+
+    def delete(self, urls):
+        for url in urls:
+            self._links.pop(url, None)
+        self._write()
+
+    def clear(self):
+        self._links = {}
+        self._write()
+
+
+class SqliteLinkStore(LinkStore):
+    """SQLite in modalità WAL: una riga per link, indicizzata per URL e dominio
+
+    Più processi (bot e runner) possono leggere e scrivere insieme: ognuno
+    aggiorna solo le righe che ha modificato, in un'unica transazione, e gli
+    esiti dei controlli (update_checks) non toccano nome e iscrizioni.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS links (
+            url TEXT PRIMARY KEY,
+            domain TEXT NOT NULL,
+            data TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS links_domain ON links (domain);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path=LINKS_DB, import_from=LINKS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+        # Importazione automatica una sola volta: dopo aver svuotato la lista
+        # il vecchio file JSON non deve far ricomparire i link
+        if import_from and not self.get_meta('json_imported'):
+            if self.count() == 0 and os.path.exists(import_from):
+                self.import_json(import_from)
+            self.set_meta('json_imported', datetime.now().isoformat())
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                (key, value)
+            )
+
+    def count(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM links').fetchone()[0]
+
+    def import_json(self, path):
+        """Importa i link da un file JSON (una sola transazione)"""
+        links = JsonLinkStore(path).load_all()
+        if links:
+            self.save(links)
+            logger.info(f"Importati {len(links)} link da {path}")
+        return len(links)
+
+    def load_all(self):
+        with self._lock:
+            rows = self.conn.execute('SELECT url, data FROM links ORDER BY rowid').fetchall()
+        return {url: json.loads(data) for url, data in rows}
+
+    def load_domain(self, domain):
+        """Link di un solo dominio (usa l'indice per dominio)"""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT url, data FROM links WHERE domain = ? ORDER BY rowid', (domain,)
+            ).fetchall()
+        return {url: json.loads(data) for url, data in rows}
+
+    def save(self, links, urls=None):
+        urls = list(links) if urls is None else [url for url in urls if url in links]
+        if not urls:
+            return
+        now = datetime.now().isoformat()
+        rows = [
+            (url, domain_of(url), json.dumps(links[url], ensure_ascii=False), now)
+            for url in urls
+        ]
+        with self._lock, self.conn:
+            # ON CONFLICT mantiene il rowid, quindi anche l'ordine di inserimento
+            self.conn.executemany(
+                """INSERT INTO links (url, domain, data, updated_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(url) DO UPDATE SET
+                       domain = excluded.domain, data = excluded.data, updated_at = excluded.updated_at""",
+                rows
+            )
+
+    def update_checks(self, links, urls):
+        urls = [url for url in urls if url in links]
+        if not urls:
+            return []
+        now = datetime.now().isoformat()
+        with self._lock:
+            # BEGIN IMMEDIATE: nessun altro processo scrive tra la lettura e l'aggiornamento
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                current = {}
+                for start in range(0, len(urls), 500):
+                    batch = urls[start:start + 500]
+                    current.update(self.conn.execute(
+                        f"SELECT url, data FROM links WHERE url IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall())
+                self.conn.executemany(
+                    'UPDATE links SET data = ?, updated_at = ? WHERE url = ?',
+                    [
+                        (json.dumps(merge_check_fields(json.loads(current[url]), links[url]), ensure_ascii=False), now, url)
+                        for url in urls if url in current
+                    ]
+                )
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        return [url for url in urls if url not in current]
+
+    def delete(self, urls):
+        with self._lock, self.conn:
+            self.conn.executemany('DELETE FROM links WHERE url = ?', [(url,) for url in urls])
+
+    def clear(self):
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM links')
+
+    def close(self):
+        """Chiude il database riportando il WAL nel file principale"""
+        with self._lock:
+            try:
+                self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error as e:
+                logger.warning(f"Checkpoint WAL non riuscito: {e}")
+            self.conn.close()
+
+
+def open_store(backend=None):
+    """Apre il backend configurato (STORAGE_BACKEND)"""
+    backend = backend or STORAGE_BACKEND
+    if backend == 'json':
+        return JsonLinkStore()
+    if backend == 'sqlite':
+        return SqliteLinkStore()
+    raise ValueError(f"Backend di archiviazione sconosciuto: {backend}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 3 or sys.argv[1] != 'import':
+        print(f"Uso: python {sys.argv[0]} import <file.json>")
+        sys.exit(1)
+    store = SqliteLinkStore(import_from=None)
+    count = store.import_json(sys.argv[2])
+    store.close()
+    print(f"✅ Importati {count} link in {LINKS_DB}")
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Download delle pagine a blocchi con limite di dimensione
+La lettura si interrompe appena è passato il blocco che contiene
+disponibilità e prezzo (form del carrello dopo il titolo o il prezzo del
+prodotto, oppure un JSON-LD che contiene davvero un'offerta); senza segnale
+si legge tutta la pagina.
+"""
+
+import os
+import re
+from collections import namedtuple
+
+# Dimensione massima scaricata per ogni pagina
+MAX_PAGE_BYTES = int(os.environ.get('MAX_PAGE_BYTES', str(4 * 1024 * 1024)))
+
+# Dimensione dei blocchi letti dalla rete
+CHUNK_SIZE = 64 * 1024
+
+# Byte dell'apertura di un <form> esaminati per trovare l'attributo action
+MAX_TAG_BYTES = 4096
+
+# Byte di un blocco conservati per verificarlo (oltre si legge tutta la pagina)
+MAX_BLOCK_BYTES = 512 * 1024
+
+# Nodi di titolo o prezzo del prodotto: un form del carrello chiude la
+# lettura solo se prima ne è comparso almeno uno
+PRODUCT_MARKERS = (
+    b'<h1', b'itemprop="price"', b'itemprop="name"', b'product-title', b'product-name',
+    b'product-price', b'product__title', b'product__price', b'class="price',
+)
+
+ACTION_RE = re.compile(rb'\baction\s*=\s*["\']?([^"\'\s>]*)')
+
+
+class SignalBlock(namedtuple('SignalBlock', 'opening closing required action markers validate structured')):
+    """Blocco che, una volta completo, contiene già i segnali che ci servono
+
+    opening e closing delimitano il blocco, required deve comparire al suo
+    interno; con action l'apertura deve essere un tag con un attributo
+    action che contiene il testo indicato (b'' per qualsiasi action); con
+    markers il blocco conta solo dopo un nodo di PRODUCT_MARKERS; validate,
+    se indicato, riceve i byte originali del blocco (dopo l'apertura) e
+    decide se basta. structured indica che il blocco porta dati strutturati:
+    se non si riescono a estrarre dalla pagina tagliata, va letta per intero.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, opening, closing, required=None, action=None, markers=False, validate=None, structured=False):
+        return super().__new__(cls, opening, closing, required, action, markers, validate, structured)
+
+
+def jsonld_offer(content):
+    """True se il blocco JSON-LD contiene un prodotto con almeno un'offerta"""
+    from extractors import JsonLdExtractor
+    text = content.decode('utf-8', errors='replace')
+    # Il blocco comincia dentro il tag <script>: il JSON segue il primo '>'
+    return JsonLdExtractor().extract_block(text.split('>', 1)[-1]) is not None
+
+
+JSONLD_BLOCK = SignalBlock(b'application/ld+json', b'</script', b'availability',
+                           validate=jsonld_offer, structured=True)
+
+# Form del carrello: bastano alle euristiche HTML
+FORM_BLOCKS = (
+    SignalBlock(b'<form', b'</form', action=b'/cart/add', markers=True),                        # Shopify
+    SignalBlock(b'<form', b'</form', b'name="add-to-cart"', action=b'', markers=True),          # WooCommerce
+)
+
+SIGNAL_BLOCKS = (JSONLD_BLOCK,) + FORM_BLOCKS
+
+# Stati della ricerca di un blocco
+SEARCH, TAG, BODY, CLOSE = range(4)
+
+
+class SignalDetector:
+    """Riconosce, mentre la pagina arriva, la fine del primo blocco utile
+
+    Tiene in memoria solo la coda del blocco precedente, quanto basta per i
+    testi a cavallo tra due blocchi (più il contenuto dei blocchi da
+    verificare): le posizioni sono assolute, dall'inizio del corpo. signal
+    è il blocco che ha chiuso la lettura.
+    """
+
+    def __init__(self, blocks=SIGNAL_BLOCKS):
+        self.blocks = [block if isinstance(block, SignalBlock) else SignalBlock(*block) for block in blocks]
+        patterns = list(PRODUCT_MARKERS)
+        for block in self.blocks:
+            patterns += [block.opening, block.closing, block.required or b'']
+        self.overlap = max(len(pattern) for pattern in patterns) - 1
+        self.tail = b''
+        self.raw_tail = b''
+        self.signal = None
+        self.total = 0
+        self.marker_at = None
+        self.marker_from = 0
+        self.states = [self._reset(0) for _ in self.blocks]
+
+    @staticmethod
+    def _reset(position):
+        return {'state': SEARCH, 'pos': position, 'found': False, 'tag': bytearray(),
+                'content': None, 'copied': position}
+
+    def feed(self, chunk):
+        """Aggiunge un blocco di byte; restituisce l'offset di fine del segnale o None"""
+        raw = self.raw_tail + chunk
+        text = raw.lower()
+        base = self.total + len(chunk) - len(text)
+        self.total += len(chunk)
+        self.tail = text[-self.overlap:] if self.overlap else b''
+        self.raw_tail = raw[-self.overlap:] if self.overlap else b''
+
+        if self.marker_at is None:
+            self._scan_markers(text, base)
+        # Con più blocchi completi nello stesso pezzo vale quello che finisce prima
+        ends = [(self._scan(block, state, text, raw, base), block) for block, state in zip(self.blocks, self.states)]
+        ends = [(end, block) for end, block in ends if end is not None]
+        if not ends:
+            return None
+        end, self.signal = min(ends, key=lambda item: item[0])
+        return end
+
+    def _scan_markers(self, text, base):
+        start = max(self.marker_from - base, 0)
+        found = [text.find(marker, start) for marker in PRODUCT_MARKERS]
+        found = [index for index in found if index != -1]
+        if found:
+            self.marker_at = base + min(found)
+        self.marker_from = max(base + len(text) - self.overlap, 0)
+
+    def _copy(self, state, raw, base, upto):
+        """Aggiunge al contenuto del blocco i byte originali fino a upto (assoluto)"""
+        if state['content'] is None:
+            return
+        state['content'] += raw[max(state['copied'] - base, 0):upto - base]
+        state['copied'] = upto
+        if len(state['content']) > MAX_BLOCK_BYTES:
+            # Blocco troppo grande per verificarlo: non chiude la lettura
+            state.update(content=None, found=False)
+
+    def _scan(self, block, state, text, raw, base):
+        end = base + len(text)
+        while True:
+            local = max(state['pos'] - base, 0)
+            if state['state'] == SEARCH:
+                start = text.find(block.opening, local)
+                if start == -1:
+                    # L'apertura potrebbe essere a cavallo del prossimo blocco
+                    state['pos'] = max(end - len(block.opening) + 1, 0)
+                    return None
+                if block.action is None:
+                    body_start = base + start + len(block.opening)
+                    state.update(state=BODY, pos=body_start, found=block.required is None, copied=body_start,
+                                 content=bytearray() if block.validate else None)
+                else:
+                    state['tag'].clear()
+                    state.update(state=TAG, pos=base + start)
+
+            elif state['state'] == TAG:
+                close = text.find(b'>', local)
+                if close == -1:
+                    state['tag'] += text[local:]
+                    state['pos'] = end
+                    if len(state['tag']) > MAX_TAG_BYTES:
+                        state.update(self._reset(end))
+                    return None
+                tag = bytes(state['tag'] + text[local:close])
+                action = ACTION_RE.search(tag)
+                if action and block.action in action.group(1):
+                    state.update(state=BODY, pos=base + close + 1, found=block.required is None, copied=base + close + 1,
+                                 content=bytearray() if block.validate else None)
+                else:
+                    # Un form qualsiasi (ricerca, newsletter): non è il blocco del prodotto
+                    state.update(self._reset(base + close + 1))
+
+            elif state['state'] == BODY:
+                close = text.find(block.closing, local)
+                if not state['found']:
+                    limit = close if close != -1 else len(text)
+                    state['found'] = text.find(block.required, local, limit) != -1
+                if close == -1:
+                    longest = max(len(block.closing), len(block.required or b''))
+                    state['pos'] = max(end - longest + 1, state['pos'])
+                    # La coda può contenere l'inizio della chiusura: resta da copiare
+                    self._copy(state, raw, base, max(state['pos'], state['copied']))
+                    return None
+                self._copy(state, raw, base, base + close)
+                state.update(state=CLOSE, pos=base + close + len(block.closing))
+
+            else:
+                close = text.find(b'>', local)
+                if close == -1:
+                    state['pos'] = end
+                    return None
+                position = base + close
+                if state['found'] and (not block.markers or
+                                       (self.marker_at is not None and self.marker_at < position)):
+                    if block.validate is None or (state['content'] is not None
+                                                  and block.validate(bytes(state['content']))):
+                        return position + 1
+                # Blocco senza il dato richiesto, prima del prodotto o non valido: si cerca il successivo
+                state.update(self._reset(position + 1))
+
+
+def page_limit(domain_config):
+    """Limite di dimensione per un dominio (chiave opzionale 'max_page_bytes')"""
+    return int(domain_config.get('max_page_bytes') or MAX_PAGE_BYTES)
+
+
+def _body_reader(max_bytes, detect):
+    """Restituisce (corpo, stato, funzione che aggiunge un blocco al corpo)
+
+    detect: True per i blocchi di SIGNAL_BLOCKS, False per leggere tutto,
+    oppure i SignalBlock da cercare. Senza segnale si legge tutta la pagina.
+    """
+    body = bytearray()
+    detector = SignalDetector(SIGNAL_BLOCKS if detect is True else detect) if detect else None
+    state = {'done': False, 'truncated': False, 'signal': None}
+
+    def add(chunk):
+        body.extend(chunk)
+        if detector is not None:
+            end = detector.feed(chunk)
+            if end is not None:
+                # Taglio deterministico alla fine del segnale, indipendente dai blocchi
+                del body[end:]
+                state['done'] = True
+                state['signal'] = detector.signal
+                return
+        if len(body) >= max_bytes:
+            del body[max_bytes:]
+            state['done'] = True
+            state['truncated'] = True
+
+    return body, state, add
+
+
+async def read_body_async(response, max_bytes=MAX_PAGE_BYTES, detect=True):
+    """Legge il corpo di una risposta httpx in streaming (asincrona)
+
+    Restituisce (byte letti, troncata per limite di dimensione, blocco che ha
+    fermato la lettura o None); i byte sono il bytearray del download, senza copie.
+    """
+    body, state, add = _body_reader(max_bytes, detect)
+    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+        add(chunk)
+        if state['done']:
+            break
+    return body, state['truncated'], state['signal']
+
+
+def read_body(response, max_bytes=MAX_PAGE_BYTES, detect=True):
+    """Legge il corpo di una risposta httpx in streaming (sincrona)"""
+    body, state, add = _body_reader(max_bytes, detect)
+    for chunk in response.iter_bytes(CHUNK_SIZE):
+        add(chunk)
+        if state['done']:
+            break
+    return body, state['truncated'], state['signal']
+
+
+def decode_body(body, response):
+    """Decodifica il corpo con la codifica dichiarata dal server (default UTF-8)"""
+    try:
+        return body.decode(response.charset_encoding or 'utf-8', errors='replace')
+    except LookupError:
+        return body.decode('utf-8', errors='replace')
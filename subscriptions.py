@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Iscrizioni delle chat ai link monitorati
+Ogni link ha la lista 'subscribers' delle chat che lo seguono; l'indice
+inverso URL -> chat permette di scaricare ogni URL una sola volta per
+controllo e di notificare solo le chat interessate. I link salvati prima
+delle iscrizioni appartengono alla chat di TELEGRAM_CHAT_ID.
+"""
+
+import os
+
+# Chat a cui appartengono i link senza iscrizioni esplicite
+DEFAULT_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')
+
+
+class SubscriptionIndex:
+    """Indice URL -> chat iscritte e chat -> URL (in ordine di iscrizione)"""
+
+    def __init__(self, links, default_chat=DEFAULT_CHAT_ID):
+        self.default_chat = str(default_chat) if default_chat else None
+        self.rebuild(links)
+
+    def rebuild(self, links):
+        self.by_url = {}
+        self.by_chat = {}
+        for url, data in links.items():
+            self.index_link(url, data)
+
+    def index_link(self, url, data):
+        """Aggiunge all'indice un link nuovo con le sue iscrizioni"""
+        for chat_id in self.chats_of(data):
+            self._add(url, chat_id)
+
+    def chats_of(self, data):
+        """Chat iscritte secondo i dati del link"""
+        subscribers = data.get('subscribers')
+        if subscribers is None:
+            return [self.default_chat] if self.default_chat else []
+        return [str(chat_id) for chat_id in subscribers]
+
+    def _add(self, url, chat_id):
+        self.by_url.setdefault(url, set()).add(chat_id)
+        # dict come insieme ordinato: la lista della chat segue l'ordine di iscrizione
+        self.by_chat.setdefault(chat_id, {})[url] = None
+
+    def subscribe(self, url, data, chat_id):
+        """Iscrive la chat al link; False se era già iscritta"""
+        chat_id = str(chat_id)
+        subscribers = self.chats_of(data)
+        if chat_id in subscribers:
+            return False
+        data['subscribers'] = subscribers + [chat_id]
+        self._add(url, chat_id)
+        return True
+
+    def unsubscribe(self, url, data, chat_id):
+        """Rimuove l'iscrizione della chat; restituisce le chat rimaste"""
+        chat_id = str(chat_id)
+        data['subscribers'] = [c for c in self.chats_of(data) if c != chat_id]
+        self.by_url.get(url, set()).discard(chat_id)
+        self.by_chat.get(chat_id, {}).pop(url, None)
+        return data['subscribers']
+
+    def remove_url(self, url):
+        for chat_id in self.by_url.pop(url, ()):
+            self.by_chat.get(chat_id, {}).pop(url, None)
+
+    def is_subscribed(self, url, chat_id):
+        return str(chat_id) in self.by_url.get(url, ())
+
+    def subscribers(self, url):
+        return self.by_url.get(url, set())
+
+    def urls_for(self, chat_id):
+        """URL seguiti da una chat"""
+        return list(self.by_chat.get(str(chat_id), ()))
+
+    def fan_out(self, results):
+        """Raggruppa i risultati per chat iscritta: {chat: [risultati]}"""
+        by_chat = {}
+        for result in results:
+            for chat_id in self.subscribers(result['url']):
+                by_chat.setdefault(chat_id, []).append(result)
+        return by_chat
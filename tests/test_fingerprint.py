@@ -0,0 +1,74 @@
+"""
+Test dell'impronta delle regioni del prodotto con lo stato incorporato
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import json
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from embedded_state import find_blobs, learn_recipe  # noqa: E402
+from fingerprint import region_fingerprint  # noqa: E402
+
+DOMAIN = 'shop.example'
+
+
+def page(in_stock, build='a1'):
+    """Pagina con un form del carrello statico: la disponibilità è solo in __NEXT_DATA__"""
+    state = {
+        'props': {'pageProps': {'product': {
+            'name': 'Matcha Uji', 'inStock': in_stock, 'price': {'amount': '24.90', 'currencyCode': 'EUR'}
+        }}},
+        'buildId': build,
+    }
+    return ('<html><head><title>Matcha Uji</title></head><body><h1 class="product-title">Matcha Uji</h1>'
+            '<span class="price">€ 24,90</span>'
+            '<form action="/cart/add" method="post"><button type="submit">Aggiungi al carrello</button></form>'
+            f'<div class="description">{"Tè coltivato all&#39;ombra, macinato a pietra. " * 20}</div>'
+            f'<script id="__NEXT_DATA__" type="application/json">{json.dumps(state)}</script></body></html>')
+
+
+def recipe():
+    return learn_recipe(find_blobs(page(True)))
+
+
+def test_only_the_state_blob_changes():
+    assert recipe() is not None
+    assert region_fingerprint(page(True), DOMAIN, recipe()) != region_fingerprint(page(False), DOMAIN, recipe())
+
+
+def test_state_outside_the_recipe_path_is_ignored():
+    assert region_fingerprint(page(True, 'a1'), DOMAIN, recipe()) == region_fingerprint(page(True, 'b2'), DOMAIN, recipe())
+
+
+def test_missing_blob_disables_the_shortcut():
+    without_state = page(True).split('<script id="__NEXT_DATA__"')[0]
+    assert region_fingerprint(without_state, DOMAIN, recipe()) is None
+
+
+def test_stock_flip_in_the_blob_is_parsed(tmp_path):
+    from check_engine import CheckEngine
+    from history import HistoryStore
+    from product_monitor import ProductMonitor
+    from storage import SqliteLinkStore
+
+    db = str(tmp_path / 'links.db')
+    monitor = ProductMonitor(SqliteLinkStore(db, import_from=None), HistoryStore(db))
+    try:
+        engine = CheckEngine(monitor)
+        url = f"https://{DOMAIN}/products/uji"
+        engine.state.recipes[DOMAIN] = recipe()
+        validators = {}
+        first = engine.parse_if_changed(url, {'url': url, 'name': 'Uji'}, url, page(True), 200, validators)
+        assert first['in_stock'] is True
+
+        data = {'url': url, 'name': 'Uji', 'in_stock': True, 'fingerprint': validators['fingerprint']}
+        second = engine.parse_if_changed(url, data, url, page(False), 200, {})
+        assert not second.get('fingerprint_match')
+        assert second['in_stock'] is False
+    finally:
+        monitor.close()
@@ -0,0 +1,62 @@
+"""
+Test dello storico condiviso da più processi (history.HistoryStore)
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import history  # noqa: E402
+from history import CheckRecord, HistoryStore, STOCK_NO, STOCK_YES  # noqa: E402
+
+URL = 'https://shop.example/products/uji'
+
+
+def record(ts, in_stock=True):
+    return CheckRecord(ts, STOCK_YES if in_stock else STOCK_NO, 2490, 100, 200, False)
+
+
+def test_two_writers_keep_each_others_records(tmp_path):
+    db = str(tmp_path / 'links.db')
+    bot, runner = HistoryStore(db), HistoryStore(db)
+    try:
+        # Entrambi partono dallo stesso blocco aperto, poi scrivono a turno
+        bot.append(URL, record(1))
+        bot.flush()
+        runner.append(URL, record(2))
+        runner.flush()
+        bot.append(URL, record(3))
+        runner.append(URL, record(4, in_stock=False))
+        bot.flush()
+        runner.flush()
+        bot.append(URL, record(5))
+        bot.flush()
+
+        for store in (bot, runner):
+            records = list(store.records(URL))
+            assert [r.ts for r in records] == [1, 2, 3, 4, 5]
+            assert [r.stock for r in records] == [STOCK_YES, STOCK_YES, STOCK_YES, STOCK_NO, STOCK_YES]
+    finally:
+        bot.close()
+        runner.close()
+
+
+def test_full_chunks_are_sealed_across_writers(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, 'CHUNK_RECORDS', 3)
+    db = str(tmp_path / 'links.db')
+    first, second = HistoryStore(db), HistoryStore(db)
+    try:
+        for ts in range(1, 8):
+            store = first if ts % 2 else second
+            store.append(URL, record(ts))
+            store.flush()
+        assert [r.ts for r in first.records(URL)] == list(range(1, 8))
+        rows = first.conn.execute('SELECT seq, count, compressed FROM history WHERE url = ? ORDER BY seq', (URL,)).fetchall()
+        assert rows == [(0, 3, 1), (1, 3, 1), (2, 1, 0)]
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,180 @@
+"""
+Test delle notifiche contro il finto server di Telegram (tools/fake_telegram.py)
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import sqlite3
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+import notifications  # noqa: E402
+from fake_telegram import serve  # noqa: E402
+from http_pool import HttpPool  # noqa: E402
+from notifications import MESSAGE_LIMIT, NotificationDispatcher, Outbox, split_message  # noqa: E402
+
+CHAT = '42'
+
+
+def change(name, **fields):
+    """Risultato di un controllo con un cambiamento di disponibilità"""
+    result = {
+        'url': f"https://shop.example/products/{name}", 'name': name, 'in_stock': True,
+        'status_changed': True, 'price_changed': False, 'price': None, 'old_price': None,
+    }
+    result.update(fields)
+    return result
+
+
+@pytest.fixture(autouse=True)
+def fast_chats(monkeypatch):
+    # Il limite di 1 messaggio al secondo per chat rallenterebbe i test senza provare nulla
+    monkeypatch.setattr(notifications, 'PER_CHAT_RATE', 1000.0)
+
+
+@pytest.fixture
+def telegram():
+    server, state = serve(port=0, chat_interval=0)
+    yield f"http://127.0.0.1:{server.server_address[1]}", state
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def outbox_db(tmp_path):
+    return str(tmp_path / 'outbox.db')
+
+
+def run_dispatcher(outbox_db, api_url, results_by_chat=None, window=0, messages=None):
+    """Accoda cambiamenti (o messaggi già pronti) e consegna; restituisce i messaggi rimasti"""
+    async def run():
+        pool = HttpPool()
+        dispatcher = NotificationDispatcher('TOKEN', Outbox(outbox_db), window=window, api_url=api_url, pool=pool)
+        try:
+            for chat_id, texts in (messages or {}).items():
+                dispatcher.outbox.add(chat_id, texts)
+            for chat_id, results in (results_by_chat or {}).items():
+                dispatcher.add_results(chat_id, results)
+            return await dispatcher.close()
+        finally:
+            dispatcher.outbox.close()
+            await pool.aclose()
+    return asyncio.run(run())
+
+
+def table_size(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_split_message_prefers_whole_lines():
+    lines = [f"riga {i} " + 'x' * 60 for i in range(200)]
+    parts = split_message('\n'.join(lines))
+    assert len(parts) > 1
+    assert all(len(part) <= MESSAGE_LIMIT for part in parts)
+    assert [line for part in parts for line in part.split('\n')] == lines
+
+
+def test_split_message_cuts_long_lines():
+    parts = split_message('x' * 10000)
+    assert [len(part) for part in parts] == [MESSAGE_LIMIT, MESSAGE_LIMIT, 10000 - 2 * MESSAGE_LIMIT]
+
+
+def test_long_message_is_sent_in_parts(telegram, outbox_db):
+    api_url, state = telegram
+    names = [f"Matcha{i:03d}" + 'x' * 40 for i in range(150)]
+    remaining = run_dispatcher(outbox_db, api_url, {CHAT: [change(name) for name in names]})
+
+    assert remaining == 0
+    assert len(state.messages) > 1
+    assert all(len(message['text']) <= MESSAGE_LIMIT for message in state.messages)
+    text = '\n'.join(message['text'] for message in state.messages)
+    assert all(name in text for name in names)
+    assert table_size(outbox_db, 'outbox') == 0
+
+
+def test_retry_after_is_respected(outbox_db, caplog):
+    server, state = serve(port=0, chat_interval=0.5, retry_after=1)
+    try:
+        api_url = f"http://127.0.0.1:{server.server_address[1]}"
+        started = time.monotonic()
+        with caplog.at_level(logging.WARNING, logger='notifications'):
+            remaining = run_dispatcher(outbox_db, api_url, messages={CHAT: ['uno', 'due']})
+        elapsed = time.monotonic() - started
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert remaining == 0
+    assert [message['text'] for message in state.messages] == ['uno', 'due']
+    assert any('Telegram limita gli invii' in record.message for record in caplog.records)
+    # Il secondo messaggio parte solo dopo il retry_after della risposta 429
+    assert elapsed >= 1
+
+
+def test_invalid_markdown_falls_back_to_plain_text(telegram, outbox_db):
+    api_url, state = telegram
+    remaining = run_dispatcher(outbox_db, api_url, {'1': [change('Matcha_Uji')], '2': [change('Matcha Uji')]})
+
+    assert remaining == 0
+    by_chat = {message['chat']['id']: message for message in state.messages}
+    assert by_chat['1']['parse_mode'] is None
+    assert 'Matcha_Uji' in by_chat['1']['text']
+    assert by_chat['2']['parse_mode'] == 'Markdown'
+
+
+def test_changes_are_coalesced_at_delivery(telegram, outbox_db):
+    api_url, state = telegram
+    first = change('Matcha', status_changed=False, price_changed=True, old_price='10 €', price='12 €')
+    second = dict(first, old_price='12 €', price='15 €')
+    run_dispatcher(outbox_db, api_url, {CHAT: [first, second]})
+
+    assert len(state.messages) == 1
+    assert '10 € → 15 €' in state.messages[0]['text']
+    assert state.messages[0]['text'].count('Matcha') == 1
+
+
+def test_changes_survive_a_crash_before_delivery(telegram, outbox_db):
+    api_url, state = telegram
+
+    async def crash():
+        dispatcher = NotificationDispatcher('TOKEN', Outbox(outbox_db), window=3600, api_url=api_url)
+        dispatcher.add_results(CHAT, [change('Matcha')])
+        # Uscita prima della fine della finestra, senza close()
+        dispatcher.flush_task.cancel()
+        dispatcher.outbox.close()
+    asyncio.run(crash())
+    assert state.messages == []
+    assert table_size(outbox_db, 'outbox_changes') == 1
+
+    remaining = run_dispatcher(outbox_db, api_url)
+    assert remaining == 0
+    assert len(state.messages) == 1
+    assert 'Matcha' in state.messages[0]['text']
+    assert table_size(outbox_db, 'outbox_changes') == 0
+
+
+def test_failed_messages_are_replayed_once(telegram, outbox_db, monkeypatch):
+    api_url, state = telegram
+    monkeypatch.setattr(notifications, 'MAX_ATTEMPTS', 1)
+    state.fail_rate = 1.0
+    assert run_dispatcher(outbox_db, api_url, {CHAT: [change('Matcha')]}) == 1
+    assert state.messages == []
+
+    state.fail_rate = 0.0
+    assert run_dispatcher(outbox_db, api_url) == 0
+    assert len(state.messages) == 1
+    assert run_dispatcher(outbox_db, api_url) == 0
+    assert len(state.messages) == 1
@@ -0,0 +1,54 @@
+"""
+Test della scelta del prezzo attuale e del prezzo pieno (pricing.pick_price)
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from parsers import BACKENDS, parse_page  # noqa: E402
+from pricing import label_prices, pick_price  # noqa: E402
+
+
+def amounts(text, struck_text=None):
+    current, regular = pick_price(label_prices(text, None, struck_text))
+    return (current.amount if current else None), (regular.amount if regular else None)
+
+
+def test_savings_badge_is_not_the_price():
+    assert amounts("Sale price€20,00Regular price€25,00Save €5,00") == (Decimal('20.00'), Decimal('25.00'))
+
+
+def test_unit_price_is_not_the_price():
+    assert amounts("€ 24,90(€ 0,83/g)") == (Decimal('24.90'), None)
+
+
+def test_first_amount_without_labels():
+    # Senza etichette né testo barrato il secondo importo non è un prezzo pieno
+    assert amounts("€ 30,00€ 24,00") == (Decimal('30.00'), None)
+    assert amounts("€ 30,00€ 24,00", struck_text="€ 30,00") == (Decimal('24.00'), Decimal('30.00'))
+
+
+def test_explicit_regular_price_only():
+    assert amounts("Prezzo: 12,50 € invece di 15,00 €") == (Decimal('12.50'), Decimal('15.00'))
+    assert amounts("Regular price€25,00 EURRegular priceSale price€25,00 EUR") == (Decimal('25.00'), None)
+
+
+@pytest.mark.parametrize('backend', sorted(BACKENDS))
+def test_struck_price_in_the_page(backend):
+    pytest.importorskip({'html.parser': 'bs4'}.get(backend, backend))
+    page = parse_page(
+        '<html><body><h1>Matcha</h1><div class="price"><s class="price-item">€25,00</s>'
+        '<span class="price-item">€20,00</span><span class="badge">Save €5,00</span>'
+        '<span class="unit">(€ 0,67/g)</span></div></body></html>',
+        backend=backend
+    )
+    text, struck_text = page.price_texts()
+    assert amounts(text, struck_text) == (Decimal('20.00'), Decimal('25.00'))
@@ -0,0 +1,127 @@
+"""
+Test dell'aggiunta di più link insieme (ProductMonitor.add_links_bulk)
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import http_pool  # noqa: E402
+from check_engine import CheckEngine  # noqa: E402
+from history import HistoryStore  # noqa: E402
+from http_pool import HttpPool  # noqa: E402
+from product_monitor import ProductMonitor  # noqa: E402
+from storage import SqliteLinkStore  # noqa: E402
+
+
+def product_page(in_stock):
+    availability = 'InStock' if in_stock else 'OutOfStock'
+    product = {'@context': 'https://schema.org', '@type': 'Product', 'name': 'Matcha Uji', 'offers': {
+        '@type': 'Offer', 'price': '24.90', 'priceCurrency': 'EUR',
+        'availability': f'https://schema.org/{availability}'}}
+    return (f'<html><head><title>Matcha Uji</title>'
+            f'<script type="application/ld+json">{json.dumps(product)}</script></head>'
+            f'<body><h1>Matcha Uji</h1></body></html>')
+
+
+@pytest.fixture
+def shop():
+    pages = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            body = pages[self.path].encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", pages
+    server.shutdown()
+    server.server_close()
+
+
+def test_bulk_add_keeps_the_initial_state(shop, tmp_path, monkeypatch):
+    base, pages = shop
+    url = f"{base}/products/uji"
+    pages['/products/uji'] = product_page(False)
+    db = str(tmp_path / 'links.db')
+    monitor = ProductMonitor(SqliteLinkStore(db, import_from=None), HistoryStore(db))
+    pool = HttpPool()
+    monkeypatch.setattr(http_pool, '_pool', pool)
+
+    async def add_and_check():
+        try:
+            results = await monitor.add_links_bulk([(url, 'Uji')], chat_id=1)
+            added = SqliteLinkStore(db, import_from=None)
+            try:
+                data = added.load_all()[url]
+            finally:
+                added.close()
+            first = await CheckEngine(monitor, pool=pool).run([url])
+            pages['/products/uji'] = product_page(True)
+            second = await CheckEngine(monitor, pool=pool).run([url])
+            return results, data, first[0], second[0]
+        finally:
+            await pool.aclose()
+    try:
+        results, data, first, second = asyncio.run(add_and_check())
+    finally:
+        monitor.close()
+
+    assert results[0][0] is True
+    assert data['in_stock'] is False
+    assert data['last_status'] == 'unavailable'
+    assert data['platform']
+    # Il primo controllo programmato non è un cambiamento, il ritorno in stock sì
+    assert not first['status_changed']
+    assert second['status_changed'] and second['in_stock'] is True
+
+
+def test_restock_windows_are_learned_off_the_loop(shop, tmp_path):
+    base, pages = shop
+    url = f"{base}/products/uji"
+    pages['/products/uji'] = product_page(True)
+    db = str(tmp_path / 'links.db')
+    monitor = ProductMonitor(SqliteLinkStore(db, import_from=None), HistoryStore(db))
+    monitor.monitored_links[url] = monitor.new_link_data(url, 'Uji', {})
+    monitor.link_ids.add(url)
+    summary = monitor.history.summary
+    threads = []
+
+    def summary_in_thread(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return summary(*args, **kwargs)
+    monitor.history.summary = summary_in_thread
+
+    async def check():
+        pool = HttpPool()
+        try:
+            return await CheckEngine(monitor, pool=pool).run([url])
+        finally:
+            await pool.aclose()
+    try:
+        asyncio.run(check())
+        assert threads and threading.main_thread() not in threads
+        assert monitor.monitored_links[url]['restock_slots'] == {}
+    finally:
+        monitor.close()
@@ -0,0 +1,139 @@
+"""
+Test della lettura a blocchi con fermata anticipata (streaming.py) e del JSON-LD dei ProductGroup
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from extractors import JsonLdExtractor  # noqa: E402
+from streaming import SignalDetector  # noqa: E402
+
+FILLER = '<div class="collection-item"><a href="/products/altro">Aggiungi al carrello</a></div>' * 2500
+
+PRODUCT_GROUP = {
+    '@context': 'https://schema.org', '@type': 'ProductGroup', 'name': 'Matcha Uji',
+    'productGroupID': 'uji',
+    'hasVariant': [
+        {'@type': 'Product', 'name': 'Matcha Uji 30g', 'sku': 'uji-30',
+         'offers': {'@type': 'Offer', 'price': '24.90', 'priceCurrency': 'EUR',
+                    'availability': 'https://schema.org/OutOfStock'}},
+        {'@type': 'Product', 'name': 'Matcha Uji 100g', 'sku': 'uji-100',
+         'offers': {'@type': 'Offer', 'price': '69.00', 'priceCurrency': 'EUR',
+                    'availability': 'https://schema.org/OutOfStock'}},
+    ],
+}
+
+
+def jsonld(data):
+    return f'<script type="application/ld+json">{json.dumps(data)}</script>'
+
+
+def product_group_page():
+    """Pagina di ~200 KB: ProductGroup esaurito nell'head, testi "Aggiungi al carrello" nel resto"""
+    return (f'<!DOCTYPE html><html><head><title>Matcha Uji</title>{jsonld(PRODUCT_GROUP)}</head>'
+            f'<body><h1 class="product-title">Matcha Uji</h1><p>Esaurito</p>{FILLER}</body></html>')
+
+
+def stop_offset(page, chunk_size):
+    detector = SignalDetector()
+    data = page.encode('utf-8')
+    for start in range(0, len(data), chunk_size):
+        end = detector.feed(data[start:start + chunk_size])
+        if end is not None:
+            return end
+    return None
+
+
+def test_product_group_variants_are_read():
+    info = JsonLdExtractor().extract(None, None, product_group_page())
+    assert info['title'] == 'Matcha Uji'
+    assert info['in_stock'] is False
+    assert info['price'] == '€ 24.90'
+    assert [variant['title'] for variant in info['variants']] == ['Matcha Uji 30g', 'Matcha Uji 100g']
+
+
+@pytest.mark.parametrize('chunk_size', [7, 64, 4096, 1 << 20])
+def test_jsonld_without_offer_does_not_stop(chunk_size):
+    # "availability" compare, ma non in un'offerta di un prodotto
+    other = jsonld({'@type': 'WebPage', 'description': 'availability e spedizioni'})
+    product = jsonld({'@type': 'Product', 'name': 'Matcha', 'offers': {
+        'price': '10', 'priceCurrency': 'EUR', 'availability': 'https://schema.org/InStock'}})
+    page = f'<html><head>{other}</head><body>{FILLER[:5000]}{product}{FILLER[:5000]}</body></html>'
+    end = stop_offset(page, chunk_size)
+    assert end is not None
+    assert page.encode('utf-8')[:end].endswith(product.encode('utf-8'))
+
+
+@pytest.mark.parametrize('chunk_size', [7, 4096, 1 << 20])
+def test_product_group_block_stops_with_its_offers(chunk_size):
+    page = product_group_page()
+    end = stop_offset(page, chunk_size)
+    cut = page.encode('utf-8')[:end].decode('utf-8')
+    assert cut.endswith('</script>')
+    assert JsonLdExtractor().extract(None, None, cut)['in_stock'] is False
+
+
+@pytest.fixture
+def shop():
+    pages = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            body = pages[self.path].encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", pages
+    server.shutdown()
+    server.server_close()
+
+
+def test_product_group_page_is_not_a_restock(shop, tmp_path):
+    from check_engine import CheckEngine
+    from history import HistoryStore
+    from http_pool import HttpPool
+    from product_monitor import ProductMonitor
+    from storage import SqliteLinkStore
+
+    base, pages = shop
+    url = f"{base}/products/uji"
+    pages['/products/uji'] = product_group_page()
+    db = str(tmp_path / 'links.db')
+    monitor = ProductMonitor(SqliteLinkStore(db, import_from=None), HistoryStore(db))
+
+    async def check():
+        pool = HttpPool()
+        try:
+            return await CheckEngine(monitor, pool=pool).fetch_all({url: {'url': url, 'name': 'Matcha Uji'}})
+        finally:
+            await pool.aclose()
+    try:
+        info = asyncio.run(check())[url]
+    finally:
+        monitor.close()
+
+    assert not info.get('error')
+    assert info['in_stock'] is False
+    assert info['price'] == '€ 24.90'
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Finto server dell'API di Telegram per provare le notifiche in locale
+
+    python tools/fake_telegram.py --port 8081 --chat-interval 1 --fail-rate 0.1
+    TELEGRAM_API_URL=http://127.0.0.1:8081 python monitor_runner.py
+
+Accetta sendMessage come Telegram: rifiuta i testi oltre 4096 caratteri e
+quelli in Markdown con entità non chiuse (es. un _ in un nome), risponde 429 con retry_after a chi invia troppo spesso nella stessa chat e
+può simulare errori 500 casuali. GET /messages restituisce i messaggi
+ricevuti, DELETE /messages li azzera.
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MESSAGE_LIMIT = 4096
+
+# Delimitatori delle entità del Markdown (vecchio stile) di Telegram
+MARKDOWN_DELIMITERS = '*_`'
+
+
+def unclosed_entity(text):
+    """Posizione della prima entità Markdown non chiusa, None se il testo è valido"""
+    opened = None
+    for i, char in enumerate(text):
+        if opened is None:
+            if char in MARKDOWN_DELIMITERS:
+                opened = (char, i)
+        elif char == opened[0]:
+            opened = None
+    return opened[1] if opened else None
+
+
+class FakeTelegram:
+    """Stato condiviso del server: messaggi ricevuti e ultimo invio per chat"""
+
+    def __init__(self, chat_interval=1.0, fail_rate=0.0, retry_after=1):
+        self.chat_interval = chat_interval
+        self.fail_rate = fail_rate
+        self.retry_after = retry_after
+        self.messages = []
+        self.last_sent = {}
+        self.lock = threading.Lock()
+
+    def send_message(self, params):
+        """(codice HTTP, risposta JSON) per una chiamata a sendMessage"""
+        chat_id = params.get('chat_id')
+        text = params.get('text', '')
+        if not chat_id or not text:
+            return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message text is empty'}
+        if len(text) > MESSAGE_LIMIT:
+            return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message is too long'}
+        if params.get('parse_mode') == 'Markdown':
+            offset = unclosed_entity(text)
+            if offset is not None:
+                return 400, {
+                    'ok': False, 'error_code': 400,
+                    'description': f"Bad Request: can't parse entities: Can't find end of the entity "
+                                   f"starting at byte offset {len(text[:offset].encode('utf-8'))}"
+                }
+        if random.random() < self.fail_rate:
+            return 500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}
+
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_sent.get(chat_id, -self.chat_interval) < self.chat_interval:
+                return 429, {
+                    'ok': False, 'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after}
+                }
+            self.last_sent[chat_id] = now
+            message = {
+                'message_id': len(self.messages) + 1,
+                'chat': {'id': chat_id},
+                'date': int(time.time()),
+                'text': text,
+                'parse_mode': params.get('parse_mode')
+            }
+            self.messages.append(message)
+        return 200, {'ok': True, 'result': message}
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if not self.path.endswith('/sendMessage'):
+                self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+                return
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length).decode('utf-8')
+            if 'application/json' in (self.headers.get('Content-Type') or ''):
+                params = json.loads(raw or '{}')
+            else:
+                params = {key: values[0] for key, values in parse_qs(raw).items()}
+            self._reply(*state.send_message(params))
+
+        def do_GET(self):
+            if self.path == '/messages':
+                with state.lock:
+                    self._reply(200, state.messages)
+            else:
+                self._reply(404, {'ok': False})
+
+        def do_DELETE(self):
+            with state.lock:
+                state.messages = []
+                state.last_sent = {}
+            self._reply(200, {'ok': True})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=8081, chat_interval=1.0, fail_rate=0.0, retry_after=1):
+    """Avvia il server in un thread; restituisce (server, stato)"""
+    state = FakeTelegram(chat_interval, fail_rate, retry_after)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--chat-interval', type=float, default=1.0, help='secondi minimi tra due messaggi nella stessa chat')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='frazione di richieste che rispondono 500')
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    server, state = serve(args.port, args.chat_interval, args.fail_rate, args.retry_after)
+    print(f"Finto Telegram su http://127.0.0.1:{args.port} (Ctrl+C per uscire)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()